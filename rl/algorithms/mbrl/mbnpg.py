@@ -16,7 +16,7 @@ import torch.nn.functional as F
 from rl.algorithms.mbrl.mbrl import MBRL
 from rl.algorithms.mfrl.npg import NPG
 from rl.world_models.fake_world import FakeWorld
-import rl.environments.mbpo.static as mbpo_static
+from rl.environments.static import get_static_fns
 # from rl.data.dataset import RLDataModule
 
 
@@ -132,12 +132,9 @@ class MBNPG(MBRL, NPG):
     def _set_fake_world(self):
         env_name = self.configs['environment']['name']
         device = self._device_
-        if self.configs['environment']['name'][:4] == 'pddm':
-        	static_fns = None
-        else:
-        	static_fns = mbpo_static[env_name[:-3].lower()]
+        self.static_fns = get_static_fns(env_name)
 
-        self.fake_world = FakeWorld(self.world_model)
+        self.fake_world = FakeWorld(self.world_model, env_name)
 
 
     def learn(self):
@@ -360,8 +357,8 @@ class MBNPG(MBRL, NPG):
 
             self.model_buffer.store_batch(O, A, R, D, V, log_Pi)
 
-            O_next = T.Tensor(O_next)
-            D = T.tensor(D, dtype=T.bool)
+            O_next = T.as_tensor(O_next)
+            D = T.as_tensor(D, dtype=T.bool)
             nonD = ~D.squeeze(-1)
             if nonD.sum() == 0:
         	    print(f'[ Epoch {n}   Model Rollout ] Breaking early: {k} | {nonD.sum()} / {nonD.shape}')
@@ -17,7 +17,7 @@ from rl.algorithms.mbrl.mbrl import MBRL
 from rl.algorithms.mfrl.sac import SAC
 from rl.world_models.model import EnsembleDynamicsModel
 from rl.world_models.fake_world import FakeWorld
-import rl.environments.mbpo.static as mbpo_static
+from rl.environments.static import get_static_fns
 # from rl.data.dataset import RLDataModule
 
 
@@ -87,7 +87,11 @@ class MBPO(MBRL, SAC):
         net_arch = self.configs['world_model']['network']['arch']
         self.oq_world_model = EnsembleDynamicsModel(num_ensembles, num_elites,
                                                     self.obs_dim, self.act_dim, 1,
-                                                    net_arch[0], use_decay=True, device=device)
+                                                    net_arch[0], use_decay=True, device=device,
+                                                    max_epochs=self.configs['world_model'].get('max_train_epochs', None),
+                                                    max_time=self.configs['world_model'].get('max_train_time', None),
+                                                    compile=self.configs['world_model'].get('compile', False),
+                                                    precision=self.configs['experiment'].get('precision', 'fp32'))
 
 
     ## FakeEnv
@@ -95,13 +99,13 @@ class MBPO(MBRL, SAC):
         self._set_oq_world_model()
         env_name = self.configs['environment']['name']
         device = self._device_
-        if self.configs['environment']['name'][:4] == 'pddm':
-        	static_fns = None
-        else:
-        	static_fns = mbpo_static[env_name[:-3].lower()]
+        self.static_fns = get_static_fns(env_name)
 
         # self.fake_world = FakeWorld(self.world_model, static_fns, env_name, self.learn_env, self.configs, device)
-        self.fake_world = FakeWorld(self.oq_world_model)
+        self.fake_world = FakeWorld(self.oq_world_model, env_name,
+                                    incremental=self.configs['world_model'].get('incremental_training', False),
+                                    refresh_epochs=self.configs['world_model'].get('refresh_epochs', 5),
+                                    reservoir_size=int(self.configs['world_model'].get('reservoir_size', 5e4)))
 
 
     def learn(self):
@@ -162,33 +166,45 @@ class MBPO(MBRL, SAC):
             learn_start_real = time.time()
             while nt < NT: # full epoch
                 # Interaction steps
-                for e in range(1, E+1):
-                    o, Z, el, t = self.internact(n, o, Z, el, t)
-                    # print('Return: ', Z)
-
-                    if el > 0:
-                        currZ = Z
-                        AvgZ = (sum(ZList)+currZ)/(len(ZList))
-                        currEL = el
-                        AvgEL = (sum(elList)+currEL)/(len(elList))
-                    else:
-                        lastZ = currZ
-                        ZList.append(lastZ)
-                        AvgZ = sum(ZList)/(len(ZList)-1)
-                        lastEL = currEL
-                        elList.append(lastEL)
-                        AvgEL = sum(elList)/(len(elList)-1)
-
-                    # print(f'[ Epoch {n}   Interaction ] Env Steps: {e} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)}'+(" "*10), end='\r')
+                with self.profiler.phase('interaction'):
+                    t0 = t
+                    for e in range(1, E+1, self.num_envs):
+                        if self.num_envs > 1:
+                            o, Z, el, t, ZDone, elDone = self.internact_vec(n, o, Z, el, t)
+                            ZList += ZDone
+                            elList += elDone
+                            AvgZ, AvgEL = np.mean(ZList[1:] or Z), np.mean(elList[1:] or el)
+                            continue
+                        o, Z, el, t = self.internact(n, o, Z, el, t)
+                        # print('Return: ', Z)
+
+                        if el > 0:
+                            currZ = Z
+                            AvgZ = (sum(ZList)+currZ)/(len(ZList))
+                            currEL = el
+                            AvgEL = (sum(elList)+currEL)/(len(elList))
+                        else:
+                            lastZ = currZ
+                            ZList.append(lastZ)
+                            AvgZ = sum(ZList)/(len(ZList)-1)
+                            lastEL = currEL
+                            elList.append(lastEL)
+                            AvgEL = sum(elList)/(len(elList)-1)
+
+                        # print(f'[ Epoch {n}   Interaction ] Env Steps: {e} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)}'+(" "*10), end='\r')
+
+                    Et = t - t0 # Transitions stored: E rounded up to whole vec steps (num_envs each)
+                    self.profiler.count(Et)
+                G_Et = GSAC * Et // E # GSAC per E transitions (same update-to-data ratio for any num_envs)
 
                 # Taking gradient steps after exploration
                 if n > Ni:
-                    if nt % model_train_frequency == 0:
+                    if (min(nt+Et, NT)-1) // model_train_frequency > (nt-1) // model_train_frequency: # A multiple of it in [nt, nt+Et), this epoch
                         #03. Train model pθ on Denv via maximum likelihood
                         # PyTorch Lightning Model Training
                         print(f'\n[ Epoch {n} | Training World Model ]'+(' '*50))
 
-                        ho_mean = self.fake_world.train_fake_world(self.buffer)
+                        with self.profiler.phase('world_model'): ho_mean = self.fake_world.train_fake_world(self.buffer)
 
                         # model_fit_bs = min(self.configs['data']['buffer_size'], self.buffer.size)
                         # model_fit_batch = self.buffer.sample_batch(model_fit_bs, self._device_)
@@ -214,28 +230,29 @@ class MBPO(MBRL, SAC):
                         self.reallocate_oq_model_buffer(n)
 
                         # Generate M k-steps imaginary rollouts for SAC traingin
-                        self.rollout_oq_world_model(n) # GCP-E
+                        with self.profiler.phase('rollout'): self.rollout_oq_world_model(n) # GCP-E
                         # ZListImag, elListImag = self.rollout_oq_world_modelII(n) # Mac/GCP-B
 
                     # JQList, JPiList = [], []
                     # AlphaList = [self.alpha]*G_sac
-                    for g in range(1, GSAC+1): # it was "for g in (1, G_sac+1):" for 2 months, and I did't notice!! ;(
-                        # print(f'Actor-Critic Grads...{g}', end='\r')
-                        print(f'[ Epoch {n} | Training AC ] Env Steps: {nt+1} | AC Grads: {g}/{GSAC} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)} | x{round(AvgZ/AvgEL, 2)}'+(" "*10), end='\r')
-                        ## Sample a batch B_sac
-                        B_sac = self.sac_batch()
-                        ## Train networks using batch B_sac
-                        Jq, Jalpha, Jpi, PiInfo = self.trainAC(g, B_sac, oldJs)
-                        # Jq, Jalpha, Jpi = self.trainAC(g, B_sac, oldJs)
-                        oldJs = [Jq, Jalpha, Jpi]
-                        JQList.append(Jq)
-                        JPiList.append(Jpi)
-                        HList.append(PiInfo['entropy'])
-                        if self.configs['actor']['automatic_entropy']:
-                            JAlphaList.append(Jalpha.item())
-                            AlphaList.append(self.alpha)
-
-                nt += E
+                    with self.profiler.phase('ac_training', steps=G_Et):
+                        for g in range(1, G_Et+1): # it was "for g in (1, G_sac+1):" for 2 months, and I did't notice!! ;(
+                            # print(f'Actor-Critic Grads...{g}', end='\r')
+                            print(f'[ Epoch {n} | Training AC ] Env Steps: {nt+1} | AC Grads: {g}/{G_Et} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)} | x{round(AvgZ/AvgEL, 2)}'+(" "*10), end='\r')
+                            ## Sample a batch B_sac
+                            B_sac = self.sac_batch()
+                            ## Train networks using batch B_sac
+                            Jq, Jalpha, Jpi, PiInfo = self.trainAC(g, B_sac, oldJs)
+                            # Jq, Jalpha, Jpi = self.trainAC(g, B_sac, oldJs)
+                            oldJs = [Jq, Jalpha, Jpi]
+                            JQList.append(Jq)
+                            JPiList.append(Jpi)
+                            HList.append(PiInfo['entropy'])
+                            if self.configs['actor']['automatic_entropy']:
+                                JAlphaList.append(Jalpha.item())
+                                AlphaList.append(self.alpha)
+
+                nt += Et
 
             print('\n')
             # logs['time/training                  '] = time.time() - learn_start_real
@@ -244,6 +261,9 @@ class MBPO(MBRL, SAC):
             # logs['training/wm/Jtrain             '] = np.mean(JTrainList)
             # logs['training/wm/Jval                    '] = ho_mean
             logs['training/wm/Jval                    '] = np.mean(JValList)
+            logs['training/wm/epochs                  '] = self.oq_world_model.train_info['epochs']
+            logs['time/wm_training                    '] = self.oq_world_model.train_info['time']
+            logs['data/wm_train_size                  '] = self.oq_world_model.train_info['num_data']
             # logs['training/wm/test_mse           '] = np.mean(LossTestList)
 
             logs['training/sac/critic/Jq              '] = np.mean(JQList)
@@ -272,7 +292,7 @@ class MBPO(MBRL, SAC):
             # logs['learning/imag/rollout_length        '] = np.mean(elListImag[1:])
 
             eval_start_real = time.time()
-            EZ, ES, EL = self.evaluate()
+            with self.profiler.phase('evaluation'): EZ, ES, EL = self.evaluate()
 
             # logs['time/evaluation                '] = time.time() - eval_start_real
 
@@ -285,7 +305,12 @@ class MBPO(MBRL, SAC):
             logs['evaluation/episodic_length_mean     '] = np.mean(EL)
             logs['evaluation/return_to_length         '] = np.mean(EZ)/np.mean(EL)
             logs['evaluation/return_to_full_length    '] = (np.mean(EZ)/1000)
+            logs.update(self.evaluator.logs())
 
+            logs.update(self.profiler.logs())
+            self.profiler.save_trace()
+            self.buffer.flush() # storage='memmap': pointers to meta.json
+            if hasattr(self, 'model_repl_buffer'): self.model_repl_buffer.flush()
             logs['time/total                          '] = time.time() - start_time_real
 
             # if n > (N - 50):
@@ -339,20 +364,24 @@ class MBPO(MBRL, SAC):
         print(f'[ Epoch {n}   Model Rollout ] Batch Size: {batch_size} | Rollout Length: {K}'+(' '*50))
         B_ro = self.buffer.sample_batch(batch_size) # Torch
         O = B_ro['observations']
+        # Particle propagation: TS1 (a new elite per row every step) | TSinf (an elite per row for the rollout)
+        TSinf = self.configs['world_model'].get('propagation', 'TS1') == 'TSinf'
+        members = self.fake_world.sample_members(len(O)) if TSinf else None
 
     	# 08. Perform k-step model rollout starting from st using policy πφ; add to Dmodel
         for k in range(1, K+1):
             A = self.actor_critic.get_action(O) # Stochastic action | No reparameterization
 
-            O_next, R, D, _ = self.fake_world.step(O, A) # ip: Tensor, op: Tensor
+            O_next, R, D, _ = self.fake_world.step(O, A, members=members) # ip: Tensor, op: Tensor
             # print('O_next: ', O_next)
             # O_next, R, D, _ = self.fake_world.step_np(O, A) # ip: Tensor, op: Numpy
 
             # self.model_repl_buffer.store_batch(O.numpy(), A, R, O_next, D) # ip: Numpy
             self.model_repl_buffer.store_batch(O, A, R, O_next, D) # ip: Tensor
+            self.profiler.count(len(O))
 
-            O_next = T.Tensor(O_next)
-            D = T.tensor(D, dtype=T.bool)
+            O_next = T.as_tensor(O_next)
+            D = T.as_tensor(D, dtype=T.bool)
             # nonD = ~D
             nonD = ~D.squeeze(-1)
 
@@ -361,6 +390,7 @@ class MBPO(MBRL, SAC):
                 break
 
             O = O_next[nonD]
+            if TSinf: members = members[nonD.to(members.device)]
 
         # return ZListImag, elListImag
 
@@ -388,13 +418,12 @@ class MBPO(MBRL, SAC):
                 # O_next, R, D, _ = self.fake_world.step(O, A) # ip: Tensor, op: Tensor
                 O_next = model.forward(O, A).detach() # ip: Tensor, op: Tensor
                 R = model.reward(O, A).detach()
-                D = self._termination_fn("Hopper-v2", O, A, O_next)
-                D = T.tensor(D, dtype=T.bool)
+                D = self.static_fns.termination_fn(O, A, O_next)
 
                 # self.model_repl_buffer.store_batch(O.numpy(), A, R, O_next, D) # ip: Numpy
                 self.model_repl_buffer.store_batch(O, A, R, O_next, D) # ip: Tensor
 
-                O_next = T.Tensor(O_next)
+                O_next = T.as_tensor(O_next)
                 nonD = ~D.squeeze(-1)
 
                 if nonD.sum() == 0:
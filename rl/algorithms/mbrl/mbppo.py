@@ -16,7 +16,7 @@ import torch.nn.functional as F
 from rl.algorithms.mbrl.mbrl import MBRL
 from rl.algorithms.mfrl.ppo import PPO
 from rl.dynamics.world_model import WorldModel
-import rl.environments.mbpo.static as mbpo_static
+from rl.environments.static import get_static_fns
 # from rl.data.dataset import RLDataModule
 
 
@@ -142,6 +142,7 @@ class MBPPO(MBRL, PPO):
         net_arch = self.configs['world_model']['network']['arch']
 
         self.models = [ WorldModel(self.obs_dim, self.act_dim, seed=0+m, device=device) for m in range(num_ensembles) ]
+        self.static_fns = get_static_fns(self.configs['environment']['name'])
 
 
     def learn(self):
@@ -153,6 +154,7 @@ class MBPPO(MBRL, PPO):
         E = self.configs['algorithm']['learning']['env_steps']
         G_AC = self.configs['algorithm']['learning']['grad_AC_steps']
         G_PPO = self.configs['algorithm']['learning']['grad_PPO_steps']
+        mini_batch_size = self.configs['data'].get('mini_batch_size', None) # None: full model buffer
         max_dev = self.configs['actor']['max_dev']
 
         global_step = 0
@@ -194,25 +196,26 @@ class MBPPO(MBRL, PPO):
             learn_start_real = time.time()
             while nt < NT: # full epoch
                 # Interaction steps
-                for e in range(1, E+1):
-                    # o, Z, el, t = self.internact(n, o, Z, el, t)
-                    o, Z, el, t = self.internact_opB(n, o, Z, el, t, return_pre_pi=False)
-                    # o, Z, el, t = self.internactII(n, o, Z, el, t)
-
-                    if el > 0:
-                        currZ = Z
-                        AvgZ = (sum(ZList)+currZ)/(len(ZList))
-                        currEL = el
-                        AvgEL = (sum(elList)+currEL)/(len(elList))
-                    else:
-                        lastZ = currZ
-                        ZList.append(lastZ)
-                        AvgZ = sum(ZList)/(len(ZList)-1)
-                        lastEL = currEL
-                        elList.append(lastEL)
-                        AvgEL = sum(elList)/(len(elList)-1)
-
-                    print(f'[ Epoch {n}   Interaction ] Env Steps: {e} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)}'+(" "*10), end='\r')
+                with self.profiler.phase('interaction', steps=E):
+                    for e in range(1, E+1):
+                        # o, Z, el, t = self.internact(n, o, Z, el, t)
+                        o, Z, el, t = self.internact_opB(n, o, Z, el, t, return_pre_pi=False)
+                        # o, Z, el, t = self.internactII(n, o, Z, el, t)
+
+                        if el > 0:
+                            currZ = Z
+                            AvgZ = (sum(ZList)+currZ)/(len(ZList))
+                            currEL = el
+                            AvgEL = (sum(elList)+currEL)/(len(elList))
+                        else:
+                            lastZ = currZ
+                            ZList.append(lastZ)
+                            AvgZ = sum(ZList)/(len(ZList)-1)
+                            lastEL = currEL
+                            elList.append(lastEL)
+                            AvgEL = sum(elList)/(len(elList)-1)
+
+                        print(f'[ Epoch {n}   Interaction ] Env Steps: {e} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)}'+(" "*10), end='\r')
                 with T.no_grad(): v = self.actor_critic.get_v(T.Tensor(o)).cpu()
                 # self.buffer.traj_tail(d, v, el)
                 self.buffer.finish_path(el, v)
@@ -225,24 +228,25 @@ class MBPPO(MBRL, PPO):
 
                     # ho_mean = self.fake_world.train_fake_world(self.buffer)
 
-                    model_fit_bs = min(self.configs['data']['buffer_size'], self.buffer.total_size())
-                    model_fit_batch = self.buffer.sample_batch(batch_size=model_fit_bs, device=self._device_)
-                    s, _, a, sp, r, _, _, _, _, _ = model_fit_batch.values()
-                    if n == Ni+1:
-                        samples_to_collect = min((Ni+1)*1000, self.buffer.total_size())
-                    else:
-                        samples_to_collect = 1000
-
-                    LossGen = []
-                    for i, model in enumerate(self.models):
-                        # print(f'\n[ Epoch {n}   Training World Model {i+1} ]'+(' '*50))
-                        loss_general = model.compute_loss(s[-samples_to_collect:],
-                                                          a[-samples_to_collect:],
-                                                          sp[-samples_to_collect:]) # generalization error
-                        dynamics_loss = model.fit_dynamics(s, a, sp, fit_mb_size=200, fit_epochs=25)
-                        reward_loss = model.fit_reward(s, a, r.reshape(-1, 1), fit_mb_size=200, fit_epochs=25)
-                    LossGen.append(loss_general)
-                    ho_mean = np.mean(LossGen)
+                    with self.profiler.phase('world_model'):
+                        model_fit_bs = min(self.configs['data']['buffer_size'], self.buffer.total_size())
+                        model_fit_batch = self.buffer.sample_batch(batch_size=model_fit_bs, device=self._device_)
+                        s, _, a, sp, r, _, _, _, _, _ = model_fit_batch.values()
+                        if n == Ni+1:
+                            samples_to_collect = min((Ni+1)*1000, self.buffer.total_size())
+                        else:
+                            samples_to_collect = 1000
+
+                        LossGen = []
+                        for i, model in enumerate(self.models):
+                            # print(f'\n[ Epoch {n}   Training World Model {i+1} ]'+(' '*50))
+                            loss_general = model.compute_loss(s[-samples_to_collect:],
+                                                              a[-samples_to_collect:],
+                                                              sp[-samples_to_collect:]) # generalization error
+                            dynamics_loss = model.fit_dynamics(s, a, sp, fit_mb_size=200, fit_epochs=25)
+                            reward_loss = model.fit_reward(s, a, r.reshape(-1, 1), fit_mb_size=200, fit_epochs=25)
+                        LossGen.append(loss_general)
+                        ho_mean = np.mean(LossGen)
 
                     # self.init_model_traj_buffer()
 
@@ -295,30 +299,32 @@ class MBPPO(MBRL, PPO):
                         # # Generate M k-steps imaginary rollouts for PPO training
                         # k_avg, ZListImag, elListImag = self.rollout_real_world(g, n)
                         # k_avg = self.rollout_real_world_trajectories(g, n)
-                        ZListImag, elListImag = self.rollout_world_model_trajectories(g, n)
+                        with self.profiler.phase('rollout'):
+                            ZListImag, elListImag = self.rollout_world_model_trajectories(g, n)
+                            self.profiler.count(self.rollout_info['transitions'])
                         # ZListImag, elListImag = self.rollout_world_model_trajectories_q(g, n)
-                        ppo_batch_size = int(self.model_traj_buffer.total_size())
                         # batch_size = 10000 #min(int(self.model_traj_buffer.total_size()), 10000)
                         stop_pi = False
                         kl = 0
                         dev = 0
                         # G_PPO = int(110 - g*5)
                         # print(f'\n\n[ Epoch {n}   Training Actor-Critic ({g}/{G}) ] Model Buffer: Size={self.model_traj_buffer.total_size()} | AvgK={self.model_traj_buffer.average_horizon()}'+(" "*25)+'\n')
-                        for gg in range(1, G_PPO+1): # 101
-                            # print(f'[ Epoch {n} ] AC: {g}/{G_AC} | ac: {gg}/{G_PPO} || stopPG={stop_pi} | KL={round(kl, 4)}'+(' '*50), end='\r')
-                            print(f"[ Epoch {n} | Training AC ] AC: {g}/{G_AC} | ac: {gg}/{G_PPO} || stopPG={stop_pi} | Dev={round(dev, 4)}"+(" "*30), end='\r')
-                            batch = self.model_traj_buffer.sample_batch(batch_size=ppo_batch_size, device=self._device_)
-                            Jv, Jpi, kl, PiInfo = self.trainAC(g, batch, oldJs)
-                            oldJs = [Jv, Jpi]
-                            JVList.append(Jv)
-                            JPiList.append(Jpi)
-                            KLList.append(kl)
-                            HList.append(PiInfo['entropy'])
-                            DevList.append(PiInfo['deviation'])
-                            dev = PiInfo['deviation']
-                            if not self.stop_pi:
-                                ppo_grads += 1
-                            stop_pi = PiInfo['stop_pi']
+                        with self.profiler.phase('ac_training'):
+                            for gg, batch in self.model_traj_buffer.minibatches(mini_batch_size, G_PPO, device=self._device_): # G_PPO epochs
+                                # print(f'[ Epoch {n} ] AC: {g}/{G_AC} | ac: {gg}/{G_PPO} || stopPG={stop_pi} | KL={round(kl, 4)}'+(' '*50), end='\r')
+                                print(f"[ Epoch {n} | Training AC ] AC: {g}/{G_AC} | ac: {gg}/{G_PPO} || stopPG={stop_pi} | Dev={round(dev, 4)}"+(" "*30), end='\r')
+                                self.profiler.count()
+                                Jv, Jpi, kl, PiInfo = self.trainAC(g, batch, oldJs)
+                                oldJs = [Jv, Jpi]
+                                JVList.append(Jv)
+                                JPiList.append(Jpi)
+                                KLList.append(kl)
+                                HList.append(PiInfo['entropy'])
+                                DevList.append(PiInfo['deviation'])
+                                dev = PiInfo['deviation']
+                                if not self.stop_pi:
+                                    ppo_grads += 1
+                                stop_pi = PiInfo['stop_pi']
 
                         # ac_grads += 1
                         # if (np.std(ZListImag[1:]) > (np.mean(ZListImag[1:])/3)) and (np.std(ZListImag[1:])>100):
@@ -358,6 +364,7 @@ class MBPPO(MBRL, PPO):
             if hasattr(self, 'model_traj_buffer'):
                 # logs['data/init_obs                       '] = 0. #len(self.buffer.init_obs)
                 logs['data/model_buffer_size              '] = self.model_traj_buffer.total_size()
+                logs['data/imag_transitions_per_sec       '] = self.rollout_info['throughput'] if hasattr(self, 'rollout_info') else 0.
                 # logs['data/model_rollout_steps            '] = self.model_traj_buffer.average_horizon()
             else:
                 # logs['data/gae_lambda                '] = self.buffer.gae_lambda
@@ -378,7 +385,7 @@ class MBPPO(MBRL, PPO):
 
             eval_start_real = time.time()
             print('\n[ Evaluation ]')
-            EZ, ES, EL = self.evaluate()
+            with self.profiler.phase('evaluation'): EZ, ES, EL = self.evaluate()
             # EZ, ES, EL = self.evaluateII()
             # EZ, ES, EL = self.evaluate_op()
 
@@ -393,7 +400,10 @@ class MBPPO(MBRL, PPO):
             logs['evaluation/episodic_length_mean     '] = np.mean(EL)
             logs['evaluation/return_to_length         '] = np.mean(EZ)/np.mean(EL)
             logs['evaluation/return_to_full_length    '] = (np.mean(EZ)/1000)
+            logs.update(self.evaluator.logs())
 
+            logs.update(self.profiler.logs())
+            self.profiler.save_trace()
             logs['time/total                          '] = time.time() - start_time_real
 
             # if n > (N - 50):
@@ -615,8 +625,8 @@ class MBPPO(MBRL, PPO):
 
             self.model_traj_buffer.store_batch(O, A, R, O_next, V, Log_Pi, k) # ip: Tensor
 
-            # O_next = T.Tensor(O_next)
-            D = T.tensor(D, dtype=T.bool)
+            # O_next = T.as_tensor(O_next)
+            D = T.as_tensor(D, dtype=T.bool)
             nonD = ~D.squeeze(-1)
 
             ZZ[nonD] += R[nonD]
@@ -640,173 +650,73 @@ class MBPPO(MBRL, PPO):
 
 
     def rollout_world_model_trajectories(self, g, n):
-    	# 07. Sample st uniformly from Denv
-    	device = self._device_
-    	Nτ = self.configs['data']['init_obs_size']
-    	K = 1000
-
-    	O = O_init = self.buffer.sample_init_obs_batch(Nτ)
-    	O_Nτ = len(O_init)
-
-        # 08. Perform k-step model rollout starting from st using policy πφ; add to Dmodel
-    	k_end_total = 0
-    	ZList, elList = [0], [0]
-    	AvgZ, AvgEL = 0, 0
-
-    	for nτ, oi in enumerate(O_init): # Generate trajectories
-            for m, model in enumerate(self.models):
-                o, Z, el = oi, 0, 0
-                for k in range(1, K+1): # Generate rollouts
-                    print(f'[ Epoch {n} | AC {g} ] Model Rollout: nτ = {nτ+1} | M = {m+1}/{len(self.models)} | k = {k}/{K} | Buffer = {self.model_traj_buffer.total_size()} | AvgZ={round(AvgZ, 2)} | AvgEL={round(AvgEL, 2)}', end='\r')
-                    # print('\no: ', o)
-                    # print(f'[ Epoch {n} ] AC Training Grads: {g} || Model Rollout: nτ = {nτ} | k = {k} | Buffer size = {self.model_traj_buffer.total_size()}'+(' '*10))
-                    with T.no_grad(): pre_a, a, log_pi, _, v = self.actor_critic.get_a_and_v(o, on_policy=True, return_pre_pi=True)
-
-                    # o_next = model.forward(o, a).detach() # ip: Tensor, op: Tensor
-                    # # print('o_next: ', o_next)
-                    # r = model.reward(o, a).detach()
-                    # d = self._termination_fn("Hopper-v2", o, a, o_next)
-                    # d = T.tensor(d, dtype=T.bool)
-
-                    o_next = model.forward(o, a).detach().cpu() # ip: Tensor, op: Tensor
-                    r = model.reward(o, a).detach()
-                    d = self._termination_fn("Hopper-v2", o, a, o_next)
-                    d = T.tensor(d, dtype=T.bool)
-
-                    Z += float(r)
-                    el += 1
-                    # print('r: ', r)
-                    self.model_traj_buffer.store(o, pre_a, a, r, o_next, v, log_pi, el)
-                    o = o_next
-
-                    currZ = Z
-                    AvgZ = (sum(ZList)+currZ)/(len(ZList))
-                    currEL = el
-                    AvgEL = (sum(elList)+currEL)/(len(elList))
-
-                    if d or (el == K):
-                        break
+        # 07. Sample st uniformly from Denv
+        Nτ = self.configs['data']['init_obs_size']
+        Nb = self.configs['data'].get('rollout_batch_size', 50) # initial states rolled out together
+        K = self.model_traj_buffer.horizon
+        M = len(self.models)
+        budget = self.configs['data']['ov_model_buffer_size']
+
+        O_init = self.buffer.sample_init_obs_batch(Nτ)
+
+        # 08. Perform k-step model rollouts from Nb initial states x M models at once: one
+        #     actor call and one call per model per step, finished trajectories are masked
+        #     out and the running ones are staged, then stored in bulk (finish_path_batch)
+        #     When the budget (ov_model_buffer_size) has no room for one more step of the
+        #     running trajectories they are cut there (bootstrapped as at K) and the rollout stops
+        ZList, elList = [0], [0]
+        num_steps, rollout_start = 0, time.time()
+
+        full = False
+        for b in range(0, len(O_init), Nb):
+            O = O_init[b:b+Nb].repeat(M, 1) # row i is rolled out by model i // Nb
+            B = len(O)
+            member = T.arange(M).repeat_interleave(B // M)
+            alive = T.arange(B)
+            Z, EL = T.zeros((B, 1), dtype=T.float32), T.zeros(B, dtype=T.long)
+
+            for k in range(1, K+1):
+                print(f'[ Epoch {n} | AC {g} ] Model Rollout: nτ = {b+1}-{b+B//M}/{len(O_init)} | k = {k}/{K} | Alive = {len(alive)}/{B} | Buffer = {self.model_traj_buffer.total_size()}'+(' '*10), end='\r')
+                o = O[alive]
+                with T.no_grad():
+                    pre_a, a, log_pi, _, v = self.actor_critic.get_a_and_v(o, on_policy=True, return_pre_pi=True)
+                    o_next, r = T.empty_like(o), T.empty((len(o), 1), dtype=T.float32)
+                    for m, model in enumerate(self.models):
+                        i = member[alive] == m
+                        if not i.any(): continue
+                        o_next[i] = model.forward(o[i], a[i]).cpu() # ip: Tensor, op: Tensor
+                        r[i] = model.reward(o[i], a[i], o_next[i]).cpu()
+                d = self.static_fns.termination_fn(o, a, o_next)[:, 0]
+
+                self.model_traj_buffer.store_batch(o, a, r, o_next, v, log_pi, k, Pre_A=pre_a,
+                                                   rows=None if k == 1 else alive)
+                Z[alive] += r
+                EL[alive] += 1
+                O[alive] = o_next
+                num_steps += len(alive)
+
+                alive = alive[~d]
+                if len(alive) == 0: break
+                if self.model_traj_buffer.total_size() + int(EL.sum()) + len(alive) > budget: # No room for step k+1
+                    full = True
+                    break
 
-                if el == K:
-                    with T.no_grad(): v = self.actor_critic.get_v(T.Tensor(o)).cpu()
-                else:
-                    v = T.Tensor([0.0])
-                self.model_traj_buffer.finish_path(el, v)
+            V = T.zeros((B, 1), dtype=T.float32) # 0 for terminated trajectories
+            if len(alive) > 0: # cut at K (or the budget): bootstrap
+                with T.no_grad(): V[alive] = self.actor_critic.get_v(O[alive]).cpu()
+            self.model_traj_buffer.finish_path_batch(EL, V)
 
-                k_end_total += k
+            ZList += Z[:, 0].tolist()
+            elList += EL.tolist()
 
-                lastZ = currZ
-                ZList.append(lastZ)
-                AvgZ = sum(ZList)/(len(ZList)-1)
-                lastEL = currEL
-                elList.append(lastEL)
-                AvgEL = sum(elList)/(len(elList)-1)
-
-            if self.model_traj_buffer.total_size() >= self.configs['data']['ov_model_buffer_size']:
-                # print(f'[ Epoch {n} | AC {g} ] Breaking img rollouts at nτ={nτ+1}/m={m+1} | Buffer = {self.model_traj_buffer.total_size()} | Z={round(np.mean(ZList[1:]), 2)}±{round(np.std(ZList[1:]), 2)} | EL={round(np.mean(elList[1:]), 2)}±{round(np.std(elList[1:]), 2)} | x{round(np.mean(ZList[1:])/np.mean(elList[1:]), 2)}'+(' ')*40)
+            if full or self.model_traj_buffer.total_size() >= budget:
                 break
-    	print(f'[ Epoch {n} | AC {g} ] RollBuffer={self.model_traj_buffer.total_size()} | Z={round(np.mean(ZList[1:]), 2)}±{round(np.std(ZList[1:]), 2)} | L={round(np.mean(elList[1:]), 2)}±{round(np.std(elList[1:]), 2)} | x{round(np.mean(ZList[1:])/np.mean(elList[1:]), 2)}'+(' ')*35)
-
-    	# EZ, ES, EL = self.evaluate()
-        #
-    	# print(color.RED+f'[ Epoch {n} | AC {g} ] Inner Evaluation | Z={round(np.mean(EZ), 2)}±{round(np.std(EZ), 2)} | L={round(np.mean(EL), 2)}±{round(np.std(EL), 2)} | x{round(np.mean(EZ)/np.mean(EL), 2)}'+color.END+(' ')*40+'\n')
-
-    	return ZList, elList
-
-
-
-
-    def _reward_fn(self, env_name, obs, act):
-        next_obs = next_obs.numpy()
-        if len(obs.shape) == 1 and len(act.shape) == 1:
-            obs = obs[None]
-            act = act[None]
-            return_single = True
-        elif len(obs.shape) == 1:
-            obs = obs[None]
-            return_single = True
-        else:
-            return_single = False
-
-        next_obs = next_obs.cpu().numpy()
-
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(act.shape) == 2
-            vel_x = obs[:, -6] / 0.02
-            power = np.square(act).sum(axis=-1)
-            height = obs[:, 0]
-            ang = obs[:, 1]
-            alive_bonus = 1.0 * (height > 0.7) * (np.abs(ang) <= 0.2)
-            rewards = vel_x + alive_bonus - 1e-3*power
-
-            return rewards
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-            pass
-        elif 'walker_' in env_name:
-            pass
-
-
-    def _termination_fn(self, env_name, obs, act, next_obs):
-        if len(obs.shape) == 1 and len(act.shape) == 1:
-            obs = obs[None]
-            act = act[None]
-            next_obs = next_obs[None]
-            return_single = True
-        elif len(obs.shape) == 1:
-            obs = obs[None]
-            next_obs = next_obs[None]
-            return_single = True
-        else:
-            return_single = False
-
-        next_obs = next_obs.cpu().numpy()
-
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = np.isfinite(next_obs).all(axis=-1) \
-                       * np.abs(next_obs[:, 1:] < 100).all(axis=-1) \
-                       * (height > .7) \
-                       * (np.abs(angle) < .2)
-
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = (height > 0.8) \
-                       * (height < 2.0) \
-                       * (angle > -1.0) \
-                       * (angle < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif 'walker_' in env_name:
-            torso_height =  next_obs[:, -2]
-            torso_ang = next_obs[:, -1]
-            if 'walker_7' in env_name or 'walker_5' in env_name:
-                offset = 0.
-            else:
-                offset = 0.26
-            not_done = (torso_height > 0.8 - offset) \
-                       * (torso_height < 2.0 - offset) \
-                       * (torso_ang > -1.0) \
-                       * (torso_ang < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
-
-
-
-
 
+        rollout_time = time.time() - rollout_start
+        self.rollout_info = {'transitions': num_steps, 'time': rollout_time, 'throughput': num_steps / rollout_time}
+        print(f'[ Epoch {n} | AC {g} ] RollBuffer={self.model_traj_buffer.total_size()} | Z={round(np.mean(ZList[1:]), 2)}±{round(np.std(ZList[1:]), 2)} | L={round(np.mean(elList[1:]), 2)}±{round(np.std(elList[1:]), 2)} | x{round(np.mean(ZList[1:])/np.mean(elList[1:]), 2)} | {int(self.rollout_info["throughput"])} transitions/sec'+(' ')*35)
 
+        return ZList, elList
 
 
 
@@ -1,10 +1,15 @@
 import gym
 from gym.spaces import Box
 
+import numpy as np
 import torch as T
 # T.multiprocessing.set_sharing_strategy('file_system')
 
+from rl.environments.vec import make_vec_env, DummyVecEnv, SubprocVecEnv, ShmemVecEnv, AsyncVecEnv, VecInteraction
 from rl.data.buffer import TrajBuffer, ReplayBuffer
+from rl.utils.profiler import Profiler
+from rl.utils.precision import MixedPrecision
+from rl.utils.evaluation import Evaluator
 # from rl.data.buffer import DataBuffer
 from rl.data.dataset import RLDataModule
 # from rl.world_models.world_model import WorldModel
@@ -15,7 +20,7 @@ from rl.data.dataset import RLDataModule
 
 
 
-class MBRL:
+class MBRL(VecInteraction):
     """
     Model-Based Reinforcement Learning
     """
@@ -26,6 +31,9 @@ class MBRL:
         self.configs = configs
         self.seed = seed
         self._device_ = device
+        self.profiler = Profiler(enabled=configs['experiment'].get('profile', False),
+                                 trace_file=configs['experiment'].get('profile_trace', None))
+        self.amp = MixedPrecision(configs['experiment'].get('precision', 'fp32'), device) # SAC/PPO updates
 
 
     def _build(self):
@@ -39,7 +47,14 @@ class MBRL:
         evaluate = self.configs['algorithm']['evaluation']
 
         # Inintialize Learning environment
-        self.learn_env = gym.make(name)
+        self.num_envs = self.configs['environment'].get('num_envs', 1)
+        if self.num_envs > 1: # N parallel envs, stepped by internact_vec
+            vec_env = self.configs['environment'].get('vec_env', 'subproc')
+            vec_env_cls = {'subproc': SubprocVecEnv, 'shmem': ShmemVecEnv, 'async': AsyncVecEnv, 'dummy': DummyVecEnv}[vec_env]
+            vec_env_kwargs = {'batch_size': self.configs['environment'].get('vec_batch_size', None)} if vec_env == 'async' else None
+            self.learn_env = make_vec_env(name, self.num_envs, vec_env_cls=vec_env_cls, vec_env_kwargs=vec_env_kwargs)
+        else:
+            self.learn_env = gym.make(name)
         self._seed_env(self.learn_env)
         assert isinstance (self.learn_env.action_space, Box), "Works only with continuous action space"
 
@@ -51,8 +66,19 @@ class MBRL:
             # Ininialize Evaluation environment
             self.eval_env = gym.make(name)
             self._seed_env(self.eval_env)
+            # Evaluation episodes run eval_envs at a time (batched actor calls), optionally in a background process
+            eval_vec_env = evaluate.get('eval_vec_env', 'dummy')
+            self.evaluator = Evaluator(name, self.seed,
+                                       EE=evaluate['eval_episodes'],
+                                       max_el=self.configs['environment']['horizon'],
+                                       num_envs=evaluate.get('eval_envs', 1),
+                                       vec_env_cls={'subproc': SubprocVecEnv, 'shmem': ShmemVecEnv, 'dummy': DummyVecEnv}[eval_vec_env],
+                                       score=self.configs['environment']['type'] == 'mujoco-pddm-shadowhand',
+                                       background=evaluate.get('eval_background', False),
+                                       eval_env=self.eval_env)
         else:
             self.eval_env = None
+            self.evaluator = None
 
         # Spaces dimensions
         self.obs_dim = self.learn_env.observation_space.shape[0]
@@ -76,12 +102,22 @@ class MBRL:
         seed = self.seed
         if self.configs['algorithm']['on-policy']:
             num_traj = max_size//10
-            horizon = 1000
+            horizon = int(self.configs['environment']['horizon']) # max trajectory length
             gamma = self.configs['critic']['gamma']
             gae_lam = self.configs['critic']['gae_lam']
-            self.buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam)
+            self.buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam,
+                                     next_obs=self.configs['data'].get('buffer_next_obs', 'copy'))
         else:
-            self.buffer = ReplayBuffer(self.obs_dim, self.act_dim, max_size, self.seed, device)
+            self.buffer = ReplayBuffer(self.obs_dim, self.act_dim, max_size, self.seed, device,
+                                       on_device=self.configs['data'].get('buffer_on_device', False),
+                                       pin_memory=self.configs['data'].get('buffer_pin_memory', False),
+                                       prefetch=self.configs['data'].get('buffer_prefetch', False),
+                                       fused=self.configs['data'].get('buffer_fused', False),
+                                       next_obs=self.configs['data'].get('buffer_next_obs', 'copy'),
+                                       storage=self.configs['data'].get('buffer_storage', 'memory'),
+                                       path=self.configs['data'].get('buffer_path', None),
+                                       readahead=self.configs['data'].get('buffer_readahead', True),
+                                       sample_chunk=self.configs['data'].get('buffer_sample_chunk', 1))
 
 
     # def _set_world_model(self):
@@ -108,10 +144,11 @@ class MBRL:
         seed = self.seed
         if self.configs['algorithm']['on-policy']:
             num_traj = max_size//10
-            horizon = 1000
+            horizon = int(self.configs['environment']['horizon']) # max trajectory length
             gamma = self.configs['critic']['gamma']
             gae_lam = self.configs['critic']['gae_lam']
-            self.model_traj_buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam)
+            self.model_traj_buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam,
+                                                next_obs=self.configs['data'].get('model_next_obs', 'copy'))
 
 
     def reallocate_oq_model_buffer(self, n):
@@ -133,6 +170,15 @@ class MBRL:
         rollouts_per_epoch = batch_size_ro * (NT / model_train_frequency)
         model_steps_per_epoch = int(K * rollouts_per_epoch)
         new_buffer_size = model_retain_epochs * model_steps_per_epoch
+        obs_dtype = getattr(T, self.configs['data'].get('model_obs_dtype', 'float32'))
+        on_device = self.configs['data'].get('buffer_on_device', False)
+        pin_memory = self.configs['data'].get('buffer_pin_memory', False)
+        fused = self.configs['data'].get('buffer_fused', False)
+        next_obs = self.configs['data'].get('model_next_obs', 'copy')
+        storage = self.configs['data'].get('model_buffer_storage', 'memory')
+        path = self.configs['data'].get('model_buffer_path', None)
+        readahead = self.configs['data'].get('model_readahead', True)
+        sample_chunk = self.configs['data'].get('model_sample_chunk', 1)
 
         if not hasattr(self, 'model_repl_buffer'):
         	print('[ MBRL ] Initializing new model buffer with size {:.2e}'.format(new_buffer_size)+(' '*50))
@@ -140,20 +186,19 @@ class MBRL:
         								act_dim=self.act_dim,
         								size=new_buffer_size,
         								seed=seed,
-        								device=device)
+        								device=device,
+        								obs_dtype=obs_dtype,
+        								on_device=on_device,
+        								pin_memory=pin_memory,
+        								fused=fused,
+        								next_obs=next_obs,
+        								storage=storage,
+        								path=path,
+        								readahead=readahead,
+        								sample_chunk=sample_chunk)
 
         elif self.model_repl_buffer.max_size != new_buffer_size:
-        	new_model_buffer = ReplayBuffer(obs_dim=self.obs_dim,
-        								act_dim=self.act_dim,
-        								size=new_buffer_size,
-        								seed=seed,
-        								device=device)
-        	# old_data = self.model_repl_buffer.return_all_np()
-        	old_data = self.model_repl_buffer.data_for_WM_np()
-        	O, A, R, O_next, D = old_data.values()
-        	new_model_buffer.store_batch(O, A, R, O_next, D)
-        	assert self.model_repl_buffer.size == new_model_buffer.size
-        	self.model_repl_buffer = new_model_buffer
+        	self.model_repl_buffer.resize(new_buffer_size) # In place, the newest transitions kept in order
         	print(f'[ MBRL ] Rellocate Model Buffer: maxSize={self.model_repl_buffer.max_size}'+(' '*50))
 
 
@@ -242,14 +287,14 @@ class MBRL:
         max_el = self.configs['environment']['horizon']
 
         if n > Nx:
-            a = self.actor_critic.get_action_np(o) # Stochastic action | No reparameterization
+            with self.profiler.phase('actor'): a = self.actor_critic.get_action_np(o) # Stochastic action | No reparameterization
         else:
             a = self.learn_env.action_space.sample()
 
-        o_next, r, d, _ = self.learn_env.step(a)
+        with self.profiler.phase('env'): o_next, r, d, _ = self.learn_env.step(a)
         d = False if el == max_el else d # Ignore artificial termination
 
-        self.buffer.store_transition(o, a, r, o_next, d)
+        with self.profiler.phase('buffer'): self.buffer.store_transition(o, a, r, o_next, d)
 
         o = o_next
         Z += r
@@ -326,30 +371,8 @@ class MBRL:
         evaluate = self.configs['algorithm']['evaluation']
         if evaluate:
             # print('\n[ Evaluation ]')
-            EE = self.configs['algorithm']['evaluation']['eval_episodes']
-            max_el = self.configs['environment']['horizon']
-            EZ = [] # Evaluation episodic return
-            ES = [] # Evaluation episodic score
-            EL = [] # Evaluation episodic length
-
-            for ee in range(1, EE+1):
-                print(f' [ Agent Evaluation ] Episode: {ee}   ', end='\r')
-                o, d, Z, S, el = self.eval_env.reset(), False, 0, 0, 0
-                while not(d or (el == max_el)):
-                    # Take deterministic actions at evaluation time
-                    a = self.actor_critic.get_action_np(o, deterministic=True) # Deterministic action | No reparameterization
-                    o, r, d, info = self.eval_env.step(a)
-                    Z += r
-                    if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand': S += info['score']
-                    el += 1
-
-                EZ.append(Z)
-                if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand': ES.append(S/el)
-                EL.append(el)
-
-            # if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand':
-            #     for i in range(len(ES)):
-            #         ES[i] /= EL[i]
+            # EE episodes over the eval envs, deterministic actions | No reparameterization
+            EZ, ES, EL = self.evaluator.evaluate(self.actor_critic)
 
         return EZ, ES, EL
 
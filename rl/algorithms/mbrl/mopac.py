@@ -16,7 +16,7 @@ import torch.nn.functional as F
 from rl.algorithms.mbrl.mbrl import MBRL
 from rl.algorithms.mfrl.sac import SAC
 from rl.world_models.fake_world import FakeWorld
-import rl.environments.mbpo.static as mbpo_static
+from rl.environments.static import get_static_fns
 # from rl.data.dataset import RLDataModule
 
 
@@ -65,13 +65,10 @@ class MoPAC(MBRL, SAC, MBPO):
     def _set_fake_world(self):
         env_name = self.configs['environment']['name']
         device = self._device_
-        if self.configs['environment']['name'][:4] == 'pddm':
-        	static_fns = None
-        else:
-        	static_fns = mbpo_static[env_name[:-3].lower()]
+        self.static_fns = get_static_fns(env_name)
 
         # self.fake_world = FakeWorld(self.world_model, static_fns, env_name, self.learn_env, self.configs, device)
-        self.fake_world = FakeWorld(self.world_model)
+        self.fake_world = FakeWorld(self.world_model, env_name)
 
 
     def learn(self):
@@ -286,8 +283,8 @@ class MoPAC(MBRL, SAC, MBPO):
     		# self.model_buffer.store_batch(O.numpy(), A, R, O_next, D) # ip: Numpy
     		self.model_buffer.store_batch(O, A, R, O_next, D) # ip: Tensor
 
-    		O_next = T.Tensor(O_next)
-    		D = T.tensor(D, dtype=T.bool)
+    		O_next = T.as_tensor(O_next)
+    		D = T.as_tensor(D, dtype=T.bool)
     		# nonD = ~D
     		nonD = ~D.squeeze(-1)
 
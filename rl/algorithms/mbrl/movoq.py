@@ -16,7 +16,7 @@ from rl.algorithms.mfrl.ovoq import OVOQ
 from rl.dynamics.world_model import WorldModel
 from rl.world_models.model import EnsembleDynamicsModel
 from rl.world_models.fake_world import FakeWorld
-import rl.environments.mbpo.static as mbpo_static
+from rl.environments.static import get_static_fns
 
 
 class color:
@@ -106,20 +106,22 @@ class MOVOQ(MBRL, OVOQ):
         net_arch = self.configs['world_model']['network']['arch']
         self.oq_world_model = EnsembleDynamicsModel(num_ensembles, num_elites,
                                                     self.obs_dim, self.act_dim, 1,
-                                                    net_arch[0], use_decay=True, device=device)
+                                                    net_arch[0], use_decay=True, device=device,
+                                                    max_epochs=self.configs['world_model'].get('max_train_epochs', None),
+                                                    max_time=self.configs['world_model'].get('max_train_time', None))
 
 
     def _set_fake_world(self):
         self._set_oq_world_model()
         env_name = self.configs['environment']['name']
         device = self._device_
-        if self.configs['environment']['name'][:4] == 'pddm':
-        	static_fns = None
-        else:
-        	static_fns = mbpo_static[env_name[:-3].lower()]
+        self.static_fns = get_static_fns(env_name)
 
         # self.fake_world = FakeWorld(self.oq_world_model, static_fns, env_name, self.learn_env, self.configs, device)
-        self.fake_world = FakeWorld(self.oq_world_model)
+        self.fake_world = FakeWorld(self.oq_world_model, env_name,
+                                    incremental=self.configs['world_model'].get('incremental_training', False),
+                                    refresh_epochs=self.configs['world_model'].get('refresh_epochs', 5),
+                                    reservoir_size=int(self.configs['world_model'].get('reservoir_size', 5e4)))
 
 
     def learn(self):
@@ -309,6 +311,8 @@ class MOVOQ(MBRL, OVOQ):
 
             logs['training/world_model/Jhov           '] = np.mean(JHOVList)
             logs['training/world_model/Jhoq           '] = np.mean(JHOQList)
+            logs['training/world_model/oq_epochs      '] = self.oq_world_model.train_info['epochs']
+            logs['time/oq_wm_training                 '] = self.oq_world_model.train_info['time']
 
             logs['training/ovoq/critic/Jv             '] = np.mean(JVList)
             logs['training/ovoq/critic/V(s)           '] = T.mean(self.model_traj_buffer.val_buf).item()
@@ -422,8 +426,8 @@ class MOVOQ(MBRL, OVOQ):
             O_next, R, D, _ = self.fake_world.step(O, A) # ip: Tensor, op: Tensor
             self.model_repl_buffer.store_batch(O, A, R, O_next, D) # ip: Tensor
 
-            O_next = T.Tensor(O_next)
-            D = T.tensor(D, dtype=T.bool)
+            O_next = T.as_tensor(O_next)
+            D = T.as_tensor(D, dtype=T.bool)
             nonD = ~D.squeeze(-1)
 
             if nonD.sum() == 0:
@@ -458,8 +462,7 @@ class MOVOQ(MBRL, OVOQ):
 
                     o_next = model.forward(o, a).detach().cpu() # ip: Tensor, op: Tensor
                     r = model.reward(o, a).detach()
-                    d = self._termination_fn("Hopper-v2", o, a, o_next)
-                    d = T.tensor(d, dtype=T.bool)
+                    d = self.static_fns.termination_fn(o[None], a[None], o_next[None])
 
                     Z += float(r)
                     el += 1
@@ -531,94 +534,6 @@ class MOVOQ(MBRL, OVOQ):
         return B
 
 
-    def _reward_fn(self, env_name, obs, act):
-        if len(obs.shape) == 1 and len(act.shape) == 1:
-            obs = obs[None]
-            act = act[None]
-            return_single = True
-        elif len(obs.shape) == 1:
-            obs = obs[None]
-            return_single = True
-        else:
-            return_single = False
-
-        next_obs = next_obs.numpy()
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(act.shape) == 2
-            vel_x = obs[:, -6] / 0.02
-            power = np.square(act).sum(axis=-1)
-            height = obs[:, 0]
-            ang = obs[:, 1]
-            alive_bonus = 1.0 * (height > 0.7) * (np.abs(ang) <= 0.2)
-            rewards = vel_x + alive_bonus - 1e-3*power
-
-            return rewards
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-            pass
-        elif 'walker_' in env_name:
-            pass
-
-
-    def _termination_fn(self, env_name, obs, act, next_obs):
-        if len(obs.shape) == 1 and len(act.shape) == 1:
-            obs = obs[None]
-            act = act[None]
-            next_obs = next_obs[None]
-            return_single = True
-        elif len(obs.shape) == 1:
-            obs = obs[None]
-            next_obs = next_obs[None]
-            return_single = True
-        else:
-            return_single = False
-
-        next_obs = next_obs.numpy()
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = np.isfinite(next_obs).all(axis=-1) \
-                       * np.abs(next_obs[:, 1:] < 100).all(axis=-1) \
-                       * (height > .7) \
-                       * (np.abs(angle) < .2)
-
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = (height > 0.8) \
-                       * (height < 2.0) \
-                       * (angle > -1.0) \
-                       * (angle < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif 'walker_' in env_name:
-            torso_height =  next_obs[:, -2]
-            torso_ang = next_obs[:, -1]
-            if 'walker_7' in env_name or 'walker_5' in env_name:
-                offset = 0.
-            else:
-                offset = 0.26
-            not_done = (torso_height > 0.8 - offset) \
-                       * (torso_height < 2.0 - offset) \
-                       * (torso_ang > -1.0) \
-                       * (torso_ang < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
-
-
-
-
-
-
 
 def main(exp_prefix, config, seed, device, wb):
 
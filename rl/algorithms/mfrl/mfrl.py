@@ -5,7 +5,11 @@ import numpy as np
 import torch as T
 
 import rl.environments
+from rl.environments.vec import make_vec_env, DummyVecEnv, SubprocVecEnv, ShmemVecEnv, AsyncVecEnv, VecInteraction
 from rl.data.buffer import TrajBuffer, ReplayBuffer
+from rl.utils.profiler import Profiler
+from rl.utils.precision import MixedPrecision
+from rl.utils.evaluation import Evaluator
 # from rl.data.buffer import TrajBuffer, ReplayBufferNP
 
 
@@ -33,7 +37,7 @@ from rl.data.buffer import TrajBuffer, ReplayBuffer
 
 
 
-class MFRL:
+class MFRL(VecInteraction):
     """
     Model-Free Reinforcement Learning
     """
@@ -44,6 +48,9 @@ class MFRL:
         self.configs = configs
         self.seed = seed
         self._device_ = device
+        self.profiler = Profiler(enabled=configs['experiment'].get('profile', False),
+                                 trace_file=configs['experiment'].get('profile_trace', None))
+        self.amp = MixedPrecision(configs['experiment'].get('precision', 'fp32'), device) # SAC/PPO updates
 
 
     def _build(self):
@@ -56,7 +63,14 @@ class MFRL:
         evaluate = self.configs['algorithm']['evaluation']
 
         # Inintialize Learning environment
-        self.learn_env = gym.make(name)
+        self.num_envs = self.configs['environment'].get('num_envs', 1)
+        if self.num_envs > 1: # N parallel envs, stepped by internact_vec
+            vec_env = self.configs['environment'].get('vec_env', 'subproc')
+            vec_env_cls = {'subproc': SubprocVecEnv, 'shmem': ShmemVecEnv, 'async': AsyncVecEnv, 'dummy': DummyVecEnv}[vec_env]
+            vec_env_kwargs = {'batch_size': self.configs['environment'].get('vec_batch_size', None)} if vec_env == 'async' else None
+            self.learn_env = make_vec_env(name, self.num_envs, vec_env_cls=vec_env_cls, vec_env_kwargs=vec_env_kwargs)
+        else:
+            self.learn_env = gym.make(name)
         self._seed_env(self.learn_env)
         assert isinstance (self.learn_env.action_space, Box), "Works only with continuous action space"
 
@@ -68,8 +82,19 @@ class MFRL:
             # Ininialize Evaluation environment
             self.eval_env = gym.make(name)
             self._seed_env(self.eval_env)
+            # Evaluation episodes run eval_envs at a time (batched actor calls), optionally in a background process
+            eval_vec_env = evaluate.get('eval_vec_env', 'dummy')
+            self.evaluator = Evaluator(name, self.seed,
+                                       EE=evaluate['eval_episodes'],
+                                       max_el=self.configs['environment']['horizon'],
+                                       num_envs=evaluate.get('eval_envs', 1),
+                                       vec_env_cls={'subproc': SubprocVecEnv, 'shmem': ShmemVecEnv, 'dummy': DummyVecEnv}[eval_vec_env],
+                                       score=self.configs['environment']['type'] == 'mujoco-pddm-shadowhand',
+                                       background=evaluate.get('eval_background', False),
+                                       eval_env=self.eval_env)
         else:
             self.eval_env = None
+            self.evaluator = None
 
         # Spaces dimensions
         self.obs_dim = self.learn_env.observation_space.shape[0]
@@ -92,12 +117,22 @@ class MFRL:
         if self.configs['algorithm']['on-policy']:
             num_traj = max_size//5
             # num_traj = max_size//20
-            horizon = 1000
+            horizon = int(self.configs['environment']['horizon']) # max trajectory length
             gamma = self.configs['critic']['gamma']
             gae_lam = self.configs['critic']['gae_lam']
-            self.buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam)
+            self.buffer = TrajBuffer(obs_dim, act_dim, horizon, num_traj, max_size, seed, device, gamma, gae_lam,
+                                     next_obs=self.configs['data'].get('buffer_next_obs', 'copy'))
         else:
-            self.buffer = ReplayBuffer(obs_dim, act_dim, max_size, seed, device)
+            self.buffer = ReplayBuffer(obs_dim, act_dim, max_size, seed, device,
+                                       on_device=self.configs['data'].get('buffer_on_device', False),
+                                       pin_memory=self.configs['data'].get('buffer_pin_memory', False),
+                                       prefetch=self.configs['data'].get('buffer_prefetch', False),
+                                       fused=self.configs['data'].get('buffer_fused', False),
+                                       next_obs=self.configs['data'].get('buffer_next_obs', 'copy'),
+                                       storage=self.configs['data'].get('buffer_storage', 'memory'),
+                                       path=self.configs['data'].get('buffer_path', None),
+                                       readahead=self.configs['data'].get('buffer_readahead', True),
+                                       sample_chunk=self.configs['data'].get('buffer_sample_chunk', 1))
 
 
     def initialize_buffer(self, num_traj=400):
@@ -107,7 +142,7 @@ class MFRL:
 
         if self.configs['algorithm']['on-policy']:
             # num_traj = 40
-            horizon = 1000
+            horizon = int(self.configs['environment']['horizon']) # max trajectory length
             max_size = self.configs['data']['batch_size']
             self.buffer = TrajBuffer(self.obs_dim, self.act_dim, horizon, num_traj, max_size, self.seed, device)
 
@@ -176,12 +211,12 @@ class MFRL:
         Nt = self.configs['algorithm']['learning']['epoch_steps']
         max_el = self.configs['environment']['horizon']
 
-        with T.no_grad(): pre_a, a, log_pi, v = self.actor_critic.get_a_and_v_np(T.Tensor(o), on_policy=True, return_pre_pi=True)
-        o_next, r, d, _ = self.learn_env.step(a)
+        with self.profiler.phase('actor'), T.no_grad(): pre_a, a, log_pi, v = self.actor_critic.get_a_and_v_np(T.Tensor(o), on_policy=True, return_pre_pi=True)
+        with self.profiler.phase('env'): o_next, r, d, _ = self.learn_env.step(a)
         Z += r
         el += 1
         t += 1
-        self.buffer.store(o, pre_a, a, r, o_next, v, log_pi, el)
+        with self.profiler.phase('buffer'): self.buffer.store(o, pre_a, a, r, o_next, v, log_pi, el)
         o = o_next
         if d or (el == max_el):
             if el == max_el:
@@ -203,14 +238,14 @@ class MFRL:
         if n > Nx:
             # a, _, _ = self.actor_critic.actor(o)
             # a = a.cpu().numpy()
-            a = self.actor_critic.get_action_np(o) # Stochastic action | No reparameterization # Deterministic action | No reparameterization
+            with self.profiler.phase('actor'): a = self.actor_critic.get_action_np(o) # Stochastic action | No reparameterization # Deterministic action | No reparameterization
         else:
             a = self.learn_env.action_space.sample()
 
-        o_next, r, d, _ = self.learn_env.step(a)
+        with self.profiler.phase('env'): o_next, r, d, _ = self.learn_env.step(a)
         d = False if el == max_el else d # Ignore artificial termination
 
-        self.buffer.store_transition(o, a, r, o_next, d)
+        with self.profiler.phase('buffer'): self.buffer.store_transition(o, a, r, o_next, d)
 
         o = o_next
         Z += r
@@ -222,8 +257,6 @@ class MFRL:
         return o, Z, el, t
 
 
-
-
     def internact_ovoq(self, n, o, Z, el, t, on_policy=True):
         max_el = self.configs['environment']['horizon']
         Nx = self.configs['algorithm']['learning']['expl_epochs']
@@ -303,30 +336,7 @@ class MFRL:
         evaluate = self.configs['algorithm']['evaluation']
         if evaluate:
             print('\n[ Evaluation ]')
-            EE = self.configs['algorithm']['evaluation']['eval_episodes']
-            max_el = self.configs['environment']['horizon']
-            EZ = [] # Evaluation episodic return
-            ES = [] # Evaluation episodic score
-            EL = [] # Evaluation episodic length
-
-            for ee in range(1, EE+1):
-                print(f' [ Agent Evaluation ] Episode: {ee}   ', end='\r')
-                o, d, Z, S, el = self.eval_env.reset(), False, 0, 0, 0
-
-                while not(d or (el == max_el)):
-                    # a, _, _ = self.actor_critic.actor(o, deterministic=True)
-                    a = self.actor_critic.get_action_np(o, on_policy=on_policy, deterministic=True) # Deterministic action | No reparameterization
-                    o, r, d, info = self.eval_env.step(a)
-                    Z += r
-                    if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand': S += info['score']
-                    el += 1
-
-                EZ.append(Z)
-                if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand': ES.append(S/el)
-                EL.append(el)
-
-            # if self.configs['environment']['type'] == 'mujoco-pddm-shadowhand':
-            #     for i in range(len(ES)):
-            #         ES[i] /= EL[i]
+            # EE episodes over the eval envs, deterministic actions | No reparameterization
+            EZ, ES, EL = self.evaluator.evaluate(self.actor_critic, on_policy=on_policy)
 
         return EZ, ES, EL
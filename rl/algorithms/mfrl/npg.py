@@ -224,24 +224,14 @@ class NPG(MFRL):
                     with T.no_grad(): v = self.actor_critic.get_v(T.Tensor(o)).cpu()
                     self.buffer.traj_tail(d, v)
                     # Optimizing policy and value networks
-                    # b_inds = np.arange(batch_size)
-                    for g in range(1, G+1):
-                        # NPG-P >>>>
-                        for b in range(0, batch_size, mini_batch_size):
-                            # print('ptr: ', self.buffer.ptr)
-                            mini_batch = self.buffer.sample_batch(mini_batch_size, device=self._device_)
-                            Jv, Jpi, stop_pi = self.trainAC(g, mini_batch, oldJs)
-                            oldJs = [Jv, Jpi]
-                            JVList.append(Jv.item())
-                            JPiList.append(Jpi.item())
-                        # NPG-P <<<<
-
-                        # np.random.shuffle(b_inds)
-                        # for start in range(0, batch_size, mini_batch_size):
-                        #     end = start + mini_batch_size
-                        #     mb_inds = b_inds[start:end]
-                        #     mini_batch = self.buffer.sample_inds(mb_inds)
-                        #     self.trainAC(mini_batch)
+                    # NPG-P >>>>
+                    for g, mini_batch in self.buffer.minibatches(mini_batch_size, G, device=self._device_,
+                                                                 fields=('observations', 'actions', 'returns', 'values', 'advantages', 'log_pis')): # G epochs
+                        Jv, Jpi, stop_pi = self.trainAC(g, mini_batch, oldJs)
+                        oldJs = [Jv, Jpi]
+                        JVList.append(Jv.item())
+                        JPiList.append(Jpi.item())
+                    # NPG-P <<<<
                     self.buffer.reset()
                 nt += E
 
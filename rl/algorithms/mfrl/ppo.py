@@ -261,7 +261,7 @@ class PPO(MFRL):
         G = self.configs['algorithm']['learning']['grad_AC_steps']
 
         batch_size = self.configs['data']['batch_size']
-        # mini_batch_size = self.configs['data']['mini_batch_size']
+        mini_batch_size = self.configs['data'].get('mini_batch_size', batch_size) # None: full batch
 
         max_dev = self.configs['actor']['max_dev']
 
@@ -312,26 +312,27 @@ class PPO(MFRL):
             learn_start_real = time.time()
             while nt < NT:
                 # Interaction steps (On-Policy)
-                for e in range(1, E+1):
-                    print('t: ', t, end='\r')
-                    # o, d, Z, el, t = self.internact_op(n, o, d, Z, el, t)
-                    o, Z, el, t = self.internact_opB(n, o, Z, el, t)
-                    # o, Z, el, t = self.internact_ovoq(n, o, Z, el, t, on_policy=True)
-                    # o, Z, el, t = self.internact_ovoq(n, o, Z, el, t, on_policy=False)
-                    # print(f'Steps: e={e} | el={el} || size={self.buffer.total_size()}')
-
-                    if el > 0:
-                        currZ = Z
-                        AvgZ = (sum(ZList)+currZ)/(len(ZList))
-                        currEL = el
-                        AvgEL = (sum(elList)+currEL)/(len(elList))
-                    else:
-                        lastZ = currZ
-                        ZList.append(lastZ)
-                        AvgZ = sum(ZList)/(len(ZList)-1)
-                        lastEL = currEL
-                        elList.append(lastEL)
-                        AvgEL = sum(elList)/(len(elList)-1)
+                with self.profiler.phase('interaction', steps=E):
+                    for e in range(1, E+1):
+                        print('t: ', t, end='\r')
+                        # o, d, Z, el, t = self.internact_op(n, o, d, Z, el, t)
+                        o, Z, el, t = self.internact_opB(n, o, Z, el, t)
+                        # o, Z, el, t = self.internact_ovoq(n, o, Z, el, t, on_policy=True)
+                        # o, Z, el, t = self.internact_ovoq(n, o, Z, el, t, on_policy=False)
+                        # print(f'Steps: e={e} | el={el} || size={self.buffer.total_size()}')
+
+                        if el > 0:
+                            currZ = Z
+                            AvgZ = (sum(ZList)+currZ)/(len(ZList))
+                            currEL = el
+                            AvgEL = (sum(elList)+currEL)/(len(elList))
+                        else:
+                            lastZ = currZ
+                            ZList.append(lastZ)
+                            AvgZ = sum(ZList)/(len(ZList)-1)
+                            lastEL = currEL
+                            elList.append(lastEL)
+                            AvgEL = sum(elList)/(len(elList)-1)
 
                 with T.no_grad(): v = self.actor_critic.get_v(T.Tensor(o)).cpu()
                 # self.buffer.traj_tail(d, v, el)
@@ -344,24 +345,25 @@ class PPO(MFRL):
                     self.stop_pi = False
                     kl, dev = 0, 0
                     # ppo_grads = 0
-                    for g in range(1, G+1):
-                        # PPO-P >>>>
-                        print(f'[ PPO ] grads={g}/{G} | stopPG={self.stop_pi} | Dev={round(dev, 4)}', end='\r')
-                        batch = self.buffer.sample_batch(batch_size, device=self._device_)
-                        Jv, Jpi, kl, PiInfo = self.trainAC(g, batch, oldJs)
-                        oldJs = [Jv, Jpi]
-                        JVList.append(Jv)
-                        JPiList.append(Jpi)
-                        KLList.append(kl)
-                        HList.append(PiInfo['entropy'])
-                        DevList.append(PiInfo['deviation'])
-                        dev = PiInfo['deviation']
-                        if not self.stop_pi:
-                            ppo_grads += 1
-                        # if PiInfo['deviation'] > max_dev:
-                        #     print(f'\nBreak AC grad loop at g={g}'+(' ')*80)
-                        #     break
-                        # PPO-P <<<<
+                    with self.profiler.phase('ac_training'):
+                        for g, batch in self.buffer.minibatches(mini_batch_size, G, device=self._device_): # G epochs
+                            # PPO-P >>>>
+                            print(f'[ PPO ] epoch={g}/{G} | stopPG={self.stop_pi} | Dev={round(dev, 4)}', end='\r')
+                            self.profiler.count()
+                            Jv, Jpi, kl, PiInfo = self.trainAC(g, batch, oldJs)
+                            oldJs = [Jv, Jpi]
+                            JVList.append(Jv)
+                            JPiList.append(Jpi)
+                            KLList.append(kl)
+                            HList.append(PiInfo['entropy'])
+                            DevList.append(PiInfo['deviation'])
+                            dev = PiInfo['deviation']
+                            if not self.stop_pi:
+                                ppo_grads += 1
+                            # if PiInfo['deviation'] > max_dev:
+                            #     print(f'\nBreak AC grad loop at g={g}'+(' ')*80)
+                            #     break
+                            # PPO-P <<<<
                     # self.buffer.reset()
                 nt += E
 
@@ -387,7 +389,7 @@ class PPO(MFRL):
 
             eval_start_real = time.time()
             # EZ, ES, EL = self.evaluate_op()
-            EZ, ES, EL = self.evaluate(on_policy=True)
+            with self.profiler.phase('evaluation'): EZ, ES, EL = self.evaluate(on_policy=True)
             #
             # logs['time/evaluation                '] = time.time() - eval_start_real
             #
@@ -401,7 +403,10 @@ class PPO(MFRL):
             logs['evaluation/episodic_length_mean     '] = np.mean(EL)
             logs['evaluation/return_to_length         '] = np.mean(EZ)/np.mean(EL)
             logs['evaluation/return_to_full_length    '] = (np.mean(EZ)/1000)
+            logs.update(self.evaluator.logs())
 
+            logs.update(self.profiler.logs())
+            self.profiler.save_trace()
             #
             # logs['time/total                     '] = time.time() - start_time_real
             #
@@ -461,14 +466,13 @@ class PPO(MFRL):
         max_grad_norm = kl_targ = self.configs['critic']['network']['max_grad_norm']
 
         observations, _, _, _, _, _, returns, _, _, _ = batch.values()
-        v = self.actor_critic.get_v(observations)
+        with self.amp.autocast():
+            v = self.actor_critic.get_v(observations)
 
-        Jv = 0.5 * ( (v - returns) ** 2 ).mean(axis=0)
+        Jv = 0.5 * ( (v.float() - returns) ** 2 ).mean(axis=0)
 
-        self.actor_critic.critic.optimizer.zero_grad()
-        Jv.backward()
         # nn.utils.clip_grad_norm_(self.actor_critic.critic.parameters(), max_grad_norm) # PPO-D
-        self.actor_critic.critic.optimizer.step()
+        self.amp.step(Jv, self.actor_critic.critic.optimizer)
 
         return Jv
 
@@ -489,7 +493,8 @@ class PPO(MFRL):
 
         O, pre_A, A, _, _, _, _, _, U, log_Pi_old = batch.values()
 
-        _, log_Pi, entropy = self.actor_critic.get_pi(O, pre_A, on_policy=True, reparameterize=False)
+        with self.amp.autocast():
+            _, log_Pi, entropy = self.actor_critic.get_pi(O, pre_A, on_policy=True, reparameterize=False) # log_Pi: fp32 (pi_prob)
         logratio = log_Pi - log_Pi_old
         # ratio = logratio.exp()
         ratio = T.exp(logratio)
@@ -519,10 +524,8 @@ class PPO(MFRL):
             self.stop_pi = True
         else:
             self.stop_pi = False
-            self.actor_critic.actor.optimizer.zero_grad()
-            Jpi.backward()
             # nn.utils.clip_grad_norm_(self.actor_critic.actor.parameters(), max_grad_norm) # PPO-D
-            self.actor_critic.actor.optimizer.step()
+            self.amp.step(Jpi, self.actor_critic.actor.optimizer)
 
         PiInfo['KL'] = approx_kl_old
         # PiInfo['KL-new'] = approx_kl
@@ -23,7 +23,7 @@ import torch.nn.functional as F
 
 from rl.algorithms.mfrl.mfrl import MFRL
 from rl.control.policy import StochasticPolicy, OVOQPolicy, Policy
-from rl.value_functions.q_function import SoftQFunction
+from rl.value_functions.q_function import SoftQFunction, EnsembleSoftQFunction
 
 # from rl.utils.logx import EpochLogger
 
@@ -95,6 +95,11 @@ class ActorCritic: # Done
 
     def _set_critic(self):
         net_configs = self.configs['critic']['network']
+        if net_configs.get('fused', False): # critic: the num_q Q-heads in one batched network
+            return EnsembleSoftQFunction(
+                self.obs_dim, self.act_dim,
+                net_configs, self._device_, self.seed,
+                num_q=self.configs['critic'].get('number', 2))
         return SoftQFunction(
             self.obs_dim, self.act_dim,
             net_configs, self._device_, self.seed)
@@ -287,37 +292,50 @@ class SAC(MFRL):
             learn_start_real = time.time()
             while nt < NT:
                 # Interaction steps
-                for e in range(1, E+1):
-                    o, Z, el, t = self.internact(n, o, Z, el, t)
-
-                    if el > 0:
-                        currZ = Z
-                        AvgZ = (sum(ZList)+currZ)/(len(ZList))
-                        currEL = el
-                        AvgEL = (sum(elList)+currEL)/(len(elList))
-                    else:
-                        lastZ = currZ
-                        ZList.append(lastZ)
-                        AvgZ = sum(ZList)/(len(ZList)-1)
-                        lastEL = currEL
-                        elList.append(lastEL)
-                        AvgEL = sum(elList)/(len(elList)-1)
-
+                with self.profiler.phase('interaction'):
+                    t0 = t
+                    for e in range(1, E+1, self.num_envs):
+                        if self.num_envs > 1:
+                            o, Z, el, t, ZDone, elDone = self.internact_vec(n, o, Z, el, t)
+                            ZList += ZDone
+                            elList += elDone
+                            AvgZ, AvgEL = np.mean(ZList[1:] or Z), np.mean(elList[1:] or el)
+                            continue
+                        o, Z, el, t = self.internact(n, o, Z, el, t)
+
+                        if el > 0:
+                            currZ = Z
+                            AvgZ = (sum(ZList)+currZ)/(len(ZList))
+                            currEL = el
+                            AvgEL = (sum(elList)+currEL)/(len(elList))
+                        else:
+                            lastZ = currZ
+                            ZList.append(lastZ)
+                            AvgZ = sum(ZList)/(len(ZList)-1)
+                            lastEL = currEL
+                            elList.append(lastEL)
+                            AvgEL = sum(elList)/(len(elList)-1)
+
+
+                    Et = t - t0 # Transitions stored: E rounded up to whole vec steps (num_envs each)
+                    self.profiler.count(Et)
+                G_Et = G * Et // E # G per E transitions (same update-to-data ratio for any num_envs)
 
                 # Taking gradient steps after exploration
                 if n > Ni:
-                    for g in range(1, G+1):
-                        batch = self.buffer.sample_batch(batch_size, device=self._device_)
-                        Jq, Jalpha, Jpi, PiInfo = self.trainAC(g, batch, oldJs)
-                        oldJs = [Jq, Jalpha, Jpi]
-                        JQList.append(Jq)
-                        JPiList.append(Jpi)
-                        HList.append(PiInfo['entropy'])
-                        if self.configs['actor']['automatic_entropy']:
-                            JAlphaList.append(Jalpha)
-                            AlphaList.append(self.alpha)
-
-                nt += E
+                    with self.profiler.phase('ac_training', steps=G_Et):
+                        for g in range(1, G_Et+1):
+                            batch = self.buffer.sample_batch(batch_size, device=self._device_)
+                            Jq, Jalpha, Jpi, PiInfo = self.trainAC(g, batch, oldJs)
+                            oldJs = [Jq, Jalpha, Jpi]
+                            JQList.append(Jq)
+                            JPiList.append(Jpi)
+                            HList.append(PiInfo['entropy'])
+                            if self.configs['actor']['automatic_entropy']:
+                                JAlphaList.append(Jalpha)
+                                AlphaList.append(self.alpha)
+
+                nt += Et
 
             # logs['time/training                     '] = time.time() - learn_start_real
             logs['training/sac/critic/Jq              '] = np.mean(JQList)
@@ -334,7 +352,7 @@ class SAC(MFRL):
             logs['learning/real/rollout_length        '] = np.mean(elList[1:])
 
             eval_start_real = time.time()
-            EZ, ES, EL = self.evaluate(on_policy=False)
+            with self.profiler.phase('evaluation'): EZ, ES, EL = self.evaluate(on_policy=False)
 
             # logs['time/evaluation                     '] = time.time() - eval_start_real
 
@@ -347,7 +365,11 @@ class SAC(MFRL):
             logs['evaluation/episodic_length_mean     '] = np.mean(EL)
             logs['evaluation/return_to_length         '] = np.mean(EZ)/np.mean(EL)
             logs['evaluation/return_to_full_length    '] = (np.mean(EZ)/1000)
+            logs.update(self.evaluator.logs())
 
+            logs.update(self.profiler.logs())
+            self.profiler.save_trace()
+            self.buffer.flush() # storage='memmap': pointers to meta.json
             logs['time/total                          '] = time.time() - start_time_real
 
 
@@ -436,29 +458,28 @@ class SAC(MFRL):
         O_next = batch['observations_next']
         D = batch['terminals']
 
-        # Calculate two Q-functions
-        # Qs = self.actor_critic.critic(O, A)
-        Qs = self.actor_critic.get_q(O, A)
-
-        # Bellman backup for Qs
-        with T.no_grad():
-            # pi_next, log_pi_next, entropy_next = self.actor_critic.actor(O_next, reparameterize=True, return_log_pi=True)
-            pi_next, log_pi_next, entropy_next = self.actor_critic.get_pi(O_next, on_policy=False, reparameterize=True, return_log_pi=True)
-            A_next = pi_next
-            # Qs_targ = T.cat( self.actor_critic.critic_target(O_next, A_next), dim=1 )
-            Qs_targ = T.cat( self.actor_critic.get_q_target(O_next, A_next), dim=1 )
-            min_Q_targ, _ = T.min(Qs_targ, dim=1, keepdim=True)
-            Qs_backup = R + gamma * (1 - D) * (min_Q_targ - self.alpha * log_pi_next)
-            # Qs_backup = R + gamma * (1 - D) * (min_Q_targ + self.alpha * entropy_next)
-
-        # MSE loss
-        Jq = 0.5 * sum([F.mse_loss(Q, Qs_backup) for Q in Qs])
-        # print('Jq=', Jq)
+        with self.amp.autocast():
+            # Calculate two Q-functions
+            # Qs = self.actor_critic.critic(O, A)
+            Qs = self.actor_critic.get_q(O, A)
+
+            # Bellman backup for Qs
+            with T.no_grad():
+                # pi_next, log_pi_next, entropy_next = self.actor_critic.actor(O_next, reparameterize=True, return_log_pi=True)
+                pi_next, log_pi_next, entropy_next = self.actor_critic.get_pi(O_next, on_policy=False, reparameterize=True, return_log_pi=True)
+                A_next = pi_next
+                # Qs_targ = T.cat( self.actor_critic.critic_target(O_next, A_next), dim=1 )
+                Qs_targ = T.cat( self.actor_critic.get_q_target(O_next, A_next), dim=1 )
+                min_Q_targ, _ = T.min(Qs_targ, dim=1, keepdim=True)
+                Qs_backup = R + gamma * (1 - D) * (min_Q_targ.float() - self.alpha * log_pi_next)
+                # Qs_backup = R + gamma * (1 - D) * (min_Q_targ + self.alpha * entropy_next)
+
+            # MSE loss
+            Jq = 0.5 * sum([F.mse_loss(Q.float(), Qs_backup) for Q in Qs])
+            # print('Jq=', Jq)
 
         # Gradient Descent
-        self.actor_critic.critic.optimizer.zero_grad()
-        Jq.backward()
-        self.actor_critic.critic.optimizer.step()
+        self.amp.step(Jq, self.actor_critic.critic.optimizer)
 
         return Jq
 
@@ -473,7 +494,7 @@ class SAC(MFRL):
             # Learned Temprature
             O = batch['observations']
 
-            with T.no_grad():
+            with T.no_grad(), self.amp.autocast():
                 # _, log_pi = self.actor_critic.actor(O, return_log_pi=True)
                 _, log_pi, _ = self.actor_critic.get_pi(O, return_log_pi=True)
             Jalpha = - ( self.log_alpha * (log_pi + self.target_entropy) ).mean()
@@ -502,13 +523,14 @@ class SAC(MFRL):
         # Policy Evaluation
         # pi, log_pi, entropy = self.actor_critic.actor(O, return_log_pi=True)
         # Qs_pi = T.cat(self.actor_critic.critic(O, pi), dim=1)
-        pi, log_pi, entropy = self.actor_critic.get_pi(O, on_policy=False, reparameterize=True, return_log_pi=True)
-        Qs_pi = T.cat(self.actor_critic.get_q(O, pi), dim=1)
-        min_Q_pi, _ = T.min(Qs_pi, dim=1, keepdim=True)
+        with self.amp.autocast():
+            pi, log_pi, entropy = self.actor_critic.get_pi(O, on_policy=False, reparameterize=True, return_log_pi=True)
+            Qs_pi = T.cat(self.actor_critic.get_q(O, pi), dim=1)
+            min_Q_pi, _ = T.min(Qs_pi, dim=1, keepdim=True)
 
 
-        # Policy Improvement
-        Jpi = (self.alpha * log_pi - min_Q_pi).mean()
+            # Policy Improvement
+            Jpi = (self.alpha * log_pi - min_Q_pi.float()).mean()
         # Jpi = -(self.alpha * entropy + min_Q_pi).mean()
         # print('pi=', pi)
         # print('log_pi=', log_pi)
@@ -516,9 +538,7 @@ class SAC(MFRL):
         # print('Jpi=', Jpi)
 
         # Gradient Ascent
-        self.actor_critic.actor.optimizer.zero_grad()
-        Jpi.backward()
-        self.actor_critic.actor.optimizer.step()
+        self.amp.step(Jpi, self.actor_critic.actor.optimizer)
 
         PiInfo['entropy'] = entropy.mean().item()
         PiInfo['log_pi'] = log_pi.mean().item()
@@ -529,10 +549,10 @@ class SAC(MFRL):
     def updateTarget(self):
         # print('updateTarget')
         tau = self.configs['critic']['tau']
-        with T.no_grad():
-            for p, p_targ in zip(self.actor_critic.critic.parameters(),
-                                 self.actor_critic.critic_target.parameters()):
-                p_targ.data.copy_(tau * p.data + (1 - tau) * p_targ.data)
+        with T.no_grad(): # p_targ = tau * p + (1 - tau) * p_targ, one multi-tensor kernel per op
+            params_targ = list(self.actor_critic.critic_target.parameters())
+            T._foreach_mul_(params_targ, 1 - tau)
+            T._foreach_add_(params_targ, list(self.actor_critic.critic.parameters()), alpha=tau)
 
 
 
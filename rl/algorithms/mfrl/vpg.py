@@ -193,15 +193,11 @@ class VPG(MFRL):
                     with T.no_grad(): v = self.actor_critic.get_v(T.Tensor(o))
                     self.buffer.traj_tail(d, v)
                     # Optimizing policy and value networks
-                    b_inds = np.arange(batch_size)
-                    for g in range(1, G+1):
-                        for b in range(0, batch_size, mini_batch_size):
-                            # print('ptr: ', self.buffer.ptr)
-                            mini_batch = self.buffer.sample_batch(mini_batch_size)
-                            Jv, Jpi, stop_pi = self.trainAC(g, mini_batch, oldJs)
-                            oldJs = [Jv, Jpi]
-                            JVList.append(Jv.item())
-                            JPiList.append(Jpi.item())
+                    for g, mini_batch in self.buffer.minibatches(mini_batch_size, G, fields=('observations', 'actions', 'returns', 'values', 'advantages', 'log_pis')): # G epochs
+                        Jv, Jpi, stop_pi = self.trainAC(g, mini_batch, oldJs)
+                        oldJs = [Jv, Jpi]
+                        JVList.append(Jv.item())
+                        JPiList.append(Jpi.item())
                     self.buffer.reset()
                 nt += E
 
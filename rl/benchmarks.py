@@ -0,0 +1,122 @@
+"""
+Microbenchmarks of the data paths (correctness: tests/)
+
+    python -m rl.benchmarks replay_buffer --size 1000000 --batch 100000
+    python -m rl.benchmarks traj_buffer --num_traj 250 --horizon 1000
+    python -m rl.benchmarks particles --batch 100000
+
+replay_buffer: store_batch (transitions/sec) and sample_batch (batches/sec) per storage option
+    (independent rows: next_obs=index stores both o and o' of every row, its worst case)
+traj_buffer: TrajBuffer.finish_path_batch vs a discount_cumsum loop per trajectory
+particles: FakeWorld.step, TS1/TSinf vs every elite on every row (MBPO Hopper ensemble, untrained)
+"""
+
+import time
+import argparse
+import tempfile
+
+import torch as T
+
+from rl.data.buffer import ReplayBuffer, TrajBuffer, discount_cumsum
+
+
+
+def timeit(fn, reps, device='cpu'):
+    # Seconds per call (one warm-up call)
+    fn()
+    if device == 'cuda': T.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(reps): fn()
+    if device == 'cuda': T.cuda.synchronize()
+    return (time.perf_counter() - start) / reps
+
+
+
+def replay_buffer(args):
+    obs_dim, act_dim, bs, size = args.obs_dim, args.act_dim, args.batch, args.size
+    # MBPO-style rollout batch: O, R, O_next, D are model outputs (torch), A from the actor
+    batch = (T.randn(bs, obs_dim), T.randn(bs, act_dim), T.randn(bs, 1), T.randn(bs, obs_dim), T.zeros(bs, 1, dtype=T.bool))
+    device = 'cuda' if T.cuda.is_available() else 'cpu'
+    options = {'default': {},
+               'float16 obs': dict(obs_dtype=T.float16),
+               'fused': dict(fused=True),
+               'next_obs=index': dict(next_obs='index'),
+               'memmap': dict(storage='memmap', path=tempfile.mkdtemp(prefix='replay_buffer_'))}
+    if device == 'cuda': # Ignored on CPU
+        options.update({'pinned': dict(pin_memory=True), 'on device': dict(on_device=True),
+                        'prefetch': dict(pin_memory=True, prefetch=True)})
+
+    print(f'ReplayBuffer | size={size} | batch={bs} | sample_batch={args.sample_batch} | device={device}')
+    for name, kwargs in options.items():
+        buffer = ReplayBuffer(obs_dim, act_dim, size, 0, device, **kwargs)
+        store = timeit(lambda: buffer.store_batch(*batch), args.reps)
+        sample = timeit(lambda: buffer.sample_batch(args.sample_batch, device)['observations'].sum().item(), args.sample_reps, device)
+        print(f'{name:>17}: {bs/store:.3e} transitions/sec | {1/sample:.3e} batches/sec')
+        buffer.close(delete=True)
+
+
+def traj_buffer(args):
+    N, H = args.num_traj, args.horizon
+    E = T.randint(1, H+1, (N, 1)).float()
+    E[0] = H # at least one full-horizon trajectory
+    buffer = TrajBuffer(args.obs_dim, args.act_dim, H, N, N*H, 0)
+    R, V = T.randn(N, H+1, 1), T.randn(N, H+1, 1)
+
+    def finish_path_loop():
+        for i, e in enumerate(E.long().reshape(-1).tolist()):
+            deltas = R[i, :e] + buffer.gamma * V[i, 1:e+1] - V[i, :e]
+            discount_cumsum(deltas, buffer.gamma * buffer.gae_lambda), discount_cumsum(R[i, :e+1], buffer.gamma)
+
+    def finish_path_batch():
+        buffer.reset()
+        for k in range(1, H+1): # N lockstep trajectories, as in MBPPO
+            buffer.store_batch(T.zeros(N, args.obs_dim), T.zeros(N, args.act_dim), R[:, k-1], T.zeros(N, args.obs_dim), V[:, k-1], T.zeros(N, 1), k)
+        start = time.perf_counter()
+        buffer.finish_path_batch(E, V[:, -1])
+        return time.perf_counter() - start
+
+    print(f'TrajBuffer | num_traj={N} | horizon={H} | {int(E.sum())} steps')
+    loop = timeit(finish_path_loop, args.reps)
+    batch = min(finish_path_batch() for _ in range(args.reps)) # without the stores
+    print(f'{"loop":>17}: {1e3*loop:.2f} ms/call')
+    print(f'{"finish_path_batch":>17}: {1e3*batch:.2f} ms/call | x{loop/batch:.2f}')
+
+
+def particles(args):
+    from rl.world_models.model import EnsembleDynamicsModel
+    from rl.world_models.fake_world import FakeWorld
+    device = 'cuda' if T.cuda.is_available() else 'cpu'
+    obs_dim, act_dim = 11, 3 # Hopper
+    wm = EnsembleDynamicsModel(7, 5, obs_dim, act_dim, 1, 200, use_decay=True, device=device)
+    wm.scaler.fit(T.randn(10000, obs_dim+act_dim, device=device))
+    fake_world = FakeWorld(wm, 'Hopper-v2')
+    O, A = T.randn(args.batch, obs_dim, device=device), T.randn(args.batch, act_dim, device=device)
+    members = fake_world.sample_members(args.batch)
+
+    print(f'FakeWorld.step | batch={args.batch} | 5 elites | device={device}')
+    old = timeit(lambda: wm.predict_elites(T.cat((O, A), -1)), args.reps, device)
+    print(f'{"all elites":>17}: {1e3*old:.1f} ms/step')
+    for name, m in (('TS1', None), ('TSinf', members)):
+        new = timeit(lambda: fake_world.step(O, A, members=m), args.reps, device)
+        print(f'{name:>17}: {1e3*new:.1f} ms/step | x{old/new:.2f}')
+
+
+
+BENCHMARKS = dict(replay_buffer=replay_buffer, traj_buffer=traj_buffer, particles=particles)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', choices=list(BENCHMARKS))
+    parser.add_argument('-reps', '--reps', type=int, default=10)
+    parser.add_argument('-obs_dim', '--obs_dim', type=int, default=11)
+    parser.add_argument('-act_dim', '--act_dim', type=int, default=3)
+    parser.add_argument('-size', '--size', type=int, default=int(1e6))
+    parser.add_argument('-batch', '--batch', type=int, default=int(1e5))
+    parser.add_argument('-sample_batch', '--sample_batch', type=int, default=256)
+    parser.add_argument('-sample_reps', '--sample_reps', type=int, default=2000)
+    parser.add_argument('-num_traj', '--num_traj', type=int, default=250)
+    parser.add_argument('-horizon', '--horizon', type=int, default=1000)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
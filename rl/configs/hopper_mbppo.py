@@ -49,6 +49,9 @@ configurations = {
             'eval_freq': 1, # Evaluate every 'eval_freq' epochs --> Ef
             'eval_episodes': 5, # Test policy for 'eval_episodes' times --> EE
             'eval_render_mode': None,
+            'eval_envs': 1, # Eval envs stepped together, one actor call for all
+            'eval_vec_env': 'dummy', # subproc | shmem | dummy
+            'eval_background': False, # Evaluate a snapshot of the actor in a background process
         }
     },
 
@@ -129,8 +132,11 @@ configurations = {
         'optimize_memory_usage': False,
         # 'init_obs_size': 50,
         'init_obs_size': 250,
+        'rollout_batch_size': 50, # initial states rolled out together (x num_ensembles trajectories)
         'buffer_size': int(1e4), # PAL: small- 1e4 | MAL: large- 1e5
         'ov_model_buffer_size': int(2e4),
+        'model_next_obs': 'copy', # copy: o' per row | index: o' rebuilt from the next row (+ last o' per trajectory)
+        'mini_batch_size': None, # PPO: shuffled minibatches per epoch (grad_PPO_steps epochs) | None: full model buffer
         'device': "auto",
     },
 
@@ -138,5 +144,8 @@ configurations = {
     'experiment': {
         'verbose': 0,
         'print_logs': True,
+        'profile': False, # per-phase time/throughput logs
+        'profile_trace': None, # Chrome trace json path (with profile)
+        'precision': 'fp32', # fp32 | bf16 (autocast) | fp16 (CUDA, loss scaling): updates and model training
     }
 }
@@ -8,6 +8,9 @@ configurations = {
             'state_space': 'continuous',
             'action_space': 'continuous',
             'horizon': 1e3,
+            'num_envs': 1, # >1: vectorized interaction (SAC/MBPO)
+            'vec_env': 'subproc', # subproc | shmem | async | dummy
+            'vec_batch_size': None, # async: envs per recv (first ready), None: num_envs
         },
 
     'algorithm': {
@@ -43,6 +46,9 @@ configurations = {
             'eval_freq': 1, # Evaluate every 'eval_freq' epochs --> Ef
             'eval_episodes': 5, # Test policy for 'eval_episodes' times --> EE
             'eval_render_mode': None,
+            'eval_envs': 1, # Eval envs stepped together, one actor call for all
+            'eval_vec_env': 'dummy', # subproc | shmem | dummy
+            'eval_background': False, # Evaluate a snapshot of the actor in a background process
         }
     },
 
@@ -52,6 +58,8 @@ configurations = {
         'num_ensembles': 7, # 7
         'num_elites': 5, # 5
         'sample_type': 'Random',
+        'propagation': 'TS1', # TS1 | TSinf: model rollouts keep an elite per particle
+        'compile': False, # T.compile the inference forward (rollouts)
         'learn_reward': True,
         # 'learn_log_sigma_limits': False,
         'oq_model_train_freq': 250,#250, # Mf
@@ -107,6 +115,7 @@ configurations = {
             'activation': 'PReLU',
             'op_activation': 'Identity',
             'initialize_weights': True,
+            'fused': False, # run the num_q Q-heads as one batched network (EnsembleSoftQFunction)
             'optimizer': "Adam",
             # 'lr': 1e-3, # Conv at Ep:?
             'lr': 3e-4, # Conv at Ep:340 | ReLU-16
@@ -130,5 +139,8 @@ configurations = {
     'experiment': {
         'verbose': 0,
         'print_logs': True,
+        'profile': False, # per-phase time/throughput logs
+        'profile_trace': None, # Chrome trace json path (with profile)
+        'precision': 'fp32', # fp32 | bf16 (autocast) | fp16 (CUDA, loss scaling): updates and model training
     }
 }
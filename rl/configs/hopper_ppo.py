@@ -32,6 +32,9 @@ configurations = {
             'eval_freq': 1, # Evaluate every 'eval_freq' epochs --> Ef
             'eval_episodes': 5, # Test policy for 'eval_episodes' times --> EE
             'eval_render_mode': None,
+            'eval_envs': 1, # Eval envs stepped together, one actor call for all
+            'eval_vec_env': 'dummy', # subproc | shmem | dummy
+            'eval_background': False, # Evaluate a snapshot of the actor in a background process
         }
     },
 
@@ -88,11 +91,16 @@ configurations = {
         'buffer_type': 'simple',
         'buffer_size': int(1e4),
         'batch_size': int(1e4),
+        'buffer_next_obs': 'copy', # copy: o' per row | index: o' rebuilt from the next row (+ last o' per trajectory)
+        'mini_batch_size': None, # Shuffled minibatches per epoch (grad_AC_steps epochs) | None: full batch
     },
 
     'experiment': {
         'verbose': 0,
         'print_logs': True,
+        'profile': False, # per-phase time/throughput logs
+        'profile_trace': None, # Chrome trace json path (with profile)
+        'precision': 'fp32', # fp32 | bf16 (autocast) | fp16 (CUDA, loss scaling): updates and model training
     }
 
 }
@@ -7,6 +7,9 @@ configurations = {
             'state_space': 'continuous',
             'action_space': 'continuous',
             'horizon': 1e3,
+            'num_envs': 1, # >1: vectorized interaction (SAC/MBPO)
+            'vec_env': 'subproc', # subproc | shmem | async | dummy
+            'vec_batch_size': None, # async: envs per recv (first ready), None: num_envs
         },
 
     'algorithm': {
@@ -33,6 +36,9 @@ configurations = {
             'eval_freq': 1, # Evaluate every 'eval_freq' epochs --> Ef
             'eval_episodes': 5, # Test policy for 'eval_episodes' times --> EE
             'eval_render_mode': None,
+            'eval_envs': 1, # Eval envs stepped together, one actor call for all
+            'eval_vec_env': 'dummy', # subproc | shmem | dummy
+            'eval_background': False, # Evaluate a snapshot of the actor in a background process
         }
     },
 
@@ -76,6 +82,7 @@ configurations = {
             # 'n_parameters': 1,
             'op_activation': 'Identity',
             'initialize_weights': True,
+            'fused': False, # run the num_q Q-heads as one batched network (EnsembleSoftQFunction)
             'optimizer': "Adam",
             # 'lr': 1e-3, # Conv at Ep:?
             'lr': 3e-4, # Conv at Ep:340 | ReLU-16
@@ -85,6 +92,15 @@ configurations = {
     'data': {
         'buffer_type': 'simple',
         'buffer_size': int(1e6),
+        'buffer_on_device': False, # keep replay storage on the training device
+        'buffer_pin_memory': False, # pinned host storage + non_blocking copies (CUDA)
+        'buffer_prefetch': False, # gather batch k+1 on a side stream while batch k trains (CUDA only, ignored on CPU)
+        'buffer_fused': False, # one [ o | a | r | o' | d ] storage: faster device/pinned/memmap sampling only, slower CPU writes
+        'buffer_next_obs': 'copy', # copy: o and o' per row | index: observations stored once, o' by index
+        'buffer_storage': 'memory', # memory | memmap: .npy files in buffer_path, paged by the OS, reopened from meta.json
+        'buffer_path': None, # memmap directory (None: a temporary one)
+        'buffer_readahead': True, # memmap: False for files much larger than RAM (MADV_RANDOM)
+        'buffer_sample_chunk': 1, # >1: batches of runs of consecutive rows (fewer pages read per batch on disk)
         # 'batch_size': 128,
         'batch_size': 256,
         # 'batch_size': 512
@@ -93,6 +109,9 @@ configurations = {
     'experiment': {
         'verbose': 0,
         'print_logs': True,
+        'profile': False, # per-phase time/throughput logs
+        'profile_trace': None, # Chrome trace json path (with profile)
+        'precision': 'fp32', # fp32 | bf16 (autocast) | fp16 (CUDA, loss scaling): updates and model training
     }
 
 }
@@ -8,6 +8,9 @@ configurations = {
             'state_space': 'continuous',
             'action_space': 'continuous',
             'horizon': 1e3,
+            'num_envs': 1, # >1: vectorized interaction (SAC/MBPO)
+            'vec_env': 'subproc', # subproc | shmem | async | dummy
+            'vec_batch_size': None, # async: envs per recv (first ready), None: num_envs
         },
 
     'algorithm': {
@@ -43,6 +46,9 @@ configurations = {
             'eval_freq': 1, # Evaluate every 'eval_freq' epochs --> Ef
             'eval_episodes': 5, # Test policy for 'eval_episodes' times --> EE
             'eval_render_mode': None,
+            'eval_envs': 1, # Eval envs stepped together, one actor call for all
+            'eval_vec_env': 'dummy', # subproc | shmem | dummy
+            'eval_background': False, # Evaluate a snapshot of the actor in a background process
         }
     },
 
@@ -52,10 +58,17 @@ configurations = {
         'num_ensembles': 7, # 7
         'num_elites': 5, # 5
         'sample_type': 'Random',
+        'propagation': 'TS1', # TS1 | TSinf: model rollouts keep an elite per particle
         'learn_reward': True,
         # 'learn_log_sigma_limits': False,
         'oq_model_train_freq': 250,#250, # Mf
         'model_retain_epochs': 1,
+        'max_train_epochs': None, # None: until the holdout MSEs stop improving
+        'max_train_time': None, # seconds per model refresh
+        'incremental_training': False, # warm-start refreshes on new data + a reservoir of old data
+        'refresh_epochs': 5, # epochs per incremental refresh
+        'reservoir_size': 5e4,
+        'compile': False, # T.compile the inference forward (rollouts)
         'oq_rollout_schedule': [20, 150, 1, 15], # original
         'network': {
             'arch': [200, 200, 200, 200], #@#
@@ -107,6 +120,7 @@ configurations = {
             'activation': 'PReLU',
             'output_activation': 'nn.Identity',
             'initialize_weights': True,
+            'fused': False, # run the num_q Q-heads as one batched network (EnsembleSoftQFunction)
             'optimizer': "Adam",
             # 'lr': 1e-3, # Conv at Ep:?
             'lr': 3e-4, # Conv at Ep:340 | ReLU-16
@@ -118,7 +132,22 @@ configurations = {
         'buffer_type': 'simple',
         'optimize_memory_usage': False,
         'buffer_size': int(5e5),
+        'buffer_on_device': False, # keep replay storage on the training device
+        'buffer_pin_memory': False, # pinned host storage + non_blocking copies (CUDA)
+        'buffer_prefetch': False, # gather batch k+1 on a side stream while batch k trains (CUDA only, ignored on CPU)
+        'buffer_fused': False, # one [ o | a | r | o' | d ] storage: faster device/pinned/memmap sampling only, slower CPU writes
+        'buffer_next_obs': 'copy', # copy: o and o' per row | index: observations stored once, o' by index
+        'buffer_storage': 'memory', # memory | memmap: .npy files in buffer_path, paged by the OS, reopened from meta.json
+        'buffer_path': None, # memmap directory (None: a temporary one)
+        'buffer_readahead': True, # memmap: False for files much larger than RAM (MADV_RANDOM)
+        'buffer_sample_chunk': 1, # >1: batches of runs of consecutive rows (fewer pages read per batch on disk)
         'model_buffer_size': int(1e7),
+        'model_obs_dtype': 'float32', # float32 | float16 | bfloat16
+        'model_next_obs': 'copy', # copy | index (pays off with longer rollouts)
+        'model_buffer_storage': 'memory', # memory | memmap (tens of millions of transitions)
+        'model_buffer_path': None, # memmap directory (None: a temporary one)
+        'model_readahead': True,
+        'model_sample_chunk': 1,
         'real_ratio': 0.05,
         'model_val_ratio': 0.2,
         'oq_rollout_batch_size': int(1e5),
@@ -130,5 +159,8 @@ configurations = {
     'experiment': {
         'verbose': 0,
         'print_logs': True,
+        'profile': False, # per-phase time/throughput logs
+        'profile_trace': None, # Chrome trace json path (with profile)
+        'precision': 'fp32', # fp32 | bf16 (autocast) | fp16 (CUDA, loss scaling): updates and model training
     }
 }
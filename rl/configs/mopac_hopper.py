@@ -75,6 +75,16 @@ configurations = {
 
     'traj_optz': {
         'type': 'MPC',
+        'optimizer': 'CEM', # CEM | MPPI
+        'horizon': 30,
+        'num_candidates': 500,
+        'num_particles': 20, # Per candidate, split over the elite models
+        'num_iters': 5,
+        'cem_elites': 50,
+        'cem_alpha': 0.1,
+        'mppi_temperature': 1.0,
+        'gamma': 1.0,
+        'rows_per_pass': 2048, # Candidates x particles per model pass (None: all, e.g. on GPU)
         'action_noise': None, # Optional
         'alpha': 0.2, # Temprature/Entropy #@#
         'automatic_entropy': False, # trainer_kwargs
@@ -2,26 +2,142 @@
 Model Predictive Controller
 """
 
+import numpy as np
+import torch as T
 
+from rl.environments.static import get_static_fns
 
 
 
 
 class MPC:
-    def __init__(self):
-        pass
+    """
+    Sampling-based MPC (PETS-style) over an EnsembleDynamicsModel, with CEM or MPPI updates
+
+        mpc = MPC(world_model, 'Hopper-v2', act_up_lim, act_low_lim, configs, device)
+        mpc.reset()                       # at the start of each episode
+        a = mpc.execute(o)                # ip: Numpy, op: Numpy
+
+    Each iteration samples num_candidates action sequences of length horizon (generate_acti_seq),
+    dreams them with num_particles particles each (dream) and scores them (evaluate_traj). The
+    candidates x particles rows are split over the elite members (particle p always uses elite
+    p % num_elites, TS-inf), so every model step is a single EnsembleModel pass over
+    num_elites x (num_candidates*num_particles/num_elites) rows (or over chunks of rows_per_pass
+    rows, see __init__). The action distribution is then
+    refitted (update_act_dist): CEM (mean/std of the top cem_elites, smoothed by cem_alpha) or
+    MPPI (exp(return/mppi_temperature)-weighted mean). After execute, the plan is shifted one step
+    (warm start of the next control step).
+
+    configs['traj_optz']:
+        optimizer: 'CEM' | 'MPPI', horizon, num_candidates, num_particles (rounded up to a multiple of
+        the elites), num_iters, cem_elites, cem_alpha, mppi_temperature, gamma, deterministic
+        (propagate the members' means), static_reward (use the env's static reward_fn, if any),
+        rows_per_pass
+    """
+    def __init__(self, world_model, env_name, act_up_lim, act_low_lim, configs, device):
+        mpc_configs = configs['traj_optz']
+        self.world_model = world_model # EnsembleDynamicsModel
+        self.static_fns = get_static_fns(env_name)
+        self._device_ = device
+
+        self.optimizer = mpc_configs.get('optimizer', 'CEM')
+        self.horizon = mpc_configs.get('horizon', 30)
+        self.num_candidates = mpc_configs.get('num_candidates', 500)
+        self.num_iters = mpc_configs.get('num_iters', 5)
+        self.cem_elites = mpc_configs.get('cem_elites', 50)
+        self.cem_alpha = mpc_configs.get('cem_alpha', 0.1)
+        self.mppi_temperature = mpc_configs.get('mppi_temperature', 1.0)
+        self.gamma = mpc_configs.get('gamma', 1.0)
+        self.deterministic = mpc_configs.get('deterministic', False)
+        self.static_reward = mpc_configs.get('static_reward', False) and self.static_fns.reward_fn is not None
+        # Candidates x particles rows per model pass: None, all of them (GPU); on CPU, passes with cache-sized activations are faster
+        self.rows_per_pass = mpc_configs.get('rows_per_pass', 2048 if str(device) == 'cpu' else None)
+        E = world_model.elite_size
+        self.num_particles = -(-mpc_configs.get('num_particles', 20) // E) * E
+        assert self.optimizer in ('CEM', 'MPPI'), "optimizer must be 'CEM' or 'MPPI'"
+
+        self.act_up_lim = T.as_tensor(act_up_lim, dtype=T.float32, device=device)
+        self.act_low_lim = T.as_tensor(act_low_lim, dtype=T.float32, device=device)
+        self.act_dim = self.act_up_lim.shape[0]
+        self.init_mean = (self.act_up_lim + self.act_low_lim) / 2
+        self.init_std = (self.act_up_lim - self.act_low_lim) / 4
+
+        self.reset()
+
+
+    def reset(self):
+        # Action distribution: horizon x act_dim
+        self.mean = self.init_mean.repeat(self.horizon, 1)
+        self.std = self.init_std.repeat(self.horizon, 1)
+
 
     def generate_acti_seq(self):
-        pass
+        # num_candidates x horizon x act_dim, within the action bounds
+        acts = self.mean + self.std * T.randn((self.num_candidates, self.horizon, self.act_dim), device=self._device_)
+        return T.max(T.min(acts, self.act_up_lim), self.act_low_lim)
+
+
+    def update_act_dist(self, acts, returns):
+        if self.optimizer == 'CEM':
+            elites = acts[T.topk(returns, self.cem_elites).indices]
+            self.mean = self.cem_alpha * self.mean + (1 - self.cem_alpha) * elites.mean(0)
+            self.std = self.cem_alpha * self.std + (1 - self.cem_alpha) * elites.std(0)
+        else: # MPPI
+            weights = T.softmax((returns - returns.max()) / self.mppi_temperature, 0)
+            self.mean = T.einsum('c,cha->ha', weights, acts)
+
+
+    def execute(self, o):
+        o = T.as_tensor(o, dtype=T.float32, device=self._device_)
+        if self.optimizer == 'MPPI': self.std = self.init_std.repeat(self.horizon, 1) # Fixed exploration noise
+        for _ in range(self.num_iters):
+            acts = self.generate_acti_seq()
+            returns = self.evaluate_traj(o, acts)
+            self.update_act_dist(acts, returns)
+        a = self.mean[0].clone()
+        # Warm start: shift the plan, append the initial distribution
+        self.mean = T.cat((self.mean[1:], self.init_mean[None]))
+        self.std = T.cat((self.std[1:], self.init_std[None]))
+        return a.cpu().numpy()
 
-    def update_act_dist(self):
-        pass
 
-    def execute(self):
-        pass
+    def dream(self, o, acts):
+        # o: obs_dim, acts: C x H x act_dim --> rewards, alive: H x E x (C*P/E)
+        wm = self.world_model
+        E, P, (C, H, _) = wm.elite_size, self.num_particles, acts.shape
+        N = C * P // E # Rows per elite
+        # Row n of elite e: candidate n // (P/E)
+        acts = acts.repeat_interleave(P // E, dim=0)[None].expand(E, -1, -1, -1) # E x N x H x act_dim
+        obs = o.expand(E, N, -1)
+        alive = T.ones((E, N), dtype=T.bool, device=self._device_)
+        rewards, alives = [], []
+        with T.inference_mode():
+            for h in range(H):
+                act = acts[:, :, h]
+                inputs = wm.scaler.transform(T.cat((obs, act), -1))
+                mean, var = wm.inference_model(inputs, ret_log_var=False, idx=wm.elite_idxes) # One pass: E x N x (1+obs_dim)
+                samples = mean if self.deterministic else mean + T.randn_like(mean) * var.sqrt()
+                next_obs = obs + samples[:, :, 1:]
+                if self.static_reward:
+                    r = self.static_fns.reward_fn(obs.reshape(E*N, -1), act.reshape(E*N, -1), next_obs.reshape(E*N, -1)).reshape(E, N)
+                else:
+                    r = samples[:, :, 0]
+                rewards.append(r)
+                alives.append(alive)
+                d = self.static_fns.termination_fn(obs.reshape(E*N, -1), act.reshape(E*N, -1), next_obs.reshape(E*N, -1)).reshape(E, N)
+                alive = alive & ~d
+                obs = next_obs
+        return T.stack(rewards), T.stack(alives)
 
-    def dream(self):
-        pass
 
-    def evaluate_traj(self):
-        pass
+    def evaluate_traj(self, o, acts):
+        # Discounted return of each candidate, averaged over its particles: num_candidates
+        chunk = len(acts) if self.rows_per_pass is None else max(self.rows_per_pass // self.num_particles, 1)
+        discounts = self.gamma ** T.arange(self.horizon, device=self._device_, dtype=T.float32)
+        returns = []
+        for acts_chunk in acts.split(chunk):
+            rewards, alives = self.dream(o, acts_chunk)
+            Z = (discounts[:, None, None] * T.where(alives, rewards, T.zeros_like(rewards))).sum(0) # E x N
+            Z = T.nan_to_num(Z, nan=-1e6, posinf=-1e6, neginf=-1e6) # Diverged particles (incl. overflowed rewards)
+            returns.append(Z.reshape(Z.shape[0], len(acts_chunk), -1).mean((0, 2)))
+        return T.cat(returns)
@@ -182,6 +182,7 @@ class StochasticPolicy(nn.Module):
 
 
 	def pi_prob(self, mean, std, reparameterize, return_log_prob, return_entropy=True):
+		mean, std = mean.float(), std.float() # fp32 under autocast: the tanh-squash log(1 - tanh^2) cancels in bf16
 		normal_ditribution = Normal(mean, std)
 
 		if reparameterize:
@@ -340,6 +341,7 @@ class OVOQPolicy(nn.Module):
                 return_log_prob,
                 return_entropy):
 
+		mean, std = mean.float(), std.float() # fp32 under autocast: the tanh-squash log(1 - tanh^2) cancels in bf16
 		normal_ditribution = Normal(mean, std)
 
 		if reparameterize:
@@ -489,6 +491,7 @@ class Policy(nn.Module):
                 return_entropy,
                 return_pre_prob=False):
 
+		mean, std = mean.float(), std.float() # fp32 under autocast: the tanh-squash log(1 - tanh^2) cancels in bf16
 		normal_ditribution = Normal(mean, std)
 
 		if reparameterize:
@@ -6,7 +6,13 @@ Inspired by:
 
 """
 
+import os
+import json
+import mmap
+import collections
 import random
+import shutil
+import tempfile
 # import scipy.signal
 import numpy as np
 import torch as T
@@ -42,6 +48,38 @@ def discount_cumsum(x, discount): # source: https://github.com/openai/spinningup
     return T.flip(T.tensor(y), [0])
 
 
+def gae_batch(R, V, E, gamma, gae_lambda):
+    """
+    Batched GAE-lambda advantages and rewards-to-go on a padded trajectories layout,
+    in one reverse scan over time (torch, on the device of the inputs).
+    input:
+        R, V: (num_traj, horizon+1, 1), R[i, E[i]] = V[i, E[i]] = bootstrap value
+        E: (num_traj,) trajectory lengths
+    output:
+        Adv, Ret: (num_traj, max(E), 1), zero beyond each trajectory length
+    """
+    E = E.reshape(-1).long().to(R.device)
+    N, H = len(E), int(E.max())
+    mask = (T.arange(H, device=R.device)[None, :] < E[:, None]).to(R.dtype) # (N, H)
+    r, v = R[:, :H+1, 0], V[:, :H+1, 0]
+    boot = R[T.arange(N, device=R.device), E, 0]
+
+    # Both recursions are x_t = X_t + c * x_t+1 once masked (the bootstrap enters as γ*V at t=e-1)
+    X = T.empty((H, N, 2), dtype=R.dtype, device=R.device)
+    X[:, :, 0] = ((r[:, :H] + gamma * v[:, 1:] - v[:, :H]) * mask).T
+    X[:, :, 1] = (r[:, :H] * mask).T
+    X[E-1, T.arange(N, device=R.device), 1] += gamma * boot * (E > 0)
+    c = T.tensor([gamma * gae_lambda, gamma], dtype=R.dtype, device=R.device)
+
+    Y = T.empty_like(X)
+    x = T.zeros_like(X[0])
+    for t in reversed(range(H)):
+        x = T.addcmul(X[t], c, x, out=Y[t])
+
+    Y = Y.permute(1, 0, 2)
+    return Y[:, :, :1], Y[:, :, 1:]
+
+
 
 
 
@@ -50,55 +88,83 @@ def discount_cumsum(x, discount): # source: https://github.com/openai/spinningup
 class TrajBuffer:
     """
     A simple buffer for storing trajectories
+
+    Transitions live in flat (capacity, dim) tensors; the live data is always the
+    contiguous slice [head:end], trajectories are indexed by (traj_start, traj_len)
+    over slots [first:last). Memory is proportional to stored transitions, horizon
+    only bounds a single trajectory (and the staging area of store_batch).
+
+    version counts the changes of the live data (trajectories added, evicted or
+    moved); the flat views of batch_data and their normalized advantages are
+    rebuilt only when it changed, not at every sample_batch.
+
+    next_obs: 'copy' stores o' per row. 'index' keeps no obs_next_buf: within a
+              trajectory o' of step t is o of step t+1, the o' of the last step is
+              kept per trajectory (last_obs); observations_next is rebuilt once
+              per version in batch_data.
     """
 
-    def __init__(self, obs_dim, act_dim, horizon, num_traj, max_size, seed, device='cpu', gamma=0.995, gae_lambda=0.99):
+    def __init__(self, obs_dim, act_dim, horizon, num_traj, max_size, seed, device='cpu', gamma=0.995, gae_lambda=0.99,
+                 next_obs='copy'):
         print('Initialize Trajectory Buffer')
-        self.obs_buf = T.zeros((num_traj, horizon, obs_dim), dtype=T.float32)
-        self.pre_act_buf = T.zeros((num_traj, horizon, act_dim), dtype=T.float32)
-        self.act_buf = T.zeros((num_traj, horizon, act_dim), dtype=T.float32)
-        self.rew_buf = T.zeros((num_traj, horizon+1, 1), dtype=T.float32)
-        self.obs_next_buf = T.zeros((num_traj, horizon, obs_dim), dtype=T.float32)
-        self.ter_buf = T.zeros((num_traj, horizon, 1), dtype=T.float32)
-        self.ret_buf = T.zeros((num_traj, horizon, 1), dtype=T.float32)
-        self.val_buf = T.zeros((num_traj, horizon+1, 1), dtype=T.float32)
-        self.adv_buf = T.zeros((num_traj, horizon, 1), dtype=T.float32)
-        self.log_pi_buf = T.zeros((num_traj, horizon, 1), dtype=T.float32)
-
-        self.ter_idx = T.zeros((num_traj, 1), dtype=T.float32)
+        assert next_obs in ('copy', 'index'), "next_obs must be 'copy' or 'index'"
+        horizon, num_traj, max_size = int(horizon), int(num_traj), int(max_size)
+        self.capacity = capacity = 2*max_size + horizon
+        self.obs_buf = T.zeros((capacity, obs_dim), dtype=T.float32)
+        self.pre_act_buf = T.zeros((capacity, act_dim), dtype=T.float32)
+        self.act_buf = T.zeros((capacity, act_dim), dtype=T.float32)
+        self.rew_buf = T.zeros((capacity, 1), dtype=T.float32)
+        self.obs_next_buf = T.zeros((capacity, obs_dim), dtype=T.float32) if next_obs == 'copy' else None
+        self.ter_buf = T.zeros((capacity, 1), dtype=T.float32)
+        self.ret_buf = T.zeros((capacity, 1), dtype=T.float32)
+        self.val_buf = T.zeros((capacity, 1), dtype=T.float32)
+        self.adv_buf = T.zeros((capacity, 1), dtype=T.float32)
+        self.log_pi_buf = T.zeros((capacity, 1), dtype=T.float32)
+
+        self.traj_start = T.zeros(num_traj, dtype=T.long)
+        self.traj_len = T.zeros(num_traj, dtype=T.long)
         self.ter_ret = T.zeros((num_traj, 1), dtype=T.float32)
+        self.last_obs = T.zeros((num_traj, obs_dim), dtype=T.float32) if next_obs == 'index' else None
+        self._o_next = None # o' of the running trajectory (next_obs='index')
 
+        self.next_obs = next_obs
         self.obs_dim, self.act_dim = obs_dim, act_dim
         self.horizon, self.num_traj, self.max_size = horizon, num_traj, max_size
-        self.ptr, self.last_traj = 0, 0
-        self.last_z = 0
+        self.head, self.end = 0, 0 # live transitions: [head:end]
+        self.first, self.last = 0, 0 # live trajectories: [first:last]
         self.gamma, self.gae_lambda = gamma, gae_lambda
         self.normz_adv = True
+        self.version, self._view_key = 0, None
+
+
+    @property
+    def ptr(self): # number of live trajectories
+        return self.last - self.first
+
+
+    def _bufs(self):
+        bufs = dict(obs=self.obs_buf, pre_act=self.pre_act_buf, act=self.act_buf, rew=self.rew_buf,
+                    obs_next=self.obs_next_buf, ter=self.ter_buf, ret=self.ret_buf, val=self.val_buf,
+                    adv=self.adv_buf, log_pi=self.log_pi_buf)
+        return {k: buf for k, buf in bufs.items() if buf is not None}
 
 
     def total_size(self):
-        last_idx = min(self.last_traj+1, self.num_traj)
-        return int(self.ter_idx[:last_idx].sum())
+        return self.end - self.head
 
 
     def average_horizon(self):
-        last_idx = min(self.last_traj+1, self.num_traj)
-        total_size = self.ter_idx[:last_idx].sum()
-        live_traj = T.count_nonzero(self.ter_idx[:last_idx])
-        # print('live_traj: ', )
+        live_traj = self.last - self.first
         if live_traj > 0:
-            return int(total_size//live_traj)
+            return int(self.total_size()//live_traj)
         else:
             return 0
 
 
     def average_return(self):
-        last_idx = min(self.last_traj+1, self.num_traj)
-        total_size = self.ter_ret[:last_idx].sum()
-        live_traj = T.count_nonzero(self.ter_ret[:last_idx])
-        # print('live_traj: ', )
+        live_traj = self.last - self.first
         if live_traj > 0:
-            return int(total_size//live_traj)
+            return int(self.ter_ret[self.first:self.last].sum()//live_traj)
         else:
             return 0
 
@@ -107,81 +173,113 @@ class TrajBuffer:
         return (x - x.mean()) / (x.std() + 1e-8)
 
 
-    def clean_buffer(self):
-        # print('Clean Buffer: Max size reached!'+(' ')*50)
-        if self.last_traj == self.num_traj-1:
-            ptr = self.ptr
-        else:
-            ptr = self.last_z
-        a = ptr
-        while self.total_size() >= self.max_size:
-            # print(f'Reduce buffer size: ptr={ptr}')
-            self.ter_idx[ptr] = 0
-            ptr += 1
-            if ptr == self.num_traj:
-                ptr = 0
-        self.last_z = z = ptr
-        # print(f'Reduce buffer size: a={a}-->z={z} | ptr={self.ptr} | last_traj={self.last_traj} | size={self.total_size()}')
+    def clean_buffer(self, extra=0):
+        # Evict the oldest whole trajectories until total_size+extra <= max_size (advance first/head)
+        if self.total_size() + extra <= self.max_size: return
+        kept = self.total_size() - T.cumsum(self.traj_len[self.first:self.last], 0)
+        k = int(T.searchsorted(-kept, -T.tensor(self.max_size - extra))) + 1
+        k = min(k, self.last - self.first)
+        self.first += k
+        self.head = int(self.traj_start[self.first]) if self.first < self.last else self.end
+        self.version += 1
+        # print(f'Reduce buffer size: evicted={k} | size={self.total_size()}')
+
+
+    def _compact(self, open_len=0):
+        # Move the live data (+ an open trajectory of open_len steps) to the front
+        n = self.end + open_len - self.head
+        if self.head > 0:
+            for buf in self._bufs().values():
+                buf[:n] = buf[self.head:self.head+n].clone()
+            self.traj_start[self.first:self.last] -= self.head
+            self.end -= self.head
+            self.head = 0
+            self.version += 1
+        if self.first > 0:
+            live = self.last - self.first
+            self.traj_start[:live] = self.traj_start[self.first:self.last].clone()
+            self.traj_len[:live] = self.traj_len[self.first:self.last].clone()
+            self.ter_ret[:live] = self.ter_ret[self.first:self.last].clone()
+            if self.last_obs is not None: self.last_obs[:live] = self.last_obs[self.first:self.last].clone()
+            self.first, self.last = 0, live
+
+
+    def _make_room(self, n, k=1, open_len=0):
+        # Room for n more transitions and k more trajectories: the oldest trajectories are evicted down to
+        # max_size first, the data is moved to the front only when the capacity (compaction margin) is hit
+        self.clean_buffer(extra=n+open_len)
+        if self.end + open_len + n > self.capacity or self.last + k > self.num_traj:
+            self._compact(open_len)
+        if self.last + k > self.num_traj: # more live trajectories than slots: grow the index
+            self.num_traj = max(2*self.num_traj, self.last + k)
+            self.traj_start = T.cat([self.traj_start, T.zeros(self.num_traj-len(self.traj_start), dtype=T.long)])
+            self.traj_len = T.cat([self.traj_len, T.zeros(self.num_traj-len(self.traj_len), dtype=T.long)])
+            self.ter_ret = T.cat([self.ter_ret, T.zeros((self.num_traj-len(self.ter_ret), 1))])
+            if self.last_obs is not None:
+                self.last_obs = T.cat([self.last_obs, T.zeros((self.num_traj-len(self.last_obs), self.obs_dim))])
+        assert self.end + open_len + n <= self.capacity, "TrajBuffer: batch larger than the buffer"
+
+
+    def _add_traj(self, e):
+        self.traj_start[self.last] = self.end
+        self.traj_len[self.last] = e
+        self.ter_ret[self.last] = self.rew_buf[self.end:self.end+e].sum()
+        if self.last_obs is not None and self._o_next is not None: self.last_obs[self.last] = self._o_next
+        self.last += 1
+        self.end += e
+        self.version += 1
 
 
     def batch_data(self, recent=False):
-        full_size = self.total_size()
-
-        self.obs_batch = T.zeros((full_size, self.obs_dim), dtype=T.float32)
-        self.pre_act_batch = T.zeros((full_size, self.act_dim), dtype=T.float32)
-        self.act_batch = T.zeros((full_size, self.act_dim), dtype=T.float32)
-        self.rew_batch = T.zeros((full_size, 1), dtype=T.float32)
-        self.obs_next_batch = T.zeros((full_size, self.obs_dim), dtype=T.float32)
-        self.ter_batch = T.zeros((full_size, 1), dtype=T.float32)
-        self.ret_batch = T.zeros((full_size, 1), dtype=T.float32)
-        self.val_batch = T.zeros((full_size, 1), dtype=T.float32)
-        self.adv_batch = T.zeros((full_size, 1), dtype=T.float32)
-        self.log_pi_batch = T.zeros((full_size, 1), dtype=T.float32)
-
-        i = 0
-        for traj in range(self.last_traj+1):
-            j = int(self.ter_idx[traj])
-            self.obs_batch[i:i+j] = self.obs_buf[traj, :j, :]
-            self.pre_act_batch[i:i+j] = self.pre_act_buf[traj, :j, :]
-            self.act_batch[i:i+j] = self.act_buf[traj, :j, :]
-            self.rew_batch[i:i+j] = self.rew_buf[traj, :j, :]
-            self.obs_next_batch[i:i+j] = self.obs_next_buf[traj, :j, :]
-            self.ter_batch[i:i+j] = self.ter_buf[traj, :j, :]
-            self.ret_batch[i:i+j] = self.ret_buf[traj, :j, :]
-            self.val_batch[i:i+j] = self.val_buf[traj, :j, :]
-            self.adv_batch[i:i+j] = self.adv_buf[traj, :j, :]
-            self.log_pi_batch[i:i+j] = self.log_pi_buf[traj, :j, :]
-
-            i = i+j
-
-        if recent:
-            self.obs_batch = self.obs_batch[-recent:]
-            self.pre_act_batch = self.pre_act_batch[-recent:]
-            self.act_batch = self.act_batch[-recent:]
-            self.rew_batch = self.rew_batch[-recent:]
-            self.obs_next_batch = self.obs_next_batch[-recent:]
-            self.ter_batch = self.ter_batch[-recent:]
-            self.ret_batch = self.ret_batch[-recent:]
-            self.val_batch = self.val_batch[-recent:]
-            self.adv_batch = self.adv_batch[-recent:]
-            self.log_pi_batch = self.log_pi_batch[-recent:]
+        # Views of the live data (single slices, no copy), rebuilt when the live data changed
+        key = (self.version, recent, self.normz_adv)
+        if key == self._view_key: return
+        self._view_key = key
+        start = max(self.head, self.end - recent) if recent else self.head
+        self.obs_batch = self.obs_buf[start:self.end]
+        self.pre_act_batch = self.pre_act_buf[start:self.end]
+        self.act_batch = self.act_buf[start:self.end]
+        self.rew_batch = self.rew_buf[start:self.end]
+        self.obs_next_batch = self.obs_next_buf[start:self.end] if self.obs_next_buf is not None else self._obs_next(start)
+        self.ter_batch = self.ter_buf[start:self.end]
+        self.ret_batch = self.ret_buf[start:self.end]
+        self.val_batch = self.val_buf[start:self.end]
+        self.adv_batch = self.adv_buf[start:self.end]
+        self.log_pi_batch = self.log_pi_buf[start:self.end]
+        # Adv normalization, once per version (over the live data)
+        self.adv_normz_batch = self.normalize(self.adv_batch) if self.normz_adv else self.adv_batch
+
+
+    def _obs_next(self, start):
+        # next_obs='index': o' of [start:end] = o shifted by one, the last step of each trajectory from last_obs
+        O_next = T.empty((self.end - start, self.obs_dim), dtype=T.float32)
+        O_next[:-1] = self.obs_buf[start+1:self.end]
+        ends = self.traj_start[self.first:self.last] + self.traj_len[self.first:self.last] - 1 - start
+        live = ends >= 0
+        O_next[ends[live]] = self.last_obs[self.first:self.last][live]
+        return O_next
 
 
     def store_transition(self, o, pre_a, a, r, o_next, d, v, log_pi, e):
         assert self.total_size() < self.max_size
+        if self.end + e > self.capacity:
+            self._make_room(1, k=1, open_len=e-1)
+        i = self.end + e-1
 
-        self.obs_buf[ self.ptr, e-1, : ] = T.Tensor(o)
-        self.pre_act_buf[ self.ptr, e-1, : ] = T.Tensor(pre_a)
-        self.act_buf[ self.ptr, e-1, : ] = T.Tensor(a)
-        self.rew_buf[ self.ptr, e-1, : ] = T.tensor(r)
-        self.obs_next_buf[ self.ptr, e-1, : ] = T.Tensor(o_next)
-        # self.ter_buf[ self.ptr, e-1, : ] = T.Tensor([d])
-        self.val_buf[ self.ptr, e-1, : ] = T.Tensor(v)
-        self.log_pi_buf[ self.ptr, e-1, : ] = T.Tensor(log_pi)
+        self.obs_buf[i] = T.as_tensor(o)
+        self.pre_act_buf[i] = T.as_tensor(pre_a)
+        self.act_buf[i] = T.as_tensor(a)
+        self.rew_buf[i] = T.as_tensor(r)
+        if self.obs_next_buf is None: self._o_next = T.as_tensor(o_next)
+        else: self.obs_next_buf[i] = T.as_tensor(o_next)
+        self.ter_buf[i] = float(d)
+        self.val_buf[i] = T.as_tensor(v)
+        self.log_pi_buf[i] = T.as_tensor(log_pi)
 
 
     def traj_tail(self, next_done, next_value, e): # Source: CleanRL
         # print('ptr: ', self.ptr)
+        s = self.end
         next_done = T.Tensor([next_done])
         if self.gae_lambda: # GAE-lambda
             lastgaelam = 0
@@ -190,141 +288,136 @@ class TrajBuffer:
                     next_nonterminal = 1.0 - next_done
                     next_values = next_value
                 else:
-                    next_nonterminal = 1.0 - self.ter_buf[ self.ptr, t + 1, : ]
-                    next_values = self.val_buf[ self.ptr, t + 1, : ]
-                delta = self.rew_buf[ self.ptr, t, : ] + self.gamma * next_values * next_nonterminal - self.val_buf[ self.ptr, t, : ]
-                self.adv_buf[ self.ptr, t, : ] = lastgaelam = delta + self.gamma * self.gae_lambda * next_nonterminal * lastgaelam
-            self.ret_buf[self.ptr] = self.adv_buf[self.ptr] + self.val_buf[self.ptr]
-
-        self.ter_idx[self.ptr] = e
+                    next_nonterminal = 1.0 - self.ter_buf[ s+t+1 ]
+                    next_values = self.val_buf[ s+t+1 ]
+                delta = self.rew_buf[ s+t ] + self.gamma * next_values * next_nonterminal - self.val_buf[ s+t ]
+                self.adv_buf[ s+t ] = lastgaelam = delta + self.gamma * self.gae_lambda * next_nonterminal * lastgaelam
+            self.ret_buf[s:s+e] = self.adv_buf[s:s+e] + self.val_buf[s:s+e]
 
-        # if self.total_size() > self.max_size:
-        #     self.ptr = 0
-        #     print('new buffer!')
-        # else:
-        self.ptr +=1
-        # print(f'new trajectory [{self.ptr}]')
+        self._make_room(0, k=1, open_len=e)
+        self._add_traj(e)
 
 
     def store(self, o, pre_a, a, r, o_next, v, log_pi, e):
         if self.total_size() >= self.max_size:
             self.clean_buffer()
-        self.obs_buf[ self.ptr, e-1, : ] = T.Tensor(o)
-        self.pre_act_buf[ self.ptr, e-1, : ] = T.Tensor(pre_a)
-        self.act_buf[ self.ptr, e-1, : ] = T.Tensor(a)
-        self.rew_buf[ self.ptr, e-1, : ] = T.tensor(r)
-        self.obs_next_buf[ self.ptr, e-1, : ] = T.Tensor(o_next)
-        # self.ter_buf[ self.ptr, e-1, : ] = T.Tensor([d])
-        self.val_buf[ self.ptr, e-1, : ] = T.Tensor(v)
-        self.log_pi_buf[ self.ptr, e-1, : ] = T.Tensor(log_pi)
+        if self.end + e > self.capacity:
+            self._make_room(1, k=1, open_len=e-1)
+        i = self.end + e-1
+        self.obs_buf[i] = T.as_tensor(o)
+        self.pre_act_buf[i] = T.as_tensor(pre_a)
+        self.act_buf[i] = T.as_tensor(a)
+        self.rew_buf[i] = T.as_tensor(r)
+        if self.obs_next_buf is None: self._o_next = T.as_tensor(o_next)
+        else: self.obs_next_buf[i] = T.as_tensor(o_next)
+        # self.ter_buf[i] = T.Tensor([d])
+        self.val_buf[i] = T.as_tensor(v)
+        self.log_pi_buf[i] = T.as_tensor(log_pi)
 
 
     def finish_path(self, e, v):
         # print(f'\n[ finish_path ] e={e} | ptr={self.ptr} | size={self.total_size()}')
-        self.rew_buf[ self.ptr, e, : ] = T.Tensor(v)
-        self.val_buf[ self.ptr, e, : ] = T.Tensor(v)
+        self._make_room(0, k=1, open_len=e)
+        s = self.end
+        v = T.as_tensor(v, dtype=T.float32).reshape(1, 1)
         # the next two lines implement GAE-Lambda advantage calculation
-        deltas = self.rew_buf[ self.ptr, :e, : ] + self.gamma * self.val_buf[ self.ptr, 1:e+1, : ] - self.val_buf[ self.ptr, :e, : ]
-        self.adv_buf[ self.ptr, :e, : ] = discount_cumsum(deltas, self.gamma * self.gae_lambda)
+        vals = T.cat([self.val_buf[s:s+e], v])
+        deltas = self.rew_buf[s:s+e] + self.gamma * vals[1:] - vals[:-1]
+        self.adv_buf[s:s+e] = discount_cumsum(deltas, self.gamma * self.gae_lambda)
         # the next line computes rewards-to-go, to be targets for the value function
-        self.ret_buf[ self.ptr, :e, : ] = discount_cumsum(self.rew_buf[ self.ptr, :e+1, : ], self.gamma)[:e, :]
-        self.ter_idx[self.ptr] = e
-        # self.ter_ret[self.ptr] = self.ret_buf[ self.ptr, e, : ]
-        # print(f'\n[ finish_path ] e={e} | ptr={self.ptr} | size={self.total_size()}')
-        if self.last_traj < self.num_traj-1:
-            self.ptr +=1
-            self.last_traj +=1
-        elif self.ptr < self.num_traj-1:
-            self.ptr +=1
-        else:
-            self.ptr = 0
+        self.ret_buf[s:s+e] = discount_cumsum(T.cat([self.rew_buf[s:s+e], v]), self.gamma)[:e]
+        self._add_traj(e)
 
 
-    def store_batch(self, O, A, R, O_next, V, Log_Pi, e):
-        # print('store_batch!')
-        if self.total_size() >= self.max_size:
-            self.clean_buffer()
+    def _stage(self, batch_size):
+        # Padded (batch_size, horizon+1, dim) staging area for trajectories generated in parallel
+        self.stage = {k: T.zeros((batch_size, self.horizon+1, buf.shape[-1]), dtype=T.float32)
+                      for k, buf in self._bufs().items()}
+        if self.obs_next_buf is None: self.stage['obs_next'] = T.zeros((batch_size, self.horizon+1, self.obs_dim))
+
 
+    def store_batch(self, O, A, R, O_next, V, Log_Pi, e, Pre_A=None, rows=None):
+        # rows: write step e of these staged trajectories only (the still running ones),
+        #       the stage is (re)allocated by a call with rows=None
+        # print('store_batch!')
         batch_size = len(O)
+        if rows is None:
+            if e == 1 or not hasattr(self, 'stage') or len(self.stage['obs']) != batch_size:
+                self._stage(batch_size)
+            rows = slice(None)
 
-        self.obs_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(O)
-        self.act_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(A)
-        self.rew_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.tensor(R)
-        self.obs_next_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(O_next)
-        # self.ter_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor([d])
-        self.val_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(V)
-        self.log_pi_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(Log_Pi)
+        self.stage['obs'][ rows, e-1 ] = T.as_tensor(O)
+        if Pre_A is not None: self.stage['pre_act'][ rows, e-1 ] = T.as_tensor(Pre_A)
+        self.stage['act'][ rows, e-1 ] = T.as_tensor(A)
+        self.stage['rew'][ rows, e-1 ] = T.as_tensor(R).reshape(batch_size, -1)
+        self.stage['obs_next'][ rows, e-1 ] = T.as_tensor(O_next)
+        # self.stage['ter'][ :, e-1 ] = T.Tensor([d])
+        self.stage['val'][ rows, e-1 ] = T.as_tensor(V).reshape(batch_size, -1)
+        self.stage['log_pi'][ rows, e-1 ] = T.as_tensor(Log_Pi).reshape(batch_size, -1)
 
 
     def finish_path_batch(self, E, V):
         # print('finish_path_batch!')
         # print(f'\n[ finish_path_batch ] ptr={self.ptr} | size={self.total_size()}')
         batch_size = len(E)
-        for i, e in enumerate(E):
-            e = int(e)
-            # print(f'ptr={self.ptr} | i={i} | e={e} | V={V[i]}')
-            self.rew_buf[ self.ptr+i, e, : ] = T.Tensor(V[i])
-            self.val_buf[ self.ptr+i, e, : ] = T.Tensor(V[i])
-            deltas = self.rew_buf[ self.ptr+i, :e, : ] + self.gamma * self.val_buf[ self.ptr+i, 1:e+1, : ] - self.val_buf[ self.ptr+i, :e, : ]
-            self.adv_buf[ self.ptr+i, :e, : ] = discount_cumsum(deltas, self.gamma * self.gae_lambda)
-            self.ret_buf[ self.ptr+i, :e, : ] = discount_cumsum(self.rew_buf[ self.ptr+i, :e+1, : ], self.gamma)[:e, :]
-
-        self.ter_idx[self.ptr:self.ptr+batch_size] = E
-
-        # A = T.cat([E,self.adv_buf[self.ptr:self.ptr+batch_size, :int(E.max()), :],self.ret_buf[self.ptr:self.ptr+batch_size, :int(E.max()), :]], axis=1)
-
-        # print(f'\n[ finish_path ] e={e} | ptr={self.ptr} | size={self.total_size()}')
-        if self.last_traj < self.num_traj-1:
-            self.ptr +=batch_size
-            self.last_traj +=batch_size
-        elif self.ptr < self.num_traj-1:
-            self.ptr +=batch_size
-        else:
-            self.ptr = 0
+        E = T.as_tensor(E).reshape(-1).long()
+        V = T.as_tensor(V, dtype=T.float32).reshape(-1, 1)
+        idx = T.arange(batch_size)
+        self.stage['rew'][ idx, E ] = V
+        self.stage['val'][ idx, E ] = V
+        Adv, Ret = gae_batch(self.stage['rew'], self.stage['val'], E, self.gamma, self.gae_lambda)
+        H = Adv.shape[1]
+        self.stage['adv'][:, :H], self.stage['ret'][:, :H] = Adv, Ret
+
+        # Append the live rows of all trajectories, one copy per field; of a batch larger than max_size
+        # only the last trajectories that fit are kept
+        keep = E > 0
+        if int(E.sum()) > self.max_size: keep &= T.flip(T.cumsum(T.flip(E, [0]), 0), [0]) <= self.max_size
+        mask = (T.arange(H)[None, :] < E[:, None]) & keep[:, None]
+        Z = (self.stage['rew'][:, :H, 0] * mask).sum(1, keepdim=True)
+        if self.last_obs is not None: O_last = self.stage['obs_next'][idx, (E-1).clamp(min=0)][keep]
+        Z, E = Z[keep], E[keep]
+        n, k = int(E.sum()), len(E)
+        self._make_room(n, k=k)
+        rows = (T.arange(batch_size)[:, None] * (self.horizon+1) + T.arange(H)[None, :])[mask]
+        for key, buf in self._bufs().items():
+            stage = self.stage[key].view(-1, buf.shape[-1])
+            T.index_select(stage, 0, rows, out=buf[self.end:self.end+n])
+        self.traj_start[self.last:self.last+k] = self.end + T.cumsum(E, 0) - E
+        self.traj_len[self.last:self.last+k] = E
+        self.ter_ret[self.last:self.last+k] = Z
+        if self.last_obs is not None: self.last_obs[self.last:self.last+k] = O_last
+        self.last += k
+        self.end += n
+        self.version += 1
 
 
     def store_transition_batch(self, O, A, R, D, V, log_Pi, e):
         assert self.total_size() < self.max_size
 
         batch_size = len(O[:,0])
+        if e == 1 or not hasattr(self, 'stage') or len(self.stage['obs']) != batch_size:
+            self._stage(batch_size)
 
-        self.obs_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(O)
-        self.act_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(A)
-        self.rew_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.tensor(R.reshape(-1,1))
-        self.ter_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.tensor(D, dtype=T.bool)
-        self.val_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(V)
-        self.log_pi_buf[ self.ptr:self.ptr+batch_size, e-1, : ] = T.Tensor(log_Pi)
-
-        # self.ptr +=batch_size
+        self.stage['obs'][ :, e-1 ] = T.as_tensor(O)
+        self.stage['act'][ :, e-1 ] = T.as_tensor(A)
+        self.stage['rew'][ :, e-1 ] = T.as_tensor(R).reshape(-1,1)
+        self.stage['ter'][ :, e-1 ] = T.as_tensor(D).reshape(-1,1).float()
+        self.stage['val'][ :, e-1 ] = T.as_tensor(V).reshape(-1,1)
+        self.stage['log_pi'][ :, e-1 ] = T.as_tensor(log_Pi).reshape(-1,1)
 
 
     def traj_tail_batch(self, next_done, next_value, e): # Source: CleanRL
-        # print('ptr: ', self.ptr)
-        # next_done = T.Tensor([next_done])
-        # if self.gae_lambda: # GAE-lambda
-        #     lastgaelam = 0
-        #     for t in reversed(range(e)):
-        #         if t == e - 1:
-        #             next_nonterminal = 1.0 - next_done
-        #             next_values = next_value
-        #         else:
-        #             next_nonterminal = 1.0 - self.ter_buf[self.ptr][t + 1]
-        #             next_values = self.val_buf[self.ptr][t + 1]
-        #         delta = self.rew_buf[self.ptr][t] + self.gamma * next_values * next_nonterminal - self.val_buf[self.ptr][t]
-        #         self.adv_buf[self.ptr][t] = lastgaelam = delta + self.gamma * self.gae_lambda * next_nonterminal * lastgaelam
-        #     self.ret_buf[self.ptr] = self.adv_buf[self.ptr] + self.val_buf[self.ptr]
-
-        self.ter_idx[self.ptr] = e
-        if self.total_size() > self.max_size:
-            self.ptr = 0
-        else:
-            self.ptr +=batch_size
+        # Lockstep trajectories of length e, bootstrapped unless done
+        next_done = T.as_tensor(next_done, dtype=T.float32).reshape(-1, 1)
+        next_value = T.as_tensor(next_value, dtype=T.float32).reshape(-1, 1)
+        E = T.full((len(next_value),), e)
+        self.finish_path_batch(E, (1.0 - next_done) * next_value)
 
 
     def sample_batch(self, batch_size=64, recent=False, device=False):
         # if self.total_size() >= self.max_size:
         #     self.clean_buffer()
-        # assert self.ptr == self.max_size
         # device = self.device
         batch_size = min(batch_size, self.total_size())
         if recent:
@@ -334,10 +427,6 @@ class TrajBuffer:
 
         self.batch_data(recent)
 
-        # Adv normalization
-        if self.normz_adv:
-            self.adv_batch[idxs] = self.normalize(self.adv_batch[idxs])
-
         batch = dict(observations=self.obs_batch[idxs], # 1
         			 pre_actions=self.pre_act_batch[idxs], # 2.1
         			 actions=self.act_batch[idxs], # 2.2
@@ -346,7 +435,7 @@ class TrajBuffer:
                      terminals=self.ter_batch[idxs], # 5
         			 returns=self.ret_batch[idxs], # 6
                      values=self.val_batch[idxs], # 7
-        			 advantages=self.adv_batch[idxs], # 8
+        			 advantages=self.adv_normz_batch[idxs], # 8
         			 log_pis=self.log_pi_batch[idxs] # 9
                      )
         if device:
@@ -355,18 +444,46 @@ class TrajBuffer:
             return {k: v            for k,v in batch.items()}
 
 
+    def minibatches(self, mini_batch_size=None, epochs=1, recent=False, device=False, fields=None):
+        # Shuffled minibatch epochs over the live data: yields (epoch, batch), every transition once per epoch.
+        # One permutation per epoch, the data gathered once in that order (then moved to device),
+        # minibatches are contiguous slices of it; mini_batch_size None (or >= size): full batch, no gather.
+        # fields: keys to return, in order (default: the sample_batch keys)
+        self.batch_data(recent)
+        data = dict(observations=self.obs_batch,
+        			pre_actions=self.pre_act_batch,
+        			actions=self.act_batch,
+                    observations_next=self.obs_next_batch,
+        			rewards=self.rew_batch,
+                    terminals=self.ter_batch,
+        			returns=self.ret_batch,
+                    values=self.val_batch,
+        			advantages=self.adv_normz_batch,
+        			log_pis=self.log_pi_batch)
+        if fields: data = {k: data[k] for k in fields}
+        size = len(self.obs_batch)
+        mini_batch_size = min(int(mini_batch_size or size), size)
+        shuffle = mini_batch_size < size
+        if device and not shuffle: data = {k: v.to(device) for k,v in data.items()} # Once for all epochs
+
+        for epoch in range(1, epochs+1):
+            if shuffle:
+                perm = T.from_numpy(np.random.permutation(size))
+                epoch_data = {k: v[perm] for k,v in data.items()}
+                if device: epoch_data = {k: v.to(device) for k,v in epoch_data.items()}
+            else:
+                epoch_data = data
+            for start in range(0, size, mini_batch_size):
+                yield epoch, {k: v[start:start+mini_batch_size] for k,v in epoch_data.items()}
+
+
     def sample_batch_for_reply(self, batch_size=64, recent=False, device=False):
-        # assert self.ptr == self.max_size
         # device = self.device
         batch_size = min(batch_size, self.total_size())
         idxs = np.random.randint(0, self.total_size(), size=batch_size)
 
         self.batch_data(recent)
 
-        # Adv normalization
-        if self.normz_adv:
-            self.adv_batch[idxs] = self.normalize(self.adv_batch[idxs])
-
         batch = dict(observations=self.obs_batch[idxs],
         			 actions=self.act_batch[idxs],
         			 rewards=self.rew_batch[idxs],
@@ -381,39 +498,11 @@ class TrajBuffer:
 
     def update_init_obs(self):
         # print('update_init_obs!')
-        old_size = len(self.init_obs)
-        if self.ptr > old_size:
-            start = old_size
-            add_size = self.ptr - old_size
-        else:
-            start = 0
-            add_size = self.ptr
-        # print(f'ptr={self.ptr} | add_size={add_size}')
-        new_init_obs = T.zeros((old_size+add_size, self.obs_dim), dtype=T.float32)
-        new_init_obs[:old_size] = self.init_obs
-
-        i = old_size
-        for traj in range(start, start+add_size+1):
-            j = int(self.ter_idx[traj])
-            if j > 0:
-                new_init_obs[i, :] = self.obs_buf[traj, 0, :]
-                i +=1
-        self.init_obs = new_init_obs
+        self.init_obs = self.obs_buf[self.traj_start[self.first:self.last]]
 
 
     def sample_init_obs_batch(self, batch_size=200, device=False):
-        if not hasattr(self, 'init_obs'):
-            last_idx = min(self.ptr+1, self.num_traj)
-            live_traj = T.count_nonzero(self.ter_idx[:last_idx])
-            self.init_obs = T.zeros((live_traj, self.obs_dim), dtype=T.float32)
-            i = 0
-            for traj in range(self.last_traj+1):
-                j = int(self.ter_idx[traj])
-                if j > 0:
-                    self.init_obs[i, :] = self.obs_buf[traj, 0, :]
-                    i +=1
-        elif (self.ptr > len(self.init_obs)) or (self.ptr < self.last_traj):
-            self.update_init_obs()
+        self.update_init_obs()
 
         batch_size = min(batch_size, len(self.init_obs))
         idxs = np.random.randint(0, len(self.init_obs), size=batch_size)
@@ -425,18 +514,15 @@ class TrajBuffer:
 
 
     def sample_inds(self, inds, device=False):
-        assert self.ptr == self.max_size
-
-        # Adv normalization
-        if self.normz_adv:
-            self.adv_buf[inds] = self.normalize(self.adv_buf[inds])
-
-        batch = dict(observations=self.obs_buf[inds],
-        			 actions=self.act_buf[inds],
-        			 returns=self.ret_buf[inds],
-                     values=self.val_buf[inds],
-        			 advantages=self.adv_buf[inds],
-        			 log_pis=self.log_pi_buf[inds])
+        self.batch_data()
+        adv = self.adv_normz_batch[inds]
+
+        batch = dict(observations=self.obs_batch[inds],
+        			 actions=self.act_batch[inds],
+        			 returns=self.ret_batch[inds],
+                     values=self.val_batch[inds],
+        			 advantages=adv,
+        			 log_pis=self.log_pi_batch[inds])
         if device:
             return {k: v.to(device) for k,v in batch.items()}
         else:
@@ -444,20 +530,17 @@ class TrajBuffer:
 
 
     def return_all(self, device=False):
-        assert self.ptr == self.max_size
+        self.batch_data()
+        adv = self.adv_normz_batch
+
+        buffer = dict(observations=self.obs_batch,
+                      actions=self.act_batch,
+                      returns=self.ret_batch,
+                      values=self.val_batch,
+                      advantages=adv,
+                      log_pis=self.log_pi_batch)
         self.reset()
 
-        # Adv normalization
-        if self.normz_adv:
-            self.adv_buf = self.normalize(self.adv_buf)
-
-        buffer = dict(observations=self.obs_buf,
-                      actions=self.act_buf,
-                      returns=self.ret_buf,
-                      values=self.val_buf,
-                      advantages=self.adv_buf,
-                      log_pis=self.log_pi_buf)
-
         if device:
             return {k: v.to(device) for k,v in buffer.items()}
         else:
@@ -465,31 +548,17 @@ class TrajBuffer:
 
 
     def return_all_np(self):
-        assert self.ptr == self.max_size
-        self.reset()
-
-        # Adv normalization
-        if self.normz_adv:
-            self.adv_buf = self.normalize(self.adv_buf)
-
-        buffer = dict(observations=self.obs_buf,
-                      actions=self.act_buf,
-                      returns=self.ret_buf,
-                      values=self.val_buf,
-                      advantages=self.adv_buf,
-                      log_pis=self.log_pi_buf)
-
-        return {k: v.numpy() for k, v in buffer.items()}
+        return {k: v.numpy() for k, v in self.return_all().items()}
 
 
     def data_for_WM(self, recent=False, device=False):
-        idxs = np.random.randint(0, self.total_size(), size=self.total_size())
+        # Live transitions as single slices (the model trainer shuffles them)
         self.batch_data(recent)
-        buffer = dict(observations=self.obs_batch[idxs],
-        			  actions=self.act_batch[idxs],
-                      rewards=self.rew_batch[idxs],
-                      observations_next=self.obs_next_batch[idxs],
-                      terminals=self.ter_batch[idxs])
+        buffer = dict(observations=self.obs_batch,
+        			  actions=self.act_batch,
+                      rewards=self.rew_batch,
+                      observations_next=self.obs_next_batch,
+                      terminals=self.ter_batch)
         if device:
             return {k: v.to(device) for k,v in buffer.items()}
         else:
@@ -497,15 +566,15 @@ class TrajBuffer:
 
 
     def data_for_WM_stack(self):
-        data = self.data_for_WM(recent=False)
-        return {k: T.stack([v])[0] for k, v in data.items()}
+        return self.data_for_WM(recent=False)
 
 
     def reset(self):
         # print('Reset Buffer!')
-        self.ter_idx = T.zeros((self.num_traj, 1), dtype=T.float32)
-        self.ptr, self.last_traj = 0, 0
-        self.last_z = 0
+        self.head, self.end = 0, 0
+        self.first, self.last = 0, 0
+        self.version += 1
+
 
 
 
@@ -687,114 +756,437 @@ class ReplayBuffer:
     FIFO Replay buffer for off-policy data:
         __init__: initialize: empty matrices for storing traj's, poniter, size, max_size
         store_transition: D ← D ∪ {(st, at, rt, st+1)}
+        store_batch: D ← D ∪ {(st, at, rt, st+1)}_B, at most two slice copies per field
         sample_batch: B ~ D(|B|); |B|: batch_size
+        resize: new max_size in place, the newest transitions kept in order
+
+    Options: obs_dtype (float16/bfloat16 observations), on_device, pin_memory, prefetch
+    (CUDA), fused rows, next_obs ('copy' | 'index'), storage ('memory' | 'memmap' files in path).
     """
 
-    def __init__(self, obs_dim, act_dim, size, seed, device):
+    def __init__(self, obs_dim, act_dim, size, seed, device, obs_dtype=T.float32,
+                 on_device=False, pin_memory=False, prefetch=False, next_obs='copy', obs_size=None,
+                 storage='memory', path=None, readahead=True, sample_chunk=1, fused=False):
         print('Initialize ReplayBuffer')
-        self.obs_buf = T.zeros((size, obs_dim), dtype=T.float32)
-        self.act_buf = T.zeros((size, act_dim), dtype=T.float32)
-        self.rew_buf = T.zeros((size, 1), dtype=T.float32)
-        self.obs_next_buf = T.zeros((size, obs_dim), dtype=T.float32)
-        self.ter_buf = T.zeros((size, 1), dtype=T.float32)
+        assert next_obs in ('copy', 'index'), "next_obs must be 'copy' or 'index'"
+        assert storage in ('memory', 'memmap'), "storage must be 'memory' or 'memmap'"
+        assert not (storage == 'memmap' and on_device), "storage='memmap' keeps the data on the host"
+        self.obs_dtype = obs_dtype
+        self.next_obs = next_obs
+        self.storage = storage
+        self.readahead = readahead
+        self.sample_chunk = max(int(sample_chunk), 1)
+        self.storage_device = T.device(device) if on_device else T.device('cpu')
+        self.pin_memory = pin_memory and (self.storage_device.type == 'cpu') and T.cuda.is_available() and storage == 'memory'
+        self.fused = fused # One [ o | a | r | o' | d ] storage: one gather per batch, slower writes
+        self._layout = dict(obs_dim=obs_dim, act_dim=act_dim, size=size, obs_dtype=str(obs_dtype), next_obs=next_obs, fused=self.fused)
+        self._maps, meta = dict(), None
+        if storage == 'memmap':
+            self.path = path or tempfile.mkdtemp(prefix='replay_buffer_')
+            os.makedirs(self.path, exist_ok=True)
+            meta = self._read_meta()
+            if meta: size = self._layout['size'] = meta['size'] # Size of the stored buffer (resize)
+
+        fields = [('observations', obs_dim, obs_dtype),
+                  ('actions', act_dim, T.float32),
+                  ('rewards', 1, T.float32),
+                  ('observations_next', obs_dim, obs_dtype),
+                  ('terminals', 1, T.float32)]
+        self._keys = [f[0] for f in fields]
+        if next_obs == 'index':
+            fields = [f for f in fields if f[0] not in ('observations', 'observations_next')]
+        self._storages, self._columns, self._names = [], [], []
+        if self.fused: # One storage per dtype
+            groups = [[f for f in fields if f[2] == dtype] for dtype in dict.fromkeys(f[2] for f in fields)]
+        else:
+            groups = [[f] for f in fields]
+        for group in groups:
+            dtype = group[0][2]
+            name = f'rows_{str(dtype)[6:]}' if self.fused else group[0][0]
+            storage = self._alloc(name, (size, sum(f[1] for f in group)), dtype, meta)
+            columns, c = [], 0
+            for k, dim, _ in group:
+                columns.append((k, c, c+dim))
+                c += dim
+            self._storages.append(storage)
+            self._columns.append(columns)
+            self._names.append(name)
+
+        if next_obs == 'index':
+            self.obs_size = meta['obs_size'] if meta else int(obs_size or size + size//16)
+            self.obs_store = self._alloc('obs_store', (self.obs_size, obs_dim), obs_dtype, meta)
+            self.obs_rows = self._alloc('obs_rows', (size, 2), T.int32, meta) # [ o | o' ]
+            self.obs_head = meta['obs_head'] if meta else 0 # observations ever written (id), row = id % obs_size
+            self._obs_columns = [('observations', 0, obs_dim), ('observations_next', obs_dim, 2*obs_dim)]
+            self._pending = None # o', their ids and d of the previous store (its row order)
+        self._set_views()
 
         self.ptr, self.size, self.max_size = 0, 0, size
+        self.num_stored = 0 # transitions ever stored (incl. evicted ones)
+        if meta:
+            self.ptr, self.size, self.num_stored = meta['ptr'], meta['count'], meta['num_stored']
+            print(f'[ ReplayBuffer ] reopened {self.path}: {self.size}/{size} transitions'+(' '*50))
+        if next_obs == 'index':
+            self._mins = collections.deque() # (num_stored after a store, its smallest o id), increasing ids
+            if self.size: self._mins.append((self.num_stored, int(self._obs_id(self.obs_rows[:self.size, 0].long()).min())))
+
+        self._staging, self._slot = dict(), 0 # pinned staging buffers (2 slots/storage)
+        self.prefetch = prefetch and T.cuda.is_available() # CPU: the gather thread only competes with the update
+        self._next = None
+        if self.prefetch:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._stream = T.cuda.Stream()
 
 
     def total_size(self):
         return self.size
 
 
+    def _set_views(self):
+        views = {k: storage[:, c0:c1] for storage, columns in zip(self._storages, self._columns) for k, c0, c1 in columns}
+        self.obs_buf = views.get('observations') # None with next_obs='index'
+        self.act_buf = views['actions']
+        self.rew_buf = views['rewards']
+        self.obs_next_buf = views.get('observations_next')
+        self.ter_buf = views['terminals']
+
+
+    def resize(self, size):
+        # New max_size in place: the newest min(self.size, size) transitions are kept in ring order, oldest
+        # first at row 0 (at most two slice copies, none when they already start there). Storages are only
+        # reallocated when they are too small, with 1/4 slack (rows past max_size are never used)
+        self._wait()
+        keep = min(self.size, size)
+        start = (self.ptr - keep) % self.max_size
+        head = min(keep, self.max_size - start) # [start, start+head) then [0, keep-head)
+        capacity = self._storages[0].shape[0]
+        rows = list(zip(self._names, self._storages))
+        if self.next_obs == 'index': rows.append(('obs_rows', self.obs_rows))
+        for i, (name, X) in enumerate(rows):
+            if size > capacity:
+                Y = self._alloc(f'{name}_grown', (max(size, capacity + capacity//4), X.shape[1]), X.dtype, zeros=False)
+                Y[:head] = X[start:start+head]
+                Y[head:keep] = X[:keep-head]
+                self._replace_file(name)
+                if name == 'obs_rows': self.obs_rows = Y
+                else: self._storages[i] = Y
+            elif start != 0: # Rotated to [0, keep) through one temporary
+                X[:keep] = T.cat([X[start:start+head], X[:keep-head]])
+        self._set_views()
+        self.ptr, self.size, self.max_size = keep % size, keep, size
+        self._layout['size'] = size
+        if self.next_obs == 'index' and size + size//16 > self.obs_size: # Room for the new size at once
+            self._grow_obs(size + size//16, self._obs_floor(self.num_stored, self.obs_head))
+
+
+    def _alloc(self, name, shape, dtype, meta=None, zeros=True):
+        # Zeroed storage (zeros=False: uninitialized, rows written before they are read);
+        # storage='memmap': a (sparse, zeroed) .npy file, reopened as is when meta is given
+        if self.storage == 'memory':
+            alloc = T.zeros if zeros else T.empty
+            return alloc(shape, dtype=dtype, device=self.storage_device, pin_memory=self.pin_memory)
+        file = os.path.join(self.path, f'{name}.npy')
+        np_dtype = np.int16 if dtype == T.bfloat16 else T.empty(0, dtype=dtype).numpy().dtype # bf16: raw bits
+        if meta:
+            array = np.lib.format.open_memmap(file, mode='r+')
+            assert array.shape[0] >= shape[0] and array.shape[1:] == shape[1:] and array.dtype == np_dtype, \
+                   f'{file}: {array.shape} {array.dtype}, expected {shape} {np_dtype}' # Resized buffers may have more rows
+        else:
+            array = np.lib.format.open_memmap(file, mode='w+', dtype=np_dtype, shape=shape)
+        if not self.readahead and hasattr(mmap, 'MADV_RANDOM'): array._mmap.madvise(mmap.MADV_RANDOM)
+        self._maps[name] = array
+        return T.from_numpy(array).view(dtype)
+
+
+    def _replace_file(self, name):
+        # storage='memmap': the <name>_grown file written by resize/_grow_obs takes the place of <name>
+        if self.storage != 'memmap': return
+        os.replace(os.path.join(self.path, f'{name}_grown.npy'), os.path.join(self.path, f'{name}.npy'))
+        self._maps[name] = self._maps.pop(f'{name}_grown')
+
+
+    def _read_meta(self):
+        for file in os.listdir(self.path): # Left by a resize/_grow_obs that did not finish
+            if file.endswith('_grown.npy'): os.remove(os.path.join(self.path, file))
+        file = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(file): return None
+        with open(file) as f: meta = json.load(f)
+        layout = {k: meta.get(k, True) for k in self._layout if k != 'size'} # max_size: the stored one (older files: fused)
+        assert layout == {k: v for k, v in self._layout.items() if k != 'size'}, f'{self.path} holds a buffer of another layout: {layout}'
+        return meta
+
+
+    def flush(self):
+        # storage='memmap': dirty pages to disk and the pointers to meta.json (reopened by a buffer on the same path)
+        if self.storage != 'memmap': return
+        self._wait()
+        for array in self._maps.values(): array.flush()
+        meta = dict(self._layout, ptr=self.ptr, count=self.size, num_stored=self.num_stored)
+        if self.next_obs == 'index': meta.update(obs_head=self.obs_head, obs_size=self.obs_size)
+        file = os.path.join(self.path, 'meta.json')
+        with open(file + '.tmp', 'w') as f: json.dump(meta, f)
+        os.replace(file + '.tmp', file)
+
+
+    def close(self, delete=False):
+        # storage='memmap': flush (or delete the files), the buffer is not usable afterwards
+        if self.storage != 'memmap': return
+        if delete:
+            self._wait()
+            shutil.rmtree(self.path, ignore_errors=True)
+        else:
+            self.flush()
+        self._maps = dict()
+
+
+    def _as_tensor(self, X, rows):
+        # Zero-copy (rows, -1) view of a torch/NumPy source; the dtype cast happens in the slice copy
+        if isinstance(X, np.ndarray):
+            X = T.from_numpy(X.astype(np.float32) if X.dtype == np.bool_ else X)
+        else:
+            X = T.as_tensor(X)
+        return X.detach().reshape(rows, -1)
+
+
     def store_transition(self, o, a, r, o_next, d):
-        self.obs_buf[self.ptr] = T.Tensor(o)
-        self.act_buf[self.ptr] = T.Tensor(a)
-        self.rew_buf[self.ptr] = T.tensor(r)
-        self.obs_next_buf[self.ptr] = T.Tensor(o_next)
-        self.ter_buf[self.ptr] = T.tensor([d], dtype=T.bool)
+        self._wait()
+        if self.next_obs == 'index':
+            self._store_obs_row(o, o_next, d)
+        else:
+            self.obs_buf[self.ptr] = T.as_tensor(o)
+            self.obs_next_buf[self.ptr] = T.as_tensor(o_next)
+        self.act_buf[self.ptr] = T.as_tensor(a)
+        self.rew_buf[self.ptr] = float(r)
+        self.ter_buf[self.ptr] = float(d)
 
         self.ptr = (self.ptr+1) % self.max_size
         self.size = min(self.size+1, self.max_size)
+        self.num_stored += 1
 
 
     def override_batch(self, O, A, R, O_next, D, batch_size):
-        available_size = self.max_size - self.ptr # 84
-        self.obs_buf[self.ptr:self.ptr+available_size] = T.Tensor(O[:available_size,:])
-        self.act_buf[self.ptr:self.ptr+available_size] = T.Tensor(A[:available_size,:])
-        self.rew_buf[self.ptr:self.ptr+available_size] = T.tensor(R[:available_size].reshape(-1,1))
-        self.obs_next_buf[self.ptr:self.ptr+available_size] = T.Tensor(O_next[:available_size,:])
-        self.ter_buf[self.ptr:self.ptr+available_size] = T.tensor(D[:available_size])
-        self.ptr = (self.ptr+available_size) % self.max_size # 0
-        remain_size = batch_size - available_size # 316
-        # print('ptr=', self.ptr)
+        # Kept for old callers, store_batch handles the wrap-around itself
+        self.store_batch(O[:batch_size], A[:batch_size], R[:batch_size], O_next[:batch_size], D[:batch_size])
 
-        if self.ptr+remain_size > self.max_size:
-            self.override_batch(O[available_size:,:],
-                                A[available_size:,:],
-                                R[available_size:],
-                                O_next[available_size:,:],
-                                D[available_size:],
-                                remain_size)
+
+    def store_batch(self, O, A, R, O_next, D):
+        batch_size = len(O)
+        if batch_size == 0: return
+        self._wait()
+        Xs = [self._as_tensor(X, batch_size) for X in (O, A, R, O_next, D)]
+        self.num_stored += batch_size
+
+        # A batch larger than the buffer: only its last max_size transitions survive
+        if batch_size > self.max_size:
+            Xs = [X[-self.max_size:] for X in Xs]
+            batch_size = self.max_size
+
+        Xs = dict(zip(self._keys, Xs))
+        if self.next_obs == 'index': Xs = self._store_obs(Xs)
+        head = min(batch_size, self.max_size - self.ptr)
+        tail = batch_size - head
+        for storage, columns in zip(self._storages, self._columns):
+            X = [Xs[k] for k, _, _ in columns]
+            if len(X) == 1: # One field: slice copies, the cast happens in them
+                storage[self.ptr:self.ptr+head] = X[0][:head]
+                if tail > 0: storage[:tail] = X[0][head:]
+                continue
+            # fused: fields are concatenated straight into the (contiguous) storage rows
+            X = [x.to(storage.device, storage.dtype) for x in X]
+            T.cat([x[:head] for x in X], dim=-1, out=storage[self.ptr:self.ptr+head])
+            if tail > 0: T.cat([x[head:] for x in X], dim=-1, out=storage[:tail])
+        if self.next_obs == 'index':
+            self.obs_rows[self.ptr:self.ptr+head] = Xs['obs_rows'][:head]
+            if tail > 0: self.obs_rows[:tail] = Xs['obs_rows'][head:]
+
+        self.ptr = (self.ptr+batch_size) % self.max_size
+        self.size = min(self.size+batch_size, self.max_size)
+
+
+    def _store_obs(self, Xs):
+        # next_obs='index': ids for the o/o' of a (trimmed) batch, new observations written to obs_store;
+        # returns the other fields reordered by obs id, plus obs_rows. An o equal to the o' of the row
+        # before, or of the same (not-done) row of the previous store, reuses its id; others get a new one
+        dev = self.storage_device
+        O = Xs['observations'].to(dev, self.obs_dtype)
+        O_next = Xs['observations_next'].to(dev, self.obs_dtype)
+        D = Xs['terminals'].reshape(-1).to(dev) > 0
+        n = len(O)
+
+        ids = T.full((n,), -1, dtype=T.long, device=dev)
+        if self._pending is not None: # Episode boundaries: o != previous o' (reset after d/timeout, new rollout)
+            P_next, P_ids, P_D = self._pending
+            if len(P_next) != n and int((~P_D).sum()) == n:
+                P_next, P_ids = P_next[~P_D], P_ids[~P_D]
+            if len(P_next) == n:
+                cont = (P_next == O).all(-1)
+                ids[cont] = P_ids[cont]
+        chain = T.zeros(n, dtype=T.bool, device=dev) # consecutive steps within the batch: o_j = o'_j-1
+        chain[1:] = (O[1:] == O_next[:-1]).all(-1) & (ids[1:] < 0)
+        new = (ids < 0) & ~chain
+
+        # Row by row: [ o (if new) | o' ], then o of chained rows = o' of the row before
+        pos = T.cumsum(new.long() + 1, 0) - 1 # position of o' in the written block
+        next_ids = self.obs_head + pos
+        ids[new] = next_ids[new] - 1
+        ids[1:][chain[1:]] = next_ids[:-1][chain[1:]]
+        block = T.empty((int(pos[-1]) + 1, O.shape[1]), dtype=self.obs_dtype, device=dev)
+        block[pos[new] - 1] = O[new]
+        block[pos] = O_next
+        order = T.argsort(ids)
+
+        self._write_obs(block, self._obs_floor(self.num_stored, int(ids.min())))
+        self._pending = (O_next.clone(), next_ids, D)
+
+        Xs = {k: X[order.to(X.device)] for k, X in Xs.items() if k not in ('observations', 'observations_next')}
+        Xs['obs_rows'] = (T.stack([ids[order], next_ids[order]], dim=-1) % self.obs_size).int()
+        return Xs
+
+
+    def _store_obs_row(self, o, o_next, d):
+        # store_transition with next_obs='index': o is the previous o' within an episode
+        dev = self.storage_device
+        o = T.as_tensor(o).to(dev, self.obs_dtype).reshape(-1)
+        o_next = T.as_tensor(o_next).to(dev, self.obs_dtype).reshape(1, -1)
+        P = self._pending
+        if P is not None and len(P[0]) == 1 and T.equal(P[0][0], o):
+            oid, block = int(P[1][0]), o_next
         else:
-            self.obs_buf[self.ptr:self.ptr+remain_size] = T.Tensor(O[available_size:,:])
-            self.act_buf[self.ptr:self.ptr+remain_size] = T.Tensor(A[available_size:,:])
-            self.rew_buf[self.ptr:self.ptr+remain_size] = T.tensor(R[available_size:].reshape(-1,1))
-            self.obs_next_buf[self.ptr:self.ptr+remain_size] = T.Tensor(O_next[available_size:,:])
-            self.ter_buf[self.ptr:self.ptr+remain_size] = T.tensor(D[available_size:])
-            self.ptr = (self.ptr+remain_size) % self.max_size # 316
+            oid, block = self.obs_head, T.stack([o, o_next[0]])
+        nid = self.obs_head + len(block) - 1
+        self._write_obs(block, self._obs_floor(self.num_stored+1, oid))
+        self._pending = (o_next.clone(), T.tensor([nid], device=dev), T.tensor([bool(d)], device=dev))
+        self.obs_rows[self.ptr] = T.tensor([oid % self.obs_size, nid % self.obs_size])
+
+
+    def _obs_floor(self, stored, new_min):
+        # Smallest id the live rows refer to once num_stored is `stored` (new_min: smallest o id of the rows
+        # being stored). Rows are sorted by o id within a store only (o's reused from the previous store
+        # can be older than its new ones), so the smallest o id of each store is kept while any of its
+        # rows is live: a sliding-window minimum (monotonic deque)
+        while self._mins and self._mins[0][0] <= stored - self.max_size: self._mins.popleft()
+        floor = min(new_min, self._mins[0][1]) if self._mins else new_min
+        while self._mins and self._mins[-1][1] >= new_min: self._mins.pop()
+        self._mins.append((stored, new_min))
+        return floor
+
+
+    def _obs_id(self, row):
+        # id of the live observation in row (live ids span less than obs_size up to obs_head)
+        return self.obs_head - 1 - (self.obs_head - 1 - row) % self.obs_size
+
+
+    def _write_obs(self, X, floor):
+        n = len(X)
+        if self.obs_head + n - floor > self.obs_size:
+            self._grow_obs(self.obs_head + n - floor, floor)
+        r = self.obs_head % self.obs_size
+        head = min(n, self.obs_size - r)
+        self.obs_store[r:r+head] = X[:head]
+        if n > head: self.obs_store[:n-head] = X[head:]
+        self.obs_head += n
+
+
+    def _grow_obs(self, need, floor):
+        # Live observations [floor, obs_head) moved to a larger ring, obs_rows remapped
+        obs_size = need + need//8
+        obs_store = self._alloc('obs_store_grown', (obs_size, self.obs_store.shape[1]), self.obs_dtype)
+        ids = T.arange(floor, self.obs_head, device=self.storage_device)
+        obs_store[ids % obs_size] = self.obs_store[ids % self.obs_size]
+        rows = self.obs_rows[:self.size].long()
+        self.obs_rows[:self.size] = (self._obs_id(rows) % obs_size).int()
+        self.obs_store, self.obs_size = obs_store, obs_size
+        self._replace_file('obs_store')
+        print(f'[ ReplayBuffer ] obs_store grown to {obs_size} rows'+(' '*50))
+
+
+    def _wait(self):
+        # Writes must not race a background gather
+        if self._next is not None: self._next[1].result()
+
+
+    def _stage(self, s, storage, idxs):
+        # Gather into a pinned buffer; a slot is reused only once its last copy has finished
+        bs = len(idxs)
+        slot = self._slot
+        if (s, slot) not in self._staging or self._staging[(s, slot)][0].shape[0] < bs:
+            self._staging[(s, slot)] = [T.empty((bs, storage.shape[1]), dtype=storage.dtype, pin_memory=True), None]
+        staging, event = self._staging[(s, slot)]
+        if event is not None: event.synchronize()
+        return T.index_select(storage, 0, idxs, out=staging[:bs])
+
+
+    def _gather(self, idxs, device=False, staged=False):
+        # Rows idxs of all fields (float32), one gather per storage (+ one of obs_store by obs_rows)
+        sources = [(storage, columns, idxs) for storage, columns in zip(self._storages, self._columns)]
+        if self.next_obs == 'index':
+            rows = self.obs_rows.index_select(0, idxs).reshape(-1) # [ o | o' ] per row
+            sources.append((self.obs_store, self._obs_columns, rows))
+        batch = dict()
+        for s, (storage, columns, rows) in enumerate(sources):
+            if staged:
+                B = self._stage(s, storage, rows).to(device, non_blocking=True)
+                event = T.cuda.Event()
+                event.record()
+                self._staging[(s, self._slot)][1] = event
+            else:
+                B = storage.index_select(0, rows)
+                if device: B = B.to(device)
+            B = B.reshape(len(idxs), -1)
+            for k, c0, c1 in columns:
+                batch[k] = B[:, c0:c1].float()
+        return {k: batch[k] for k in self._keys}
+
+
+    def _sample_idxs(self, batch_size):
+        if self.sample_chunk > 1: # Runs of consecutive rows
+            starts = T.randint(0, self.size, (-(-batch_size // self.sample_chunk), 1), device=self.storage_device)
+            idxs = ((starts + T.arange(self.sample_chunk, device=self.storage_device)) % self.size).reshape(-1)[:batch_size]
+        else:
+            idxs = T.randint(0, self.size, (batch_size,), device=self.storage_device)
+        return idxs
 
 
-    def store_batch(self, O, A, R, O_next, D):
-    	batch_size = len(O[:,0])
-    	# print(f"store_batch, size={batch_size}, ptr={self.ptr}, max_size={self.max_size}")
+    def _sample(self, batch_size, device=False):
+        idxs = self._sample_idxs(batch_size)
+        staged = self.pin_memory and device and T.device(device).type == 'cuda'
+        batch = self._gather(idxs, device, staged)
+        self._slot = 1 - self._slot
+        return batch
 
-    	if self.ptr+batch_size > self.max_size:
-            self.override_batch(O, A, R, O_next, D, batch_size)
-    	else:
-    		self.obs_buf[self.ptr:self.ptr+batch_size] = T.Tensor(O)
-    		self.act_buf[self.ptr:self.ptr+batch_size] = T.Tensor(A)
-    		self.rew_buf[self.ptr:self.ptr+batch_size] = T.tensor(R.reshape(-1,1))
-    		self.obs_next_buf[self.ptr:self.ptr+batch_size] = T.Tensor(O_next)
-    		self.ter_buf[self.ptr:self.ptr+batch_size] = T.tensor(D, dtype=T.bool)
-    		self.ptr = (self.ptr+batch_size) % self.max_size
 
-    		self.size = min(self.size+batch_size, self.max_size)
-        # print('ptr=', self.ptr)
+    def _sample_async(self, batch_size, device):
+        with T.cuda.stream(self._stream):
+            batch = self._sample(batch_size, device)
+        self._stream.synchronize()
+        return batch
 
 
     def sample_batch(self, batch_size=32, device=False):
-        # device = self.device
-        idxs = np.random.randint(0, self.size, size=batch_size)
-        # print('Index:	', idxs[0: 5])
-        batch = dict(observations=self.obs_buf[idxs],
-        			 actions=self.act_buf[idxs],
-        			 rewards=self.rew_buf[idxs],
-        			 observations_next=self.obs_next_buf[idxs],
-        			 terminals=self.ter_buf[idxs])
-        if device:
-            return {k: v.to(device) for k,v in batch.items()}
+        if not self.prefetch:
+            return self._sample(batch_size, device)
+        key = (batch_size, device)
+        if self._next is not None and self._next[0] == key:
+            batch = self._next[1].result()
         else:
-            return {k: v            for k,v in batch.items()}
+            self._wait()
+            batch = self._sample(batch_size, device)
+        self._next = (key, self._executor.submit(self._sample_async, batch_size, device))
+        return batch
 
 
     def sample_batch_np(self, batch_size=32):
         # device = self.device
         idxs = np.random.randint(0, self.size, size=batch_size)
         # print('Index:	', idxs[0: 5])
-        batch = dict(observations=self.obs_buf[idxs],
-        			actions=self.act_buf[idxs],
-        			rewards=self.rew_buf[idxs],
-        			observations_next=self.obs_next_buf[idxs],
-        			terminals=self.ter_buf[idxs])
-        return {k: v.numpy() for k,v in batch.items()}
+        batch = self._gather(T.as_tensor(idxs, device=self.storage_device))
+        return {k: v.cpu().numpy() for k,v in batch.items()}
 
 
     def get_recent_data(self, batch_size=32, device=False):
         # device = self.device
-        batch = dict(observations=self.obs_buf[-batch_size:],
-        			actions=self.act_buf[-batch_size:],
-        			rewards=self.rew_buf[-batch_size:],
-        			observations_next=self.obs_next_buf[-batch_size:],
-        			terminals=self.ter_buf[-batch_size:])
+        batch = self._gather(T.arange(max(self.max_size-batch_size, 0), self.max_size, device=self.storage_device))
         if device:
             return {k: v.to(device) for k,v in batch.items()}
         else:
@@ -804,11 +1196,18 @@ class ReplayBuffer:
     def data_for_WM_all(self, device=False):
         # device = self.device
         idxs = np.random.randint(0, self.size, size=self.size)
-        buffer = dict(observations=self.obs_buf[idxs],
-        			actions=self.act_buf[idxs],
-        			rewards=self.rew_buf[idxs],
-        			observations_next=self.obs_next_buf[idxs],
-        			terminals=self.ter_buf[idxs])
+        buffer = self._gather(T.as_tensor(idxs, device=self.storage_device))
+        if device:
+            return {k: v.to(device) for k,v in buffer.items()}
+        else:
+            return {k: v            for k,v in buffer.items()}
+
+
+    def data_for_WM_recent(self, num, device=False):
+        # The last min(num, size) stored transitions, oldest first (ring order)
+        num = min(num, self.size)
+        idxs = T.arange(self.ptr - num, self.ptr, device=self.storage_device) % self.max_size
+        buffer = self._gather(idxs)
         if device:
             return {k: v.to(device) for k,v in buffer.items()}
         else:
@@ -818,12 +1217,8 @@ class ReplayBuffer:
     def data_for_WM_np(self):
     	# device = self.device
     	idxs = np.random.randint(0, self.size, size=self.size)
-    	buffer = dict(observations=self.obs_buf[idxs],
-                      actions=self.act_buf[idxs],
-                      rewards=self.rew_buf[idxs],
-                      observations_next=self.obs_next_buf[idxs],
-                      terminals=self.ter_buf[idxs])
-    	return {k: v.numpy() for k, v in buffer.items()}
+    	buffer = self._gather(T.as_tensor(idxs, device=self.storage_device))
+    	return {k: v.cpu().numpy() for k, v in buffer.items()}
 
 
     def data_for_WM_stack(self):
@@ -73,7 +73,8 @@ class WorldModel:
         s_next = s_next.to('cpu').data.numpy()
         return s_next
 
-    def reward(self, s, a):
+    def reward(self, s, a, sp=None):
+        # sp: the model's own next-state prediction, if already computed
         if not self.learn_reward:
             print("Reward model is not learned. Use the reward function from env.")
             return None
@@ -84,8 +85,9 @@ class WorldModel:
                 a = torch.from_numpy(a).float()
             s = s.to(self.device)
             a = a.to(self.device)
-            sp = self.dynamics_net.forward(s, a).detach().clone()
-            return self.reward_net.forward(s, a, sp)
+            if sp is None:
+                sp = self.dynamics_net.forward(s, a).detach().clone()
+            return self.reward_net.forward(s, a, sp.to(self.device))
 
     def compute_loss(self, s, a, s_next):
         # Intended for logging use only, not for loss computation
@@ -3,18 +3,21 @@ import typing
 from copy import deepcopy
 from typing import Optional, Type, Union
 
-from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper, VecEnv, VecEnvWrapper
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
-from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv
-from stable_baselines3.common.vec_env.vec_check_nan import VecCheckNan
-from stable_baselines3.common.vec_env.vec_frame_stack import VecFrameStack
-from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
-from stable_baselines3.common.vec_env.vec_transpose import VecTransposeImage
-from stable_baselines3.common.vec_env.vec_video_recorder import VecVideoRecorder
+from rl.environments.vec.base_vec_env import CloudpickleWrapper, VecEnv, VecEnvWrapper
+from rl.environments.vec.dummy_vec_env import DummyVecEnv
+from rl.environments.vec.subproc_vec_env import SubprocVecEnv
+from rl.environments.vec.shmem_vec_env import ShmemVecEnv
+from rl.environments.vec.async_vec_env import AsyncVecEnv
+from rl.environments.vec.interaction import VecInteraction
+from rl.environments.vec.vec_check_nan import VecCheckNan
+from rl.environments.vec.vec_frame_stack import VecFrameStack
+from rl.environments.vec.vec_normalize import VecNormalize
+from rl.environments.vec.vec_transpose import VecTransposeImage
+from rl.environments.vec.vec_video_recorder import VecVideoRecorder
 
 # Avoid circular import
 if typing.TYPE_CHECKING:
-    from stable_baselines3.common.type_aliases import GymEnv
+    from gym import Env as GymEnv
 
 
 def unwrap_vec_wrapper(env: Union["GymEnv", VecEnv], vec_wrapper_class: Type[VecEnvWrapper]) -> Optional[VecEnvWrapper]:
@@ -56,3 +59,39 @@ def sync_envs_normalization(env: "GymEnv", eval_env: "GymEnv") -> None:
             eval_env_tmp.ret_rms = deepcopy(env_tmp.ret_rms)
         env_tmp = env_tmp.venv
         eval_env_tmp = eval_env_tmp.venv
+
+
+def make_vec_env(
+    env_id: str,
+    n_envs: int = 1,
+    seed: Optional[int] = None,
+    vec_env_cls: Optional[Type[VecEnv]] = None,
+    vec_env_kwargs: Optional[dict] = None,
+) -> VecEnv:
+    """
+    Create a ``VecEnv`` of ``n_envs`` copies of a registered gym environment.
+
+    :param env_id: (str) the environment ID
+    :param n_envs: (int) the number of environments you wish to have in parallel
+    :param seed: (int) the initial seed for the random number generator (env i is seeded with seed + i)
+    :param vec_env_cls: (Type[VecEnv]) A custom ``VecEnv`` class constructor. Default: DummyVecEnv.
+    :param vec_env_kwargs: (dict) Keyword arguments to pass to the ``VecEnv`` class constructor.
+    :return: (VecEnv) The wrapped environment
+    """
+
+    def make_env(rank):
+        def _init():
+            import gym
+            import rl.environments  # registers the PDDM/MBPO environments in subprocesses
+
+            env = gym.make(env_id)
+            if seed is not None:
+                env.seed(seed + rank)
+                env.action_space.seed(seed + rank)
+            return env
+
+        return _init
+
+    if vec_env_cls is None:
+        vec_env_cls = DummyVecEnv
+    return vec_env_cls([make_env(i) for i in range(n_envs)], **(vec_env_kwargs or {}))
@@ -0,0 +1,88 @@
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from rl.environments.vec.shmem_vec_env import ShmemVecEnv
+
+
+class AsyncVecEnv(ShmemVecEnv):
+    """
+    EnvPool-style asynchronous vectorized environment (first-ready stepping) on top of ``ShmemVecEnv``.
+
+    Instead of a lockstep ``step`` that waits for the slowest worker, ``send(actions, env_ids)`` steps some envs
+    and ``recv()`` returns as soon as ``batch_size`` of the pending envs are done, whichever they are:
+
+        venv.async_reset()
+        while True:
+            obs, rews, dones, infos, env_ids = venv.recv()
+            venv.send(policy(obs), env_ids)
+
+    Done envs are reset by their worker (``infos[i]["terminal_observation"]`` holds the last observation);
+    ``async_reset(env_ids)`` resets envs explicitly and their ``recv`` has ``infos[i] = None``, zero reward
+    and ``done = False``. ``reset``/``step`` keep the lockstep ``VecEnv`` behaviour (pending envs are drained).
+
+    :param env_fns: ([Gym Environment]) Environments to run in subprocesses
+    :param batch_size: (int) number of envs returned by ``recv`` (default: num_envs, i.e. lockstep)
+    :param start_method: (str) method used to start the subprocesses (see ``SubprocVecEnv``).
+    """
+
+    def __init__(self, env_fns, batch_size=None, start_method=None):
+        super().__init__(env_fns, start_method)
+        self.batch_size = batch_size or self.num_envs
+        assert 0 < self.batch_size <= self.num_envs, "batch_size must be in [1, num_envs]"
+        self.pending = np.zeros(self.num_envs, dtype=bool)
+
+    def send(self, actions, env_ids):
+        env_ids = np.asarray(env_ids, dtype=int)
+        self.bufs["act"][env_ids] = np.asarray(actions).reshape((len(env_ids),) + self.bufs["act"].shape[1:])
+        for env_idx in env_ids:
+            self.remotes[env_idx].send(("step", None))
+        self.pending[env_ids] = True
+
+    def async_reset(self, env_ids=None):
+        env_ids = np.arange(self.num_envs) if env_ids is None else np.asarray(env_ids, dtype=int)
+        for env_idx in env_ids:
+            self.remotes[env_idx].send(("reset", None))
+        self.pending[env_ids] = True
+
+    def recv(self):
+        # The first batch_size pending envs to be ready (all of them if fewer are pending)
+        batch_size = min(self.batch_size, int(self.pending.sum()))
+        env_ids, infos = [], []
+        while len(env_ids) < batch_size:
+            for remote in wait([self.remotes[i] for i in np.flatnonzero(self.pending)]):
+                if len(env_ids) == batch_size:
+                    break
+                env_idx = self.remotes.index(remote)
+                infos.append(remote.recv())
+                env_ids.append(env_idx)
+                self.pending[env_idx] = False
+        env_ids = np.array(env_ids, dtype=int)
+        dones = self.bufs["done"][env_ids]
+        for i in np.flatnonzero(dones):
+            infos[i]["terminal_observation"] = self.bufs["terminal_obs"][env_ids[i]].copy()
+        return self.bufs["obs"][env_ids], self.bufs["rew"][env_ids], dones, infos, env_ids
+
+    def _drain(self):
+        for env_idx in np.flatnonzero(self.pending):
+            self.remotes[env_idx].recv()
+        self.pending[:] = False
+
+    def _get_target_remotes(self, indices):
+        # get_attr/set_attr/env_method: no step replies may be left in the pipes
+        self._drain()
+        return super()._get_target_remotes(indices)
+
+    def step_async(self, actions):
+        self._drain()
+        super().step_async(actions)
+
+    def reset(self):
+        self._drain()
+        return super().reset()
+
+    def close(self):
+        if self.closed:
+            return
+        self._drain()
+        super().close()
@@ -0,0 +1,98 @@
+import numpy as np
+
+from rl.environments.vec.async_vec_env import AsyncVecEnv
+
+
+class VecInteraction:
+    """
+    Learn-env interaction of MFRL/MBRL agents with num_envs > 1 (``self.learn_env`` a ``VecEnv``).
+
+    Uses the agent's ``configs``, ``num_envs``, ``act_dim``, ``actor_critic``, ``buffer`` and ``profiler``.
+    ``internact_vec`` steps every env once (lockstep) and stores the N transitions with one ``store_batch``;
+    with an ``AsyncVecEnv`` it steps whichever envs are ready first (``internact_async``).
+    Both return the per-env O, Z, el, the env step counter t and the returns/lengths of finished episodes.
+    """
+
+    def internact_vec(self, n, O, Z, el, t):
+        # One step of each of the num_envs learn envs; O, Z, el are per env
+        if isinstance(self.learn_env, AsyncVecEnv): return self.internact_async(n, O, Z, el, t)
+        Nx = self.configs['algorithm']['learning']['expl_epochs']
+        max_el = self.configs['environment']['horizon']
+        N = self.num_envs
+
+        if n > Nx:
+            with self.profiler.phase('actor'): A = self.actor_critic.get_action_np(O) # One actor call for the N envs
+        else:
+            A = np.stack([ self.learn_env.action_space.sample() for _ in range(N) ])
+
+        with self.profiler.phase('env'): O_next, R, D, infos = self.learn_env.step(A)
+        Z, el = Z + R, el + np.ones(N, dtype=int)
+
+        # Ignore artificial termination (horizon or the env's TimeLimit), per env
+        timeout = (el == max_el) | np.array([ info.get('TimeLimit.truncated', False) for info in infos ])
+        # The VecEnv auto-resets done envs; store their last observation
+        O_last = O_next.copy()
+        for i in np.flatnonzero(D): O_last[i] = infos[i]['terminal_observation']
+
+        with self.profiler.phase('buffer'): self.buffer.store_batch(O, A, R, O_last, D & ~timeout)
+
+        horizon = np.flatnonzero((el == max_el) & ~D).tolist() # Not reset by the VecEnv
+        if horizon: O_next[horizon] = np.stack(self.learn_env.env_method('reset', indices=horizon))
+        done = D | (el == max_el)
+        ZDone, elDone = list(Z[done]), list(el[done]) # Finished episodes
+        Z, el = np.where(done, 0, Z), np.where(done, 0, el)
+        t += N
+
+        return O_next, Z, el, t, ZDone, elDone
+
+
+    def internact_async(self, n, O, Z, el, t):
+        # AsyncVecEnv: step whichever vec_batch_size envs are ready first, until num_envs
+        # transitions are collected; O holds each env's latest observation
+        Nx = self.configs['algorithm']['learning']['expl_epochs']
+        max_el = self.configs['environment']['horizon']
+        N = self.num_envs
+        env = self.learn_env
+
+        def act(O):
+            if n > Nx:
+                with self.profiler.phase('actor'): return self.actor_critic.get_action_np(O)
+            return np.stack([ env.action_space.sample() for _ in range(len(O)) ])
+
+        Z, el = Z + np.zeros(N), el + np.zeros(N, dtype=int)
+        if not hasattr(self, 'async_A'): self.async_A = np.zeros((N, self.act_dim), dtype=np.float32) # Last action sent to each env
+        idle = np.flatnonzero(~env.pending)
+        if len(idle):
+            self.async_A[idle] = act(O[idle])
+            env.send(self.async_A[idle], idle)
+
+        ZDone, elDone, stored = [], [], 0
+        while stored < N:
+            with self.profiler.phase('env'): O_next, R, D, infos, ids = env.recv()
+            stepped = np.array([ info is not None for info in infos ]) # Not replies to async_reset
+            ids_s, R, D, infos = ids[stepped], R[stepped], D[stepped], [ info for info in infos if info is not None ]
+            Z[ids_s] += R
+            el[ids_s] += 1
+
+            # Ignore artificial termination (horizon or the env's TimeLimit), per env
+            at_max = el[ids_s] == max_el
+            timeout = at_max | np.array([ info.get('TimeLimit.truncated', False) for info in infos ], dtype=bool)
+            O_last = O_next[stepped].copy()
+            for i in np.flatnonzero(D): O_last[i] = infos[i]['terminal_observation']
+            with self.profiler.phase('buffer'): self.buffer.store_batch(O[ids_s], self.async_A[ids_s], R, O_last, D & ~timeout)
+
+            O[ids] = O_next
+            done = D | at_max
+            ZDone += list(Z[ids_s[done]])
+            elDone += list(el[ids_s[done]])
+            Z[ids_s[done]], el[ids_s[done]] = 0, 0
+            horizon = ids_s[at_max & ~D] # Not reset by the env
+            if len(horizon): env.async_reset(horizon)
+            go = np.setdiff1d(ids, horizon)
+            if len(go):
+                self.async_A[go] = act(O[go])
+                env.send(self.async_A[go], go)
+            stored += len(ids_s)
+        t += stored
+
+        return O, Z, el, t, ZDone, elDone
@@ -0,0 +1,145 @@
+import multiprocessing
+from multiprocessing import shared_memory
+
+import gym
+import numpy as np
+
+from rl.environments.vec.base_vec_env import CloudpickleWrapper, VecEnv
+from rl.environments.vec.subproc_vec_env import SubprocVecEnv
+
+
+def _shmem_worker(remote, parent_remote, env_fn_wrapper, shm_specs, env_idx):
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    shms = {key: shared_memory.SharedMemory(name=name) for key, (name, _, _) in shm_specs.items()}
+    # (1, ...) views of this env's rows
+    bufs = {
+        key: np.ndarray(shape, dtype=dtype, buffer=shms[key].buf)[env_idx : env_idx + 1]
+        for key, (_, shape, dtype) in shm_specs.items()
+    }
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, done, info = env.step(bufs["act"][0])
+                if done:
+                    # save final observation where user can get it, then reset
+                    bufs["terminal_obs"][0] = observation
+                    observation = env.reset()
+                bufs["obs"][0], bufs["rew"][0], bufs["done"][0] = observation, reward, done
+                remote.send(info)
+            elif cmd == "reset":
+                bufs["obs"][0], bufs["rew"][0], bufs["done"][0] = env.reset(), 0.0, False
+                remote.send(None)
+            elif cmd == "seed":
+                remote.send(env.seed(data))
+            elif cmd == "render":
+                remote.send(env.render(data))
+            elif cmd == "close":
+                env.close()
+                del bufs
+                for shm in shms.values():
+                    shm.close()
+                remote.close()
+                break
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+
+class ShmemVecEnv(SubprocVecEnv):
+    """
+    A ``SubprocVecEnv`` whose workers exchange observations, actions, rewards and dones through
+    preallocated ``multiprocessing.shared_memory`` blocks instead of pickling them through the pipes.
+
+    Each step, the parent writes the actions in the shared action block and sends a tiny "step" command;
+    a worker steps its env, writes its row of the observation/reward/done blocks and answers with the info
+    dict only (the terminal observation of a done env also goes through shared memory). This removes the
+    per-step pickling of large observations (e.g. PDDM ShadowHand envs).
+
+    Only ``Box`` observation and action spaces are supported; observations are stored with the
+    observation space's dtype. The spaces are read from a first env created in the parent process.
+
+    :param env_fns: ([Gym Environment]) Environments to run in subprocesses
+    :param start_method: (str) method used to start the subprocesses (see ``SubprocVecEnv``).
+    """
+
+    def __init__(self, env_fns, start_method=None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        dummy = env_fns[0]()
+        observation_space, action_space = dummy.observation_space, dummy.action_space
+        dummy.close()
+        del dummy
+        assert isinstance(observation_space, gym.spaces.Box), "ShmemVecEnv works only with Box observation spaces"
+        assert isinstance(action_space, gym.spaces.Box), "ShmemVecEnv works only with Box action spaces"
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+        self.shms, self.bufs, shm_specs = dict(), dict(), dict()
+        for key, shape, dtype in [
+            ("obs", observation_space.shape, observation_space.dtype),
+            ("terminal_obs", observation_space.shape, observation_space.dtype),
+            ("act", action_space.shape, action_space.dtype),
+            ("rew", (), np.float64),
+            ("done", (), np.bool_),
+        ]:
+            shape = (n_envs,) + tuple(shape)
+            shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1))
+            self.shms[key] = shm
+            self.bufs[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            shm_specs[key] = (shm.name, shape, dtype)
+
+        if start_method is None:
+            forkserver_available = "forkserver" in multiprocessing.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = multiprocessing.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for env_idx, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), shm_specs, env_idx)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_shmem_worker, args=args, daemon=True)  # pytype:disable=attribute-error
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+    def step_async(self, actions):
+        self.bufs["act"][:] = np.asarray(actions).reshape(self.bufs["act"].shape)
+        for remote in self.remotes:
+            remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        dones = self.bufs["done"].copy()
+        for env_idx in np.flatnonzero(dones):
+            infos[env_idx]["terminal_observation"] = self.bufs["terminal_obs"][env_idx].copy()
+        return self.bufs["obs"].copy(), self.bufs["rew"].copy(), dones, infos
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return self.bufs["obs"].copy()
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.bufs = None
+        for shm in self.shms.values():
+            shm.close()
+            shm.unlink()
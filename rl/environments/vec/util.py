@@ -71,3 +71,59 @@ def obs_space_info(obs_space):
         shapes[key] = box.shape
         dtypes[key] = box.dtype
     return keys, shapes, dtypes
+
+
+def is_image_space(observation_space, channels_last=True, check_channels=False):
+    """
+    Check if a observation space has the shape, limits and dtype
+    of a valid image.
+
+    :param observation_space: (gym.spaces.Space)
+    :param channels_last: (bool)
+    :param check_channels: (bool) Whether to check the number of channels (1, 3 or 4)
+    :return: (bool)
+    """
+    if isinstance(observation_space, gym.spaces.Box) and len(observation_space.shape) == 3:
+        if observation_space.dtype != np.uint8:
+            return False
+        if np.any(observation_space.low != 0) or np.any(observation_space.high != 255):
+            return False
+        if not check_channels:
+            return True
+        n_channels = observation_space.shape[-1] if channels_last else observation_space.shape[0]
+        return n_channels in [1, 3, 4]
+    return False
+
+
+class RunningMeanStd(object):
+    def __init__(self, epsilon=1e-4, shape=()):
+        """
+        Calulates the running mean and std of a data stream
+        https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+
+        :param epsilon: (float) helps with arithmetic issues
+        :param shape: (tuple) the shape of the data stream's output
+        """
+        self.mean = np.zeros(shape, np.float64)
+        self.var = np.ones(shape, np.float64)
+        self.count = epsilon
+
+    def update(self, arr):
+        batch_mean = np.mean(arr, axis=0)
+        batch_var = np.var(arr, axis=0)
+        batch_count = arr.shape[0]
+        self.update_from_moments(batch_mean, batch_var, batch_count)
+
+    def update_from_moments(self, batch_mean, batch_var, batch_count):
+        delta = batch_mean - self.mean
+        tot_count = self.count + batch_count
+
+        new_mean = self.mean + delta * batch_count / tot_count
+        m_a = self.var * self.count
+        m_b = batch_var * batch_count
+        m_2 = m_a + m_b + np.square(delta) * self.count * batch_count / (self.count + batch_count)
+        new_var = m_2 / (self.count + batch_count)
+
+        self.mean = new_mean
+        self.var = new_var
+        self.count = batch_count + self.count
@@ -1,8 +1,8 @@
 import numpy as np
 from gym import spaces
 
-from stable_baselines3.common.preprocessing import is_image_space
-from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvStepReturn, VecEnvWrapper
+from rl.environments.vec.base_vec_env import VecEnv, VecEnvStepReturn, VecEnvWrapper
+from rl.environments.vec.util import is_image_space
 
 
 class VecTransposeImage(VecEnvWrapper):
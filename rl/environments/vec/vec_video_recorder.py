@@ -2,12 +2,11 @@ import os
 
 from gym.wrappers.monitoring import video_recorder
 
-from stable_baselines3.common import logger
-from stable_baselines3.common.vec_env.base_vec_env import VecEnvWrapper
-from stable_baselines3.common.vec_env.dummy_vec_env import DummyVecEnv
-from stable_baselines3.common.vec_env.subproc_vec_env import SubprocVecEnv
-from stable_baselines3.common.vec_env.vec_frame_stack import VecFrameStack
-from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
+from rl.environments.vec.base_vec_env import VecEnvWrapper
+from rl.environments.vec.dummy_vec_env import DummyVecEnv
+from rl.environments.vec.subproc_vec_env import SubprocVecEnv
+from rl.environments.vec.vec_frame_stack import VecFrameStack
+from rl.environments.vec.vec_normalize import VecNormalize
 
 
 class VecVideoRecorder(VecEnvWrapper):
@@ -87,7 +86,7 @@ class VecVideoRecorder(VecEnvWrapper):
             self.video_recorder.capture_frame()
             self.recorded_frames += 1
             if self.recorded_frames > self.video_length:
-                logger.info("Saving video to ", self.video_recorder.path)
+                print("Saving video to ", self.video_recorder.path)
                 self.close_video_recorder()
         elif self._video_enabled():
             self.start_video_recorder()
@@ -1,3 +1,5 @@
+import typing
+
 import numpy as np
 import torch as T
 
@@ -45,3 +47,102 @@ class MLPNet(nn.Module):
 
     def forward(self, x):
         return self.net(x)
+
+
+
+class LinearEnsemble(nn.Module): # source: https://github.com/Xingyu-Lin/mbpo_pytorch/model.py
+    __constants__ = ['in_features', 'out_features']
+    ensemble_size: int
+    in_features: int
+    out_features: int
+    weight: T.Tensor
+
+    def __init__(self,
+                 ensemble_size: int,
+                 in_features: int,
+                 out_features: int,
+                 weight_decay: float = 0.,
+                 bias: bool = True
+                 ) -> None:
+
+        super(LinearEnsemble, self).__init__()
+
+        self.ensemble_size = ensemble_size
+
+        self.in_features = in_features
+        self.out_features = out_features
+
+        self.weight = nn.Parameter( T.Tensor(ensemble_size, in_features, out_features) )
+        self.weight_decay = weight_decay
+
+        if bias:
+            self.bias = nn.Parameter( T.Tensor(ensemble_size, out_features) )
+        else:
+            self.register_parameter('bias', None)
+
+        self.reset_parameters()
+
+    def reset_parameters(self) -> None:
+        pass
+
+
+    def forward(self, x: T.Tensor, idx: typing.Optional[T.Tensor] = None) -> T.Tensor:
+        if idx is None:
+            return T.baddbmm(self.bias[:, None, :], x, self.weight)  # b + x times w, fused
+        return T.baddbmm(self.bias[idx, None, :], x, self.weight[idx])  # members idx only
+
+    def extra_repr(self) -> str:
+        return 'in_features={}, out_features={}, bias={}'.format(
+            self.in_features, self.out_features, self.bias is not None
+        )
+
+
+
+class PReLUEnsemble(nn.Module):
+    # nn.PReLU (one slope) per member: MLPNet shares its activation module across its layers
+    def __init__(self, ensemble_size, init=0.25):
+        super(PReLUEnsemble, self).__init__()
+        self.weight = nn.Parameter(T.full((ensemble_size,), init))
+
+    def forward(self, x):
+        # F.prelu (native kernel) takes one slope per channel (dim 1): members there
+        return F.prelu(x.transpose(0, 1), self.weight).transpose(0, 1)
+
+
+
+class MLPEnsembleNet(nn.Module):
+    """
+    ensemble_size MLPNets (same net_configs) as stacked weights: every layer is one
+    batched matmul (LinearEnsemble) over the members. ip: ensemble_size x N x ip_dim
+    """
+    def __init__(self, ensemble_size, ip_dim, op_dim, net_configs):
+        super(MLPEnsembleNet, self).__init__() # To automatically use forward
+
+        net_arch = net_configs['arch']
+        op_activation = eval('nn.' + net_configs['op_activation'])()
+        if net_configs['activation'] == 'PReLU':
+            activation = PReLUEnsemble(ensemble_size)
+        else:
+            activation = eval('nn.' + net_configs['activation'])()
+
+        if len(net_arch) > 0:
+            layers = [LinearEnsemble(ensemble_size, ip_dim, net_arch[0]), activation]
+            for l in range(len(net_arch)-1):
+                layers.extend([LinearEnsemble(ensemble_size, net_arch[l], net_arch[l+1]), activation])
+            if op_dim > 0:
+                last_dim = net_arch[-1]
+                layers.extend([LinearEnsemble(ensemble_size, last_dim, op_dim), op_activation])
+        else:
+            raise 'No network arch!'
+
+        for layer in layers:
+            if isinstance(layer, LinearEnsemble): # nn.Linear default init, per member
+                bound = 1 / np.sqrt(layer.in_features)
+                nn.init.uniform_(layer.weight, -bound, bound)
+                nn.init.uniform_(layer.bias, -bound, bound)
+
+        self.net = nn.Sequential(*layers)
+
+
+    def forward(self, x):
+        return self.net(x)
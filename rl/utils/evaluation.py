@@ -0,0 +1,156 @@
+"""
+Batched policy evaluation over a pool of eval envs, in-process or in a background process
+
+    evaluator = Evaluator('Hopper-v2', seed, EE=10, max_el=1000, num_envs=10)
+    EZ, ES, EL = evaluator.evaluate(actor_critic)     # EE episodes, num_envs at a time
+    logs.update(evaluator.logs())                     # evaluation/lag (background only)
+
+All the eval envs are stepped together and the actor is called once per step
+for all of them (deterministic actions). With background=True the episodes run
+in an evaluator process against a snapshot of the actor's weights: evaluate()
+sends the current weights (if the evaluator is idle) and returns at once the
+latest finished results, so the learn loop never waits for evaluation (except
+for the very first call); evaluation/lag is the age, in evaluate() calls, of
+the policy those results belong to.
+"""
+
+import multiprocessing
+from copy import deepcopy
+
+import numpy as np
+import torch as T
+
+from rl.environments.vec import make_vec_env, DummyVecEnv, CloudpickleWrapper
+
+
+
+def evaluate_vec(actor_critic, venv, EE, max_el, score=False, verbose=True, **act_kwargs):
+    """
+    Run EE episodes of the deterministic policy on the envs of venv, in lockstep
+    Returns the episodic returns EZ, scores ES (PDDM info['score'] per step) and lengths EL
+    """
+    N = venv.num_envs
+    EZ, ES, EL = [], [], []
+    O = venv.reset()
+    Z, S, el = np.zeros(N), np.zeros(N), np.zeros(N, dtype=int)
+    active = np.arange(N) < EE # Envs running an episode that counts
+    started = int(active.sum())
+
+    while len(EZ) < EE:
+        A = actor_critic.get_action_np(O, deterministic=True, **act_kwargs) # One actor call for the N envs
+        O, R, D, infos = venv.step(A)
+        Z, el = Z + R, el + 1
+        if score: S += np.array([ info['score'] for info in infos ])
+
+        done = D | (el == max_el)
+        for i in np.flatnonzero(done & active):
+            EZ.append(float(Z[i]))
+            if score: ES.append(S[i]/el[i])
+            EL.append(int(el[i]))
+            if verbose: print(f' [ Agent Evaluation ] Episode: {len(EZ)}   ', end='\r')
+            if started < EE: started += 1
+            else: active[i] = False
+
+        horizon = np.flatnonzero((el == max_el) & ~D).tolist() # Not reset by the VecEnv
+        if horizon: O[horizon] = np.stack(venv.env_method('reset', indices=horizon))
+        Z, S, el = np.where(done, 0, Z), np.where(done, 0, S), np.where(done, 0, el)
+
+    return EZ, ES, EL
+
+
+
+def _evaluator_worker(remote, parent_remote, make_venv_wrapper, actor_critic_wrapper, EE, max_el, score):
+    parent_remote.close()
+    T.set_num_threads(1)
+    venv, actor_critic = make_venv_wrapper.var(), actor_critic_wrapper.var
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "evaluate":
+                actor_weights, act_kwargs = data
+                actor_critic.actor.load_state_dict(actor_weights)
+                remote.send(evaluate_vec(actor_critic, venv, EE, max_el, score, verbose=False, **act_kwargs))
+            elif cmd == "close":
+                venv.close()
+                remote.close()
+                break
+        except EOFError:
+            break
+
+
+
+class Evaluator:
+    """
+    :param env_name: (str) the gym environment ID
+    :param seed: (int) eval env i is seeded with seed + i
+    :param EE: (int) episodes per evaluation
+    :param max_el: (int) episode horizon
+    :param num_envs: (int) eval envs stepped together (at most EE are used)
+    :param vec_env_cls: (Type[VecEnv]) in-process only, DummyVecEnv by default (the evaluator process always uses DummyVecEnv)
+    :param score: (bool) collect info['score'] (PDDM ShadowHand envs)
+    :param background: (bool) evaluate in a background process
+    :param eval_env: (gym.Env) in-process with num_envs == 1, reuse this env instead of making one
+    """
+
+    def __init__(self, env_name, seed, EE, max_el, num_envs=1, vec_env_cls=None,
+                 score=False, background=False, eval_env=None):
+        self.EE, self.max_el, self.score = EE, max_el, score
+        self.background = background
+        num_envs = min(num_envs, EE)
+
+        if background:
+            make_venv = lambda: make_vec_env(env_name, num_envs, seed=seed)
+            self.venv, self.remote, self.process = None, None, None
+            self._make_venv = CloudpickleWrapper(make_venv)
+            self.calls, self.busy_call = 0, None # evaluate() calls; call whose weights are being evaluated
+            self.results, self.results_call = None, None
+        elif num_envs == 1 and eval_env is not None:
+            self.venv = DummyVecEnv([lambda: eval_env])
+        else:
+            self.venv = make_vec_env(env_name, num_envs, seed=seed, vec_env_cls=vec_env_cls)
+
+
+    def evaluate(self, actor_critic, **act_kwargs):
+        if not self.background:
+            return evaluate_vec(actor_critic, self.venv, self.EE, self.max_el, self.score, **act_kwargs)
+
+        if self.process is None: self._start(actor_critic)
+        self.calls += 1
+        self._poll(block=False)
+        if self.busy_call is None: # Idle: evaluate the current weights
+            actor_weights = {k: v.detach().cpu() for k, v in actor_critic.actor.state_dict().items()}
+            self.remote.send(("evaluate", (actor_weights, act_kwargs)))
+            self.busy_call = self.calls
+        if self.results is None: self._poll(block=True) # First evaluation
+        return self.results
+
+
+    def logs(self):
+        if not self.background: return {}
+        return {'evaluation/lag                      ': self.calls - self.results_call}
+
+
+    def _start(self, actor_critic):
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        self.remote, work_remote = ctx.Pipe()
+        args = (work_remote, self.remote, self._make_venv, CloudpickleWrapper(deepcopy(actor_critic)),
+                self.EE, self.max_el, self.score)
+        # daemon=True: if the main process crashes, we should not cause things to hang
+        self.process = ctx.Process(target=_evaluator_worker, args=args, daemon=True)
+        self.process.start()
+        work_remote.close()
+
+
+    def _poll(self, block):
+        if self.busy_call is not None and (block or self.remote.poll()):
+            self.results, self.results_call = self.remote.recv(), self.busy_call
+            self.busy_call = None
+
+
+    def close(self):
+        if self.background:
+            if self.process is not None:
+                self.remote.send(("close", None))
+                self.process.join()
+        else:
+            self.venv.close()
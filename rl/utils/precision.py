@@ -0,0 +1,51 @@
+"""
+Opt-in mixed precision for the update methods
+
+    amp = MixedPrecision('bf16', device)              # 'fp32' (default, off) | 'bf16' | 'fp16'
+    with amp.autocast():                              # forward + loss in low precision
+        loss = ...
+    amp.step(loss, optimizer)                         # zero_grad, (scaled) backward, step
+
+bf16 (CPU or CUDA) keeps the float32 exponent range, so it needs no loss
+scaling; fp16 (CUDA) gets one GradScaler per optimizer. Parameters, optimizer
+states and gradients stay in float32 (autocast only casts the op inputs), and
+numerically fragile ops (log-variance bounds, tanh-squash log-prob) are
+computed in float32 by the networks themselves.
+"""
+
+from contextlib import nullcontext
+
+import torch as T
+
+
+
+class MixedPrecision:
+
+    _null = nullcontext()
+
+    def __init__(self, precision='fp32', device='cpu'):
+        assert precision in ('fp32', 'bf16', 'fp16'), "precision must be 'fp32', 'bf16' or 'fp16'"
+        self.precision = precision
+        self.enabled = precision != 'fp32'
+        self.device_type = 'cuda' if 'cuda' in str(device) else 'cpu'
+        self.dtype = T.float16 if precision == 'fp16' else T.bfloat16
+        self.scale_loss = precision == 'fp16'
+        self._scalers = dict()
+
+
+    def autocast(self):
+        if not self.enabled: return self._null
+        return T.autocast(self.device_type, dtype=self.dtype)
+
+
+    def step(self, loss, optimizer):
+        optimizer.zero_grad()
+        if not self.scale_loss:
+            loss.backward()
+            optimizer.step()
+            return
+        scaler = self._scalers.get(optimizer)
+        if scaler is None: scaler = self._scalers[optimizer] = T.amp.GradScaler(self.device_type)
+        scaler.scale(loss).backward()
+        scaler.step(optimizer)
+        scaler.update()
@@ -0,0 +1,97 @@
+"""
+Hierarchical wall-clock profiler for the learn() loops
+
+    profiler = Profiler(enabled=True, trace_file='trace.json')
+    with profiler.phase('interaction', steps=E):    # time/interaction, throughput/interaction
+        with profiler.phase('env'): ...             # time/interaction/env
+    with profiler.phase('rollout'):
+        profiler.count(len(O))                      # steps of the current phase
+    logs.update(profiler.logs())                    # per-phase totals, p50/p95, steps/sec
+    profiler.save_trace()                           # Chrome trace (chrome://tracing, Perfetto)
+
+When disabled, phase() returns a shared no-op context and count() returns at
+once, so instrumented code pays one attribute lookup and call per phase.
+"""
+
+import time
+import json
+from contextlib import nullcontext
+
+import numpy as np
+
+
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'steps', 'start')
+
+    def __init__(self, profiler, name, steps):
+        self.profiler, self.name, self.steps = profiler, name, steps
+
+    def __enter__(self):
+        self.profiler._stack.append(self.name)
+        self.profiler._steps_stack.append(self.steps)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        p = self.profiler
+        path = '/'.join(p._stack)
+        p._stack.pop()
+        steps = p._steps_stack.pop()
+        p._times.setdefault(path, []).append(end - self.start)
+        if steps: p._steps[path] = p._steps.get(path, 0) + steps
+        if p.trace_file is not None:
+            p._events.append({'name': self.name, 'cat': path, 'ph': 'X', 'pid': 0, 'tid': 0,
+                              'ts': (self.start - p._t0) * 1e6, 'dur': (end - self.start) * 1e6})
+        return False
+
+
+
+class Profiler:
+
+    _null = nullcontext()
+
+    def __init__(self, enabled=False, trace_file=None):
+        self.enabled = enabled
+        self.trace_file = trace_file if enabled else None
+        self._stack, self._steps_stack = [], []
+        self._times, self._steps = dict(), dict()
+        self._events = []
+        self._t0 = time.perf_counter()
+
+
+    def phase(self, name, steps=0):
+        # Nested phases are logged as parent/child; steps feed the phase's throughput
+        if not self.enabled: return self._null
+        return _Phase(self, name, steps)
+
+
+    def count(self, steps=1):
+        # Steps done inside the current (innermost) phase, when unknown on entry
+        if not self.enabled or not self._steps_stack: return
+        self._steps_stack[-1] += steps
+
+
+    def logs(self, reset=True):
+        # {time/<phase>: total s, time/<phase>/p50|p95: s per call, throughput/<phase>: steps/s}
+        logs = dict()
+        for path, times in self._times.items():
+            times = np.asarray(times)
+            total = times.sum()
+            logs[f'{"time/"+path:<36}'] = total
+            if len(times) > 1:
+                logs[f'{"time/"+path+"/p50":<36}'] = np.percentile(times, 50)
+                logs[f'{"time/"+path+"/p95":<36}'] = np.percentile(times, 95)
+            if path in self._steps:
+                logs[f'{"throughput/"+path:<36}'] = self._steps[path] / max(total, 1e-12)
+        if reset:
+            self._times, self._steps = dict(), dict()
+        return logs
+
+
+    def save_trace(self, trace_file=None):
+        trace_file = trace_file or self.trace_file
+        if trace_file is None: return
+        with open(trace_file, 'w') as f:
+            json.dump({'traceEvents': self._events, 'displayTimeUnit': 'ms'}, f)
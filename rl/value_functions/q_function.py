@@ -3,7 +3,7 @@ import numpy as np
 import torch as T
 nn = T.nn
 
-from rl.networks.mlp import MLPNet
+from rl.networks.mlp import MLPNet, MLPEnsembleNet, LinearEnsemble
 
 
 
@@ -12,6 +12,10 @@ def init_weights_(l):
 	if isinstance(l, nn.Linear):
 		nn.init.xavier_uniform_(l.weight, 1.0)
 		nn.init.uniform_(l.bias, 0.0)
+	elif isinstance(l, LinearEnsemble): # xavier_uniform_ per member
+		bound = np.sqrt(6 / (l.in_features + l.out_features))
+		nn.init.uniform_(l.weight, -bound, bound)
+		nn.init.uniform_(l.bias, 0.0)
 
 
 def layer_init(layer, std=np.sqrt(2), bias_const=0.0):
@@ -88,3 +92,36 @@ class SoftQFunction(nn.Module):
     def forward(self, o, a):
         q_inputs = T.cat([o, a], dim=-1)
         return tuple(Q(q_inputs) for Q in self.Qs)
+
+
+
+
+class EnsembleSoftQFunction(nn.Module):
+    """
+    Soft Q-Function, num_q Q-heads (twin-Q: 2, REDQ-style: >2) as one batched network:
+    each layer is a single LinearEnsemble matmul over the heads instead of one MLPNet per Q
+    """
+    def __init__(self, obs_dim, act_dim, net_configs, device, seed, num_q=2):
+        print('Initialize Ensemble Soft Q-function!')
+
+        optimizer = 'T.optim.' + net_configs['optimizer']
+        lr = net_configs['lr']
+
+        super(EnsembleSoftQFunction, self).__init__() # To automatically use forward
+
+        self.num_q = num_q
+        self.qs = MLPEnsembleNet(num_q, obs_dim + act_dim, 1, net_configs)
+        if net_configs['initialize_weights']:
+        	print('Apply Initialization')
+        	self.apply(init_weights_)
+
+        self.to(device)
+
+        self.optimizer = eval(optimizer)(self.parameters(), lr)
+
+        print('QFunction: ', self)
+
+
+    def forward(self, o, a):
+        q_inputs = T.cat([o, a], dim=-1)
+        return self.qs(q_inputs.expand(self.num_q, *q_inputs.shape)).unbind(0) # num_q x (N x 1), as SoftQFunction
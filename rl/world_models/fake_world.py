@@ -3,6 +3,8 @@
 import numpy as np
 import torch as T
 
+from rl.environments.static import get_static_fns
+
 # T.multiprocessing.set_sharing_strategy('file_system')
 
 
@@ -10,74 +12,21 @@ class FakeWorld:
     """
     source: https://github.com/Xingyu-Lin/mbpo_pytorch/predict_env.py
     """
-    def __init__(self, model, env_name="Hopper-v2", model_type='pytorch'):
+    def __init__(self, model, env_name="Hopper-v2", model_type='pytorch',
+                 incremental=False, refresh_epochs=5, reservoir_size=int(5e4)):
         self.model = model
         self.env_name = env_name
+        self.static_fns = get_static_fns(env_name)
         # self.model_type = model_type
 
-
-    def _reward_fn(self, env_name, obs, act):
-        # TODO
-        next_obs = next_obs.numpy()
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(act.shape) == 2
-            vel_x = obs[:, -6] / 0.02
-            power = np.square(act).sum(axis=-1)
-            height = obs[:, 0]
-            ang = obs[:, 1]
-            alive_bonus = 1.0 * (height > 0.7) * (np.abs(ang) <= 0.2)
-            rewards = vel_x + alive_bonus - 1e-3*power
-
-            return rewards
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-            pass
-        elif 'walker_' in env_name:
-            pass
-
-
-    def _termination_fn(self, env_name, obs, act, next_obs):
-        # TODO
-        next_obs = next_obs.numpy()
-        if env_name == "Hopper-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = np.isfinite(next_obs).all(axis=-1) \
-                       * np.abs(next_obs[:, 1:] < 100).all(axis=-1) \
-                       * (height > .7) \
-                       * (np.abs(angle) < .2)
-
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif env_name == "Walker2d-v2":
-            assert len(obs.shape) == len(next_obs.shape) == len(act.shape) == 2
-
-            height = next_obs[:, 0]
-            angle = next_obs[:, 1]
-            not_done = (height > 0.8) \
-                       * (height < 2.0) \
-                       * (angle > -1.0) \
-                       * (angle < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
-        elif 'walker_' in env_name:
-            torso_height =  next_obs[:, -2]
-            torso_ang = next_obs[:, -1]
-            if 'walker_7' in env_name or 'walker_5' in env_name:
-                offset = 0.
-            else:
-                offset = 0.26
-            not_done = (torso_height > 0.8 - offset) \
-                       * (torso_height < 2.0 - offset) \
-                       * (torso_ang > -1.0) \
-                       * (torso_ang < 1.0)
-            done = ~not_done
-            done = done[:, None]
-            return done
+        # Incremental training: after a first full fit, each refresh trains for refresh_epochs
+        # on the transitions stored since the last one + a reservoir sample of all older ones.
+        self.incremental = incremental
+        self.refresh_epochs = refresh_epochs
+        self.reservoir_size = reservoir_size
+        self._num_trained = 0 # buffer.num_stored at the last refresh
+        self._num_seen = 0 # transitions offered to the reservoir
+        self._reservoir = None # (inputs, labels)
 
 
     def _get_logprob(self, x, means, variances):
@@ -85,7 +34,7 @@ class FakeWorld:
         k = x.shape[-1]
 
         ## [ num_networks, batch_size ]
-        log_prob = -1 / 2 * (k * T.log(2 * T.tensor(np.pi)) + T.log(variances).sum(-1) + (T.pow(x - means, 2) / variances).sum(-1))
+        log_prob = -1 / 2 * (k * np.log(2 * np.pi) + T.log(variances).sum(-1) + (T.pow(x - means, 2) / variances).sum(-1))
         ## [ batch_size ]
         prob = T.exp(log_prob).sum(0)
         ## [ batch_size ]
@@ -95,7 +44,18 @@ class FakeWorld:
         return log_prob, stds
 
 
-    def step(self, obs, act, deterministic=False): # ip: Torch
+    def sample_members(self, n): # op: Torch (on the model device)
+        # A random elite per particle, as balanced as possible (no padding in predict_particles)
+        device = self.model._device_
+        return T.randperm(n, device=device) % self.model.elite_size
+
+
+    def step(self, obs, act, deterministic=False, members=None): # ip: Torch, op: Torch (on the model device)
+        """
+        Particle propagation: row i is predicted by elite members[i] only
+            TS-inf: members from sample_members(n), kept for the whole rollout (filtered with the rows)
+            TS1: members=None, a new random elite per row at every step
+        """
 
         if len(obs.shape) == 1 and len(act.shape) == 1:
             obs = obs[None]
@@ -107,43 +67,29 @@ class FakeWorld:
         else:
             return_single = False
 
+        device = self.model._device_
+        obs, act = obs.to(device), act.to(device)
         inputs = T.cat((obs, act), axis=-1) # Torch
+        batch_size = obs.shape[0]
 
-        ensemble_model_means, ensemble_model_vars = self.model.predict(inputs) # ip: Torch, op: Numpy (stack)
+        if members is None: members = self.sample_members(batch_size) # TS1
 
-        ensemble_model_means[:, :, 1:] += obs
-        ensemble_model_stds = T.sqrt(ensemble_model_vars) # Torch
+        # Each member on its own rows only: batch_size x (1+obs_dim)
+        model_means, model_vars = self.model.predict_particles(inputs, members) # ip: Torch, op: Torch
+
+        model_means[:, 1:] += obs
+        model_stds = T.sqrt(model_vars) # Torch
 
         if deterministic:
-            ensemble_samples = ensemble_model_means
+            samples = model_means
         else:
-            size = ensemble_model_means.shape
-            # ensemble_samples = ensemble_model_means + np.random.normal(size=size) * ensemble_model_stds # Numpy
-            ensemble_samples = ensemble_model_means + T.randn(size=size) * ensemble_model_stds # Torch B
-
-        num_models, batch_size, _ = ensemble_model_means.shape
-        # if self.model_type == 'pytorch':
-        # model_idxes = np.random.choice(self.model.elite_model_idxes, size=batch_size)
-        model_idxes = T.as_tensor(np.random.choice(self.model.elite_model_idxes, size=batch_size))
-        # else:
-        #     model_idxes = self.model.random_inds(batch_size)
-
-        # batch_idxes = np.arange(0, batch_size) # Numpy
-        batch_idxes = T.arange(0, batch_size) # Torch
-
-        samples =     ensemble_samples[model_idxes, batch_idxes]
-        model_means = ensemble_model_means[model_idxes, batch_idxes]
-        model_stds =  ensemble_model_stds[model_idxes, batch_idxes]
-
-        log_prob, dev = self._get_logprob(samples, ensemble_model_means, ensemble_model_vars)
+            samples = model_means + T.randn_like(model_means) * model_stds # Torch
 
         rewards, next_obs = samples[:, :1], samples[:, 1:]
-        terminals = self._termination_fn(self.env_name, obs, act, next_obs)
-        terminals = T.tensor(terminals, dtype=T.bool)
+        terminals = self.static_fns.termination_fn(obs, act, next_obs)
 
-        batch_size = model_means.shape[0]
-        return_means = T.cat( (model_means[:, :1], terminals, model_means[:, 1:]),               axis=-1 ) # Torch
-        return_stds =  T.cat( (model_stds [:, :1], T.zeros((batch_size, 1)), model_stds[:, 1:]), axis=-1 ) # Torch
+        return_means = T.cat( (model_means[:, :1], terminals, model_means[:, 1:]), axis=-1 ) # Torch
+        return_stds =  T.cat( (model_stds [:, :1], T.zeros((batch_size, 1), device=device), model_stds[:, 1:]), axis=-1 ) # Torch
 
         if return_single:
             next_obs = next_obs[0]
@@ -152,28 +98,75 @@ class FakeWorld:
             rewards = rewards[0]
             terminals = terminals[0]
 
-        info = {'mean': return_means, 'std': return_stds, 'log_prob': log_prob, 'dev': dev}
+        info = {'mean': return_means, 'std': return_stds, 'members': members}
 
         return next_obs, rewards, terminals, info
 
 
-    def train_fake_world(self, buffer): # Work on!
-        # Get all samples from environment
-        # data = buffer.return_all_stack_np() # Numpy
-        # data = buffer.return_all_stack() # Torch
-        data = buffer.data_for_WM_stack() # Torch (TrajBuffer)
+    def _wm_data(self, data):
         state, action, reward, next_state, _ = data.values()
         delta_state = next_state - state
 
         inputs = T.cat( (state, action), axis=-1 ) # Torch
         labels = T.cat( ( T.reshape( reward, (reward.shape[0], -1) ), delta_state ), axis=-1 ) # Torch
+        return inputs, labels
+
+
+    def _update_reservoir(self, inputs, labels):
+        # Algorithm R over the stream of trained transitions, vectorized over the batch:
+        # item t (0-based) goes to slot t while filling up, then to slot j ~ U[0, t] if j < K
+        K, m = self.reservoir_size, inputs.shape[0]
+        if self._reservoir is None:
+            self._reservoir = (inputs.new_zeros((K, inputs.shape[1])), labels.new_zeros((K, labels.shape[1])))
+        t = self._num_seen + T.arange(m)
+        slots = T.where(t < K, t, (T.rand(m) * (t + 1)).long())
+        keep = slots < K
+        # Several items may hit one slot: the last of them wins, as in the sequential algorithm
+        winner = T.full((K,), -1, dtype=T.long).scatter_reduce_(0, slots[keep], T.arange(m)[keep], 'amax')
+        hit = winner >= 0
+        self._reservoir[0][hit] = inputs[winner[hit]]
+        self._reservoir[1][hit] = labels[winner[hit]]
+        self._num_seen += m
+
+
+    def train_fake_world(self, buffer): # Work on!
+        # Get all samples from environment
+        # data = buffer.return_all_stack_np() # Numpy
+        # data = buffer.return_all_stack() # Torch
+        if self.incremental and self._num_trained > 0:
+            return self._train_fake_world_incremental(buffer)
+
+        data = buffer.data_for_WM_stack() # Torch
+        inputs, labels = self._wm_data(data)
 
         holdout_mse_mean = self.model.train( inputs, labels, batch_size=256, holdout_ratio=0.2 ) ###
 
+        if self.incremental:
+            # Seed the reservoir with the (unique) transitions of the buffer
+            inputs, labels = self._wm_data(buffer.data_for_WM_recent(buffer.size))
+            self._update_reservoir(inputs, labels)
+            self._num_trained = buffer.num_stored
+
         # return holdout_mse_mean
         return holdout_mse_mean.item()
 
 
+    def _train_fake_world_incremental(self, buffer):
+        new_inputs, new_labels = self._wm_data(buffer.data_for_WM_recent(buffer.num_stored - self._num_trained))
+        num_old = min(self._num_seen, self.reservoir_size)
+        inputs = T.cat( (new_inputs, self._reservoir[0][:num_old]), axis=0 )
+        labels = T.cat( (new_labels, self._reservoir[1][:num_old]), axis=0 )
+
+        self.model.scaler.update(new_inputs) # running statistics over everything trained on
+        holdout_mse_mean = self.model.train( inputs, labels, batch_size=256, holdout_ratio=0.2,
+                                             max_epochs=self.refresh_epochs, fit_scaler=False )
+
+        self._update_reservoir(new_inputs, new_labels)
+        self._num_trained = buffer.num_stored
+
+        return holdout_mse_mean.item()
+
+
 
 
 
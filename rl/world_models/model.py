@@ -8,6 +8,7 @@ Inspired by:
 
 import random
 import copy
+import time
 import typing
 
 import warnings
@@ -32,7 +33,8 @@ import pytorch_lightning as pl
 from pytorch_lightning import LightningModule, Trainer
 from pytorch_lightning.callbacks.early_stopping import EarlyStopping
 
-from rl.networks.mlp import MLPNet
+from rl.networks.mlp import MLPNet, LinearEnsemble
+from rl.utils.precision import MixedPrecision
 
 
 
@@ -106,8 +108,34 @@ class StandardScaler(object):
         """
         # self.mu = np.mean(data, axis=0, keepdims=True) # Numpy
         # self.std = np.std(data, axis=0, keepdims=True) # Numpy
+        self.count = data.shape[0]
         self.mu = T.mean(data, axis=0, keepdims=True) # Torch
-        self.std = T.std(data, axis=0, keepdims=True) # Torch
+        self.m2 = T.sum(T.square(data - self.mu), axis=0, keepdims=True) # Torch
+        self._set_std()
+
+    def update(self, data):
+        """Updates the running mean/std with a new batch of data (Chan et al. parallel
+        variance), i.e. the same statistics as fitting on all the data seen so far.
+
+        Arguments:
+        data (T.Tensor): A tensor containing the new inputs
+
+        Returns: None.
+        """
+        if getattr(self, 'count', 0) == 0: return self.fit(data)
+        n_b = data.shape[0]
+        if n_b == 0: return
+        mu_b = T.mean(data, axis=0, keepdims=True)
+        m2_b = T.sum(T.square(data - mu_b), axis=0, keepdims=True)
+        delta = mu_b - self.mu.to(data.device)
+        n = self.count + n_b
+        self.mu = self.mu.to(data.device) + delta * n_b / n
+        self.m2 = self.m2.to(data.device) + m2_b + T.square(delta) * self.count * n_b / n
+        self.count = n
+        self._set_std()
+
+    def _set_std(self):
+        self.std = T.sqrt(self.m2 / max(self.count - 1, 1)) # unbiased, as T.std
         self.std[self.std < 1e-12] = 1.0
 
     def transform(self, data):
@@ -118,7 +146,7 @@ class StandardScaler(object):
 
         Returns: (np.array) The transformed dataset.
         """
-        return (data - self.mu) / self.std
+        return (data - self.mu.to(data.device)) / self.std.to(data.device)
 
     def inverse_transform(self, data):
         """Undoes the transformation performed by this scaler.
@@ -144,54 +172,6 @@ class Swish(nn.Module):
 
 
 
-class LinearEnsemble(nn.Module): # source: https://github.com/Xingyu-Lin/mbpo_pytorch/model.py
-    __constants__ = ['in_features', 'out_features']
-    ensemble_size: int
-    in_features: int
-    out_features: int
-    weight: T.Tensor
-
-    def __init__(self,
-                 ensemble_size: int,
-                 in_features: int,
-                 out_features: int,
-                 weight_decay: float = 0.,
-                 bias: bool = True
-                 ) -> None:
-
-        super(LinearEnsemble, self).__init__()
-
-        self.ensemble_size = ensemble_size
-
-        self.in_features = in_features
-        self.out_features = out_features
-
-        self.weight = nn.Parameter( T.Tensor(ensemble_size, in_features, out_features) )
-        self.weight_decay = weight_decay
-
-        if bias:
-            self.bias = nn.Parameter( T.Tensor(ensemble_size, out_features) )
-        else:
-            self.register_parameter('bias', None)
-
-        self.reset_parameters()
-
-    def reset_parameters(self) -> None:
-        pass
-
-
-    def forward(self, x: T.Tensor) -> T.Tensor:
-        return T.add(T.bmm(x, self.weight), self.bias[:, None, :])  # w times x + b
-
-    def extra_repr(self) -> str:
-        return 'in_features={}, out_features={}, bias={}'.format(
-            self.in_features, self.out_features, self.bias is not None
-        )
-
-
-
-
-
 class EnsembleModel(nn.Module):
 
     def __init__(self,
@@ -270,17 +250,19 @@ class EnsembleModel(nn.Module):
 
         self.optimizer = T.optim.Adam(self.parameters(), lr=learning_rate)
 
-        self.activation = Swish() # nn.ReLU()
+        # self.activation = Swish() # nn.ReLU()
+        self.activation = nn.SiLU() # Swish, native kernel
 
 
-    def forward(self, x, ret_log_var=False):
+    def forward(self, x, ret_log_var=False, idx=None):
         # print('x: ', x.shape)
-        nn1_output = self.activation(self.nn1(x))
-        nn2_output = self.activation(self.nn2(nn1_output))
-        nn3_output = self.activation(self.nn3(nn2_output))
-        nn4_output = self.activation(self.nn4(nn3_output))
-        nn5_output = self.nn5(nn4_output)
-        nn_output = nn5_output
+        # idx: evaluate only these members, x: len(idx) x N x dim
+        nn1_output = self.activation(self.nn1(x, idx))
+        nn2_output = self.activation(self.nn2(nn1_output, idx))
+        nn3_output = self.activation(self.nn3(nn2_output, idx))
+        nn4_output = self.activation(self.nn4(nn3_output, idx))
+        nn5_output = self.nn5(nn4_output, idx)
+        nn_output = nn5_output.float() # Log-variance bounds (softplus, exp) in fp32 under autocast
 
         # nn1_output = self.activation(self.nn1(x))
         # nn2_output = self.activation(self.nn2(nn1_output))
@@ -316,22 +298,25 @@ class EnsembleModel(nn.Module):
         """
         assert len(mean.shape) == len(logvar.shape) == len(labels.shape) == 3
 
+        # Per-member losses in one reduction (average over batch and dim); the
+        # total is their mean, i.e. the same value as the loss over the whole ensemble.
         if inc_var_loss:
-            # Average over batch and dim, sum over ensembles.
-            losses = T.tensor([ self.gnll_loss(mean[m, :, :], labels[m, :, :], T.exp(logvar[m, :, :])) for m in range(mean.shape[0]) ])
-            total_loss = self.gnll_loss(mean, labels, T.exp(logvar))
-            return total_loss, losses # op: Torch
+            # Gaussian NLL (nn.GaussianNLLLoss, full=False); logvar >= min_logvar so no var clamping
+            losses = 0.5 * (logvar + T.square(mean - labels) * T.exp(-logvar)).mean(dim=(1, 2))
         else:
-            losses = T.tensor([ self.mse_loss(mean[m, :, :], labels[m, :, :]) for m in range(mean.shape[0]) ])
-            total_loss = self.mse_loss(mean, labels)
-            return total_loss, losses # op: Torch
+            losses = T.square(mean - labels).mean(dim=(1, 2))
+        total_loss = losses.mean()
+        return total_loss, losses.detach() # op: Torch
 
 
-    def train(self, loss):
-        self.optimizer.zero_grad()
+    def train(self, loss, amp=None):
         loss += 0.01 * T.sum(self.max_logvar) - 0.01 * T.sum(self.min_logvar)
         if self.use_decay:
             loss += self.compute_wd_loss()
+        if amp is not None: # MixedPrecision: (scaled) backward
+            amp.step(loss, self.optimizer)
+            return
+        self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
 
@@ -341,7 +326,8 @@ class EnsembleModel(nn.Module):
 
 class EnsembleDynamicsModel():
 
-    def __init__(self, network_size, elite_size, state_size, action_size, reward_size=1, hidden_size=200, use_decay=False, device='cpu'):
+    def __init__(self, network_size, elite_size, state_size, action_size, reward_size=1, hidden_size=200, use_decay=False, device='cpu',
+                 max_epochs=None, max_time=None, compile=False, precision='fp32'):
         self.network_size = network_size
         self.elite_size = elite_size
         self.model_list = []
@@ -351,16 +337,28 @@ class EnsembleDynamicsModel():
 
         self.network_size = network_size
         self.elite_model_idxes = []
+        self.elite_idxes = T.arange(elite_size, device=device)
         self.ensemble_model = EnsembleModel(state_size, action_size, reward_size, network_size, hidden_size, use_decay=use_decay, device=device)
+        # Forward used by the predict_* methods (no grads): optionally compiled (T.compile), shares the parameters
+        self.inference_model = T.compile(self.ensemble_model, dynamic=True) if compile else self.ensemble_model
         # print('ensemble_model: ', self.ensemble_model)
 
         self.scaler = StandardScaler()
+        self.amp = MixedPrecision(precision, device) # Training steps only (holdout/predict in fp32)
+
+        # Training budget (None: train until the holdout losses stop improving)
+        self.max_epochs = max_epochs
+        self.max_time = max_time # seconds
+        self.train_info = {'epochs': 0, 'time': 0., 'epoch_times': [], 'stop': None, 'num_data': 0}
 
         self._device_ = device
 
 
-    def train(self, inputs, labels, batch_size=256, holdout_ratio=0., max_epochs_since_update=5):
+    def train(self, inputs, labels, batch_size=256, holdout_ratio=0., max_epochs_since_update=5, max_epochs=None, max_time=None,
+              fit_scaler=True):
         device = self._device_
+        max_epochs = self.max_epochs if max_epochs is None else max_epochs
+        max_time = self.max_time if max_time is None else max_time
 
         self._max_epochs_since_update = max_epochs_since_update
         self._epochs_since_update = 0
@@ -368,59 +366,61 @@ class EnsembleDynamicsModel():
         self._snapshots = {i: (None, 1e10) for i in range(self.network_size)}
 
         num_holdout = int(inputs.shape[0] * holdout_ratio)
-        # permutation = np.random.permutation(inputs.shape[0]) # Numpy
         permutation = T.randperm(inputs.shape[0]) # Torch [1]
         inputs, labels = inputs[permutation], labels[permutation]
 
         train_inputs, train_labels = inputs[num_holdout:], labels[num_holdout:]
         holdout_inputs, holdout_labels = inputs[:num_holdout], labels[:num_holdout]
 
-        self.scaler.fit(train_inputs)
-        train_inputs = self.scaler.transform(train_inputs)
-        holdout_inputs = self.scaler.transform(holdout_inputs)
-
-        # holdout_inputs = T.from_numpy(holdout_inputs).float().to(device) # Numpy
-        # holdout_labels = T.from_numpy(holdout_labels).float().to(device) # Numpy
-        holdout_inputs = holdout_inputs.to(device) # Torch
+        if fit_scaler: self.scaler.fit(train_inputs) # else: the caller keeps it up to date (StandardScaler.update)
+        train_inputs = self.scaler.transform(train_inputs).to(device) # Torch, moved once
+        train_labels = train_labels.to(device)
+        holdout_inputs = self.scaler.transform(holdout_inputs).to(device) # Torch
         holdout_labels = holdout_labels.to(device) # Torch
-        holdout_inputs = holdout_inputs[None, :, :].repeat([self.network_size, 1, 1])
-        holdout_labels = holdout_labels[None, :, :].repeat([self.network_size, 1, 1])
+        holdout_inputs = holdout_inputs[None, :, :].expand(self.network_size, -1, -1)
+        holdout_labels = holdout_labels[None, :, :].expand(self.network_size, -1, -1)
 
-        # for epoch in range(5):
+        num_train = train_inputs.shape[0]
+        epoch_times, stop = [], 'converged'
+        train_start = time.time()
         for epoch in itertools.count():
-            # losses = []
-            # train_idx = np.vstack([np.random.permutation(train_inputs.shape[0]) for _ in range(self.network_size)]) # Numpy
-            train_idx = T.vstack( [ T.randperm(train_inputs.shape[0]) for _ in range(self.network_size) ] ) # Torch [2]
-            # print('EnsembleDynamicsModel: train_idx', train_idx.shape)
-            for start_pos in range(0, train_inputs.shape[0], batch_size):
+            epoch_start = time.time()
+            # One independent permutation per member, drawn in a single batched op: network_size x num_train
+            train_idx = T.argsort(T.rand(self.network_size, num_train, device=device), dim=-1) # Torch [2]
+            for start_pos in range(0, num_train, batch_size):
                 idx = train_idx[:, start_pos: start_pos + batch_size]
-                # train_input = T.from_numpy(train_inputs[idx]).float().to(device) # Numpy
-                # train_label = T.from_numpy(train_labels[idx]).float().to(device) # Numpy
-                train_input = train_inputs[idx].to(device) # Torch [3]
-                train_label = train_labels[idx].to(device) # Torch [4]
-                # losses = []
-                mean, logvar = self.ensemble_model(train_input, ret_log_var=True) # ip: Torch, op: Torch
-                loss, _ = self.ensemble_model.compute_loss(mean, logvar, train_label) # ip: Torch, op: Torch (grad)
-                self.ensemble_model.train(loss)
-                # losses.append(loss)
+                train_input = train_inputs[idx] # Torch [3]
+                train_label = train_labels[idx] # Torch [4]
+                with self.amp.autocast():
+                    mean, logvar = self.ensemble_model(train_input, ret_log_var=True) # ip: Torch, op: Torch
+                    loss, _ = self.ensemble_model.compute_loss(mean, logvar, train_label) # ip: Torch, op: Torch (grad)
+                self.ensemble_model.train(loss, self.amp)
 
             with T.no_grad():
                 holdout_mean, holdout_logvar = self.ensemble_model(holdout_inputs, ret_log_var=True)
                 _, holdout_mse_losses = self.ensemble_model.compute_loss(holdout_mean, holdout_logvar, holdout_labels, inc_var_loss=False)
-                # holdout_mse_losses = holdout_mse_losses.detach().cpu().numpy()
-                # sorted_loss_idx = np.argsort(holdout_mse_losses)
-                holdout_mse_losses = holdout_mse_losses.detach()
+                holdout_mse_losses = holdout_mse_losses.cpu()
                 sorted_loss_idx = T.argsort(holdout_mse_losses)
                 self.elite_model_idxes = sorted_loss_idx[:self.elite_size].tolist()
+                self.elite_idxes = sorted_loss_idx[:self.elite_size].to(device)
                 break_train = self._save_best(epoch, holdout_mse_losses)
-                if break_train: # Used with itertools.count()
-                    # print(f"[ Break Model Training ] Epoch: {epoch} | HO MSEs: {[round(x, 4) for x in holdout_mse_losses]}"+(" "*10))
-                    # print(f"[ Break Model Training ] Epoch: {epoch} | HO MSEs: {[round(x, 4) for x in holdout_mse_losses.numpy()]}"+(" "*10))
-                    break
-            # print(f"[ Model Training ] Epoch: {epoch}, HO MSEs: {[round(x, 4) for x in holdout_mse_losses]}"+(" "*10), end='\r')
-            print(f"[ Model Training ] Epoch: {epoch}, HO MSEs: {[round(x, 4) for x in holdout_mse_losses.numpy()]}"+(" "*10), end='\r')
-
-        # return np.mean(holdout_mse_losses)
+
+            epoch_times.append(time.time() - epoch_start)
+            elapsed = time.time() - train_start
+            print(f"[ Model Training ] Epoch: {epoch}, HO MSEs: {[round(x, 4) for x in holdout_mse_losses.numpy()]} | {round(epoch_times[-1], 3)}s/epoch"+(" "*10), end='\r')
+            if break_train: # Used with itertools.count()
+                break
+            if max_epochs is not None and epoch+1 >= max_epochs:
+                stop = 'max_epochs'
+                break
+            if max_time is not None and elapsed >= max_time:
+                stop = 'max_time'
+                break
+
+        self.train_info = {'epochs': epoch+1, 'time': time.time() - train_start, 'epoch_times': epoch_times, 'stop': stop,
+                           'num_data': inputs.shape[0]}
+        # print(f"[ Break Model Training ] Epoch: {epoch} ({stop}) | {round(self.train_info['time'], 2)}s"+(" "*10))
+
         return T.mean(holdout_mse_losses)
 
 
@@ -445,7 +445,33 @@ class EnsembleDynamicsModel():
             return False
 
 
-    def predict(self, inputs, batch_size=1024, factored=True): # ip: Torch, op: Torch (used in Fakework.step)
+    def predict_elites(self, inputs): # ip: Torch, op: Torch (on device, used in Fakework.step)
+        # Elite members only, no chunking and no host round-trip: num_elites x N x dim
+        inputs = self.scaler.transform(inputs.to(self._device_))
+        with T.no_grad(): # Not inference_mode: callers update the outputs in place
+            return self.inference_model(inputs[None, :, :].expand(self.elite_size, -1, -1), ret_log_var=False, idx=self.elite_idxes)
+
+
+    def predict_particles(self, inputs, members): # ip: Torch, op: Torch (on device)
+        # Row i by elite members[i] (in 0..num_elites-1) only: rows are grouped per member
+        # (padded to the largest group) into one num_elites x max_group x dim pass
+        inputs = self.scaler.transform(inputs.to(self._device_))
+        members = members.to(self._device_)
+        N = inputs.shape[0]
+        counts = T.bincount(members, minlength=self.elite_size)
+        order = T.argsort(members, stable=True)
+        group = members[order]
+        pos = T.arange(N, device=self._device_) - (T.cumsum(counts, 0) - counts)[group] # Row within its group
+        x = inputs.new_zeros((self.elite_size, int(counts.max()), inputs.shape[1]))
+        x[group, pos] = inputs[order]
+        with T.inference_mode():
+            mean, var = self.inference_model(x, ret_log_var=False, idx=self.elite_idxes)
+        out_mean, out_var = mean.new_empty((N, mean.shape[-1])), var.new_empty((N, var.shape[-1]))
+        out_mean[order], out_var[order] = mean[group, pos], var[group, pos]
+        return out_mean, out_var
+
+
+    def predict(self, inputs, batch_size=1024, factored=True): # ip: Torch, op: Torch (all members, on CPU)
         device = self._device_
 
         inputs = self.scaler.transform(inputs)
@@ -454,7 +480,8 @@ class EnsembleDynamicsModel():
         for i in range(0, inputs.shape[0], batch_size):
             # input = T.from_numpy( inputs[ i : min(i + batch_size, inputs.shape[0]) ] ).float().to(device) # Numpy
             input = inputs[ i : min(i + batch_size, inputs.shape[0]) ].to(device) # Torch
-            b_mean, b_var = self.ensemble_model(input[None, :, :].repeat([self.network_size, 1, 1]), ret_log_var=False)
+            with T.inference_mode():
+                b_mean, b_var = self.inference_model(input[None, :, :].repeat([self.network_size, 1, 1]), ret_log_var=False)
             # ensemble_mean.append(b_mean.detach().cpu().numpy()) # Numpy
             # ensemble_var.append(b_var.detach().cpu().numpy()) # Numpy
             ensemble_mean.append(b_mean.detach().cpu()) # Torch
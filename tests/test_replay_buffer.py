@@ -0,0 +1,175 @@
+import torch as T
+
+from rl.data.buffer import ReplayBuffer
+
+
+KEYS = ('observations', 'actions', 'rewards', 'observations_next', 'terminals')
+
+
+def buffers(size, **kwargs):
+    return [ReplayBuffer(4, 2, size, 0, 'cpu', next_obs=next_obs, **kwargs) for next_obs in ('copy', 'index')]
+
+
+def store(buffers, history, O, A, R, O_next, D):
+    for buffer in buffers: buffer.store_batch(O, A, R, O_next, D)
+    for k, X in zip(KEYS, (O, A, R, O_next, D)): history.setdefault(k, []).append(T.as_tensor(X).reshape(len(O), -1))
+
+
+def live(buffer):
+    batch = buffer.data_for_WM_recent(buffer.size)
+    return batch, batch['rewards'][:, 0].long() # rewards are transition ids
+
+
+def assert_live(buffers, history):
+    # Every live transition equals the stored one, as many in both modes (index orders the rows of a store by
+    # obs id, so a store cut by the wrap may keep other rows of it than copy does)
+    history = {k: T.cat(v).float() for k, v in history.items()}
+    for buffer in buffers:
+        assert buffer.size == buffers[0].size
+        batch, ids = live(buffer)
+        assert len(T.unique(ids)) == buffer.size
+        for k in KEYS:
+            assert T.equal(batch[k], history[k][ids]), k
+
+
+def env_steps(num_envs, steps, obs_dim=4, act_dim=2, p_done=0.1, p_timeout=0.05, uid=0):
+    # num_envs envs stepped together: o' is the terminal observation, the next o a reset one after done/timeout
+    O = T.randn(num_envs, obs_dim)
+    for _ in range(steps):
+        O_next, D = T.randn(num_envs, obs_dim), T.rand(num_envs, 1) < p_done
+        R = T.arange(uid, uid+num_envs, dtype=T.float32).reshape(-1, 1)
+        uid += num_envs
+        yield O, T.randn(num_envs, act_dim), R, O_next, D
+        reset = D[:, 0] | (T.rand(num_envs) < p_timeout)
+        O = O_next.clone()
+        O[reset] = T.randn(int(reset.sum()), obs_dim)
+
+
+def test_index_store_transition_wraparound():
+    copy, index = buffers(50)
+    history = dict()
+    for O, A, R, O_next, D in env_steps(1, 170):
+        for buffer in (copy, index):
+            buffer.store_transition(O[0], A[0], R[0], O_next[0], D[0])
+        for k, X in zip(KEYS, (O, A, R, O_next, D)): history.setdefault(k, []).append(X.float())
+    assert index.ptr == 170 % 50
+    assert T.equal(live(index)[1], T.arange(120, 170)) # one row per store: plain FIFO
+    assert_live((copy, index), history)
+
+
+def test_index_parallel_envs_wraparound():
+    copy, index = buffers(100)
+    history = dict()
+    for batch in env_steps(8, 60): # 480 rows, the wrap cuts stores
+        store((copy, index), history, *batch)
+        assert_live((copy, index), history)
+    assert index.obs_size < 2 * index.max_size # sequential steps share their observations
+
+
+def test_index_done_boundaries():
+    copy, index = buffers(200)
+    history = dict()
+    for batch in env_steps(4, 40, p_done=0.3, p_timeout=0.3):
+        store((copy, index), history, *batch)
+    assert_live((copy, index), history)
+    # The o' of a terminal step is not the o of the env's next step (reset), yet both are reconstructed
+    O, O_next, D = [T.cat(history[k]).reshape(40, 4, -1) for k in ('observations', 'observations_next', 'terminals')]
+    assert not (O[1:] == O_next[:-1]).all(-1)[D[:-1, :, 0] > 0].any()
+
+
+def test_index_model_rollouts():
+    # MBPO rollouts: the done rows of a step are dropped from the next one
+    copy, index = buffers(300)
+    history, uid = dict(), 0
+    for _ in range(5):
+        O = T.randn(64, 4)
+        for k in range(4):
+            A, O_next, D = T.randn(len(O), 2), T.randn(len(O), 4), T.rand(len(O), 1) < 0.2
+            R = T.arange(uid, uid+len(O), dtype=T.float32).reshape(-1, 1)
+            uid += len(O)
+            store((copy, index), history, O, A, R, O_next, D)
+            assert_live((copy, index), history)
+            O = O_next[~D[:, 0]]
+
+
+def test_index_batch_larger_than_buffer():
+    copy, index = buffers(30)
+    history = dict()
+    store((copy, index), history, *next(env_steps(100, 1)))
+    assert index.size == 30
+    assert_live((copy, index), history)
+
+
+def test_index_obs_store_grows():
+    copy, index = buffers(64, obs_size=16)
+    history = dict()
+    for batch in env_steps(8, 30, p_done=0.5, p_timeout=0.5): # mostly new observations
+        store((copy, index), history, *batch)
+    assert index.obs_size > 16
+    assert_live((copy, index), history)
+
+
+def test_index_resize():
+    copy, index = buffers(100)
+    history, steps = dict(), env_steps(8, 75)
+    for size in (60, 250, 90):
+        for _ in range(25):
+            store((copy, index), history, *next(steps))
+        for buffer in (copy, index): buffer.resize(size)
+        assert_live((copy, index), history)
+
+
+def test_index_sample_batch():
+    _, index = buffers(100)
+    for batch in env_steps(4, 10):
+        index.store_batch(*batch)
+    batch = index.sample_batch(32)
+    assert batch['observations'].shape == batch['observations_next'].shape == (32, 4)
+    assert batch['observations'].dtype == T.float32
+
+
+def test_store_batch_wraparound():
+    # Head/tail split at the wrap, a batch larger than the buffer, NumPy and torch sources, fused or not
+    for fused in (False, True):
+        buffer, history = ReplayBuffer(4, 2, 50, 0, 'cpu', fused=fused), dict()
+        for i, n in enumerate((30, 35, 50, 7, 120, 13)): # ptr 30, 15 (wrap), 15, 22, 22 (> max_size), 35
+            batch = next(env_steps(n, 1, uid=buffer.num_stored))
+            if i % 2: batch = [X.numpy() for X in batch]
+            store((buffer,), history, *batch)
+        assert (buffer.ptr, buffer.size, buffer.num_stored) == (35, 50, 255)
+        assert T.equal(live(buffer)[1], T.arange(205, 255))
+        assert_live((buffer,), history)
+
+
+def test_store_batch_obs_dtype():
+    buffer = ReplayBuffer(4, 2, 50, 0, 'cpu', obs_dtype=T.float16)
+    O, A, R, O_next, D = next(env_steps(20, 1))
+    buffer.store_batch(O, A, R, O_next, D)
+    batch = buffer.data_for_WM_recent(20)
+    assert buffer.obs_buf.dtype == buffer.obs_next_buf.dtype == T.float16
+    assert batch['observations'].dtype == T.float32 # cast back on sampling
+    assert T.equal(batch['observations'], O.half().float())
+    assert T.equal(batch['actions'], A)
+
+
+def test_memmap_reopen_after_resize(tmp_path):
+    for next_obs in ('copy', 'index'):
+        path, history = str(tmp_path / next_obs), dict()
+        buffer = ReplayBuffer(4, 2, 100, 0, 'cpu', next_obs=next_obs, storage='memmap', path=path)
+        steps = env_steps(8, 40)
+        for _ in range(20): store((buffer,), history, *next(steps))
+        buffer.resize(250) # grown files
+        for _ in range(10): store((buffer,), history, *next(steps))
+        buffer.close()
+        # Reopened at the configured size: max_size, pointers and rows are the stored ones
+        reopened = ReplayBuffer(4, 2, 100, 0, 'cpu', next_obs=next_obs, storage='memmap', path=path)
+        assert (reopened.max_size, reopened.size, reopened.ptr, reopened.num_stored) == (250, 180, 180, 240)
+        assert_live((reopened,), history)
+        for _ in range(10): store((reopened,), history, *next(steps)) # wraps at 250
+        assert_live((reopened,), history)
+        reopened.resize(60) # shrunk in place
+        reopened.close()
+        reopened = ReplayBuffer(4, 2, 100, 0, 'cpu', next_obs=next_obs, storage='memmap', path=path)
+        assert (reopened.max_size, reopened.size) == (60, 60)
+        assert_live((reopened,), history)
+        reopened.close(delete=True)
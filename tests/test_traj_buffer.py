@@ -0,0 +1,105 @@
+import torch as T
+
+from rl.data.buffer import TrajBuffer, gae_batch
+
+
+def store_paths(buffer, E, obs_dim=3, act_dim=2):
+    # Parallel trajectories of lengths E (ragged) through store_batch/finish_path_batch
+    E = T.as_tensor(E)
+    B, K = len(E), int(E.max())
+    for k in range(1, K+1):
+        rows = None if k == 1 else T.nonzero(E >= k)[:, 0]
+        n = B if rows is None else len(rows)
+        buffer.store_batch(T.randn(n, obs_dim), T.randn(n, act_dim), T.randn(n, 1), T.randn(n, obs_dim),
+                           T.randn(n, 1), T.randn(n, 1), k, Pre_A=T.randn(n, act_dim), rows=rows)
+    buffer.finish_path_batch(E, T.randn(B, 1))
+
+
+def test_finish_path_batch_keeps_max_size():
+    buffer = TrajBuffer(3, 2, 20, 10, 100, 0)
+    for _ in range(30):
+        store_paths(buffer, T.randint(1, 21, (4,)))
+        assert buffer.total_size() <= buffer.max_size
+        lens = buffer.traj_len[buffer.first:buffer.last]
+        assert int(lens.sum()) == buffer.total_size()
+
+
+def test_finish_path_batch_larger_than_max_size():
+    buffer = TrajBuffer(3, 2, 20, 10, 50, 0)
+    store_paths(buffer, [20, 20, 20, 15])
+    assert buffer.total_size() == 35 # the last two trajectories
+    assert buffer.traj_len[buffer.first:buffer.last].tolist() == [20, 15]
+
+
+def test_finish_path_keeps_max_size():
+    buffer = TrajBuffer(3, 2, 20, 10, 100, 0)
+    for _ in range(30):
+        e = int(T.randint(1, 21, ()))
+        for k in range(1, e+1):
+            buffer.store(T.randn(3), T.randn(2), T.randn(2), T.randn(1), T.randn(3), T.randn(1), T.randn(1), k)
+        buffer.finish_path(e, T.zeros(1))
+        assert buffer.total_size() <= buffer.max_size
+
+
+def test_clean_buffer_evicts_oldest_to_max_size():
+    buffer = TrajBuffer(3, 2, 20, 10, 50, 0)
+    store_paths(buffer, [10, 10, 10, 10, 10])
+    assert buffer.total_size() == 50 # exactly max_size: nothing evicted
+    store_paths(buffer, [15])
+    assert buffer.traj_len[buffer.first:buffer.last].tolist() == [10, 10, 10, 15]
+
+
+def gae_reference(r, v, boot, gamma, lam):
+    # One trajectory, step by step: r, v (e,), boot: value after the last step
+    e = len(r)
+    adv, ret = T.zeros(e), T.zeros(e)
+    a, g = 0.0, float(boot)
+    for t in reversed(range(e)):
+        v_next = float(boot) if t == e-1 else float(v[t+1])
+        a = float(r[t]) + gamma * v_next - float(v[t]) + gamma * lam * a
+        g = float(r[t]) + gamma * g
+        adv[t], ret[t] = a, g
+    return adv, ret
+
+
+def test_gae_batch_ragged():
+    gamma, lam, H = 0.99, 0.95, 12
+    E = T.tensor([12, 5, 0, 1, 7])
+    R, V = T.randn(len(E), H+1, 1), T.randn(len(E), H+1, 1)
+    boot = T.randn(len(E))
+    R[T.arange(len(E)), E, 0] = V[T.arange(len(E)), E, 0] = boot
+    Adv, Ret = gae_batch(R, V, E, gamma, lam)
+    assert Adv.shape == Ret.shape == (len(E), H, 1)
+    for i, e in enumerate(E.tolist()):
+        adv, ret = gae_reference(R[i, :e, 0], V[i, :e, 0], boot[i], gamma, lam)
+        assert T.allclose(Adv[i, :e, 0], adv, atol=1e-5)
+        assert T.allclose(Ret[i, :e, 0], ret, atol=1e-5)
+        assert (Adv[i, e:] == 0).all() and (Ret[i, e:] == 0).all() # E=0: all zero
+
+
+def test_finish_path_batch_matches_finish_path():
+    E = T.tensor([6, 0, 3, 1])
+    V_last = T.randn(len(E), 1)
+    data = [(T.randn(int(E.max()), 3), T.randn(int(E.max()), 2), T.randn(int(E.max()), 1), T.randn(int(E.max()), 1)) for _ in E]
+
+    batch = TrajBuffer(3, 2, 10, 10, 100, 0)
+    for k in range(1, int(E.max())+1):
+        rows = None if k == 1 else T.nonzero(E >= k)[:, 0]
+        i = T.arange(len(E)) if rows is None else rows
+        O, A, R, V = [T.stack([data[j][f][k-1] for j in i.tolist()]) for f in range(4)]
+        batch.store_batch(O, A, R, O, V, T.zeros(len(i), 1), k, Pre_A=A, rows=rows)
+    batch.finish_path_batch(E, V_last)
+
+    path = TrajBuffer(3, 2, 10, 10, 100, 0)
+    for j, e in enumerate(E.tolist()):
+        if e == 0: continue
+        O, A, R, V = data[j]
+        for k in range(1, e+1):
+            path.store(O[k-1], A[k-1], A[k-1], R[k-1], O[k-1], V[k-1], T.zeros(1), k)
+        path.finish_path(e, V_last[j])
+
+    assert batch.total_size() == path.total_size() == int(E.sum())
+    assert batch.traj_len[batch.first:batch.last].tolist() == [6, 3, 1]
+    batch.batch_data(), path.batch_data()
+    assert T.allclose(batch.adv_batch, path.adv_batch.float(), atol=1e-5)
+    assert T.allclose(batch.ret_batch, path.ret_batch.float(), atol=1e-5)
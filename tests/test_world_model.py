@@ -0,0 +1,70 @@
+import pytest
+import torch as T
+
+pytest.importorskip('pytorch_lightning')
+pytest.importorskip('gym')
+
+from rl.world_models.model import EnsembleDynamicsModel, StandardScaler
+from rl.world_models.fake_world import FakeWorld
+
+
+OBS_DIM, ACT_DIM = 11, 3
+
+
+def fake_world():
+    T.manual_seed(0)
+    wm = EnsembleDynamicsModel(7, 5, OBS_DIM, ACT_DIM, 1, 32)
+    wm.scaler.fit(T.randn(1000, OBS_DIM+ACT_DIM))
+    return FakeWorld(wm, 'Hopper-v2')
+
+
+def test_sample_members_balanced():
+    world = fake_world()
+    for n in (1, 5, 12, 1003):
+        members = world.sample_members(n)
+        counts = T.bincount(members, minlength=5)
+        assert len(members) == n and members.max() < 5
+        assert counts.max() - counts.min() <= 1 # no padding in predict_particles
+
+
+def test_predict_particles_matches_elites():
+    # Row i is predicted by elite members[i] only, as the row of that elite in predict_elites
+    world = fake_world()
+    inputs = T.randn(257, OBS_DIM+ACT_DIM)
+    all_means, all_vars = world.model.predict_elites(inputs)
+    for members in (world.sample_members(257), T.randint(5, (257,)), T.full((257,), 3)): # balanced, ragged, one elite
+        means, vars = world.model.predict_particles(inputs, members)
+        assert T.allclose(means, all_means[members, T.arange(257)], atol=1e-5)
+        assert T.allclose(vars, all_vars[members, T.arange(257)], atol=1e-5)
+
+
+def test_step_ts1_tsinf():
+    world = fake_world()
+    O, A = T.randn(64, OBS_DIM), T.randn(64, ACT_DIM)
+    # TSinf: the rollout's members are used as given
+    members = world.sample_members(64)
+    _, _, _, info = world.step(O, A, deterministic=True, members=members)
+    assert info['members'] is members
+    means, _ = world.model.predict_particles(T.cat((O, A), -1), members)
+    assert T.allclose(info['mean'][:, 2:], means[:, 1:] + O, atol=1e-5)
+    assert T.allclose(info['mean'][:, :1], means[:, :1], atol=1e-5)
+    # Alive rows keep their members
+    alive = T.arange(64) % 3 > 0
+    _, _, _, info_alive = world.step(O[alive], A[alive], deterministic=True, members=members[alive])
+    assert T.allclose(info_alive['mean'], info['mean'][alive], atol=1e-5)
+    # TS1: new members at every step
+    draws = [world.step(O, A, deterministic=True)[3]['members'] for _ in range(2)]
+    assert not T.equal(*draws)
+
+
+def test_scaler_update_matches_fit():
+    data = T.randn(1000, 6) * T.arange(1, 7) + 3
+    running = StandardScaler()
+    for chunk in (data[:1], data[1:400], data[400:400], data[400:]): # first update fits, empty chunk ignored
+        running.update(chunk)
+    scaler = StandardScaler()
+    scaler.fit(data)
+    assert running.count == 1000
+    assert T.allclose(running.mu, scaler.mu, atol=1e-5)
+    assert T.allclose(running.std, scaler.std, atol=1e-5)
+    assert T.allclose(running.std, T.std(data, 0, keepdim=True), atol=1e-5)